@@ -1,6 +1,8 @@
-from rent_cars import app, db
+from rent_cars import create_app
+
+app = create_app()
 
 
 if __name__ == '__main__':
-    db.create_all()  # create sql tables
+    # the schema is created / upgraded beforehand with: flask db-upgrade
     app.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,5 @@
+import uvicorn
+from rent_cars.config import ASGI_WORKERS
+from rent_cars.utils.sessions import check_session_backend
+check_session_backend(ASGI_WORKERS)
+uvicorn.run('rent_cars.asgi:application', host='0.0.0.0', port=8080, workers=ASGI_WORKERS)
@@ -0,0 +1,160 @@
+"""
+Concurrent-connection throughput of the two serving modes: WSGI (waitress thread pool, waitress_server.py)
+and ASGI (uvicorn event loop with the async engine, asgi_server.py).
+
+Both servers are started on the configured database. For each level of concurrency, that many keep-alive
+connections log in and then loop on the hot endpoints (car listing, car details, own reservations,
+booking) for --duration seconds. Throughput and latencies are reported per mode and concurrency:
+
+    python -m benchmarks.asgi_vs_wsgi --concurrency 16 64 256 --waitress-threads 4
+"""
+import argparse
+import http.client
+import json
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.loadtest import PASSWORD, app, percentile, seed
+from rent_cars import db
+from rent_cars.migrations import upgrade
+
+
+def start_server(mode, port, waitress_threads):
+    if mode == 'wsgi':
+        command = [sys.executable, '-m', 'waitress', f'--threads={waitress_threads}', f'--port={port}', 'app:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'rent_cars.asgi:application', '--port', str(port),
+                   '--log-level', 'warning']
+    process = subprocess.Popen(command)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start on port {port}')
+
+
+class Connection:
+    def __init__(self, port, username, car_ids, deadline):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.username = username
+        self.car_ids = car_ids
+        self.deadline = deadline
+        self.cookie = None
+        self.latencies = []
+        self.errors = 0
+
+    def request(self, method, url, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        start = time.perf_counter()
+        self.connection.request(method, url, body=json.dumps(body) if body is not None else None, headers=headers)
+        res = self.connection.getresponse()
+        data = res.read()
+        self.latencies.append(time.perf_counter() - start)
+        self.errors += res.status >= 500
+
+        set_cookie = res.getheader('Set-Cookie')
+        if set_cookie:
+            self.cookie = set_cookie.split(';', 1)[0]
+        return res.status, json.loads(data or 'null')
+
+    def book(self):
+        start = datetime(2030, 1, 1) + timedelta(days=random.randint(0, 365))
+        self.request('POST', '/reservations', {
+            'car_id': random.choice(self.car_ids),
+            'reservation_start_date': start.strftime('%Y-%m-%d %H:%M'),
+            'reservation_end_date': (start + timedelta(days=3)).strftime('%Y-%m-%d %H:%M'),
+        })
+
+    def run(self):
+        self.request('POST', '/login', {'username': self.username, 'password': PASSWORD})
+        while time.monotonic() < self.deadline:
+            scenario = random.random()
+            if scenario < 0.4:
+                self.request('GET', f'/cars?limit=10&page={random.randint(1, 20)}')
+            elif scenario < 0.7:
+                self.request('GET', f'/cars/{random.choice(self.car_ids)}/car')
+            elif scenario < 0.95:
+                self.request('GET', '/reservations?limit=10')
+            else:
+                self.book()
+        self.connection.close()
+
+
+def run_level(port, usernames, car_ids, concurrency, duration):
+    deadline = time.monotonic() + duration
+    connections = [Connection(port, usernames[i % len(usernames)], car_ids, deadline) for i in range(concurrency)]
+    threads = [threading.Thread(target=connection.run) for connection in connections]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for connection in connections for latency in connection.latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(connection.errors for connection in connections),
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--cars', type=int, default=5000)
+    parser.add_argument('--reservations', type=int, default=50000, help='size of the reservation history')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--duration', type=float, default=15, help='seconds per mode and concurrency level')
+    parser.add_argument('--waitress-threads', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--random-seed', type=int, default=1)
+    parser.add_argument('--output', default='asgi_vs_wsgi.json')
+    args = parser.parse_args()
+
+    random.seed(args.random_seed)
+    app.app_context().push()
+    upgrade(db.engine)
+    usernames, car_ids = seed(args.users, args.cars, args.reservations)
+
+    results = {}
+    for mode in ('wsgi', 'asgi'):
+        process = start_server(mode, args.port, args.waitress_threads)
+        try:
+            for concurrency in args.concurrency:
+                results.setdefault(mode, {})[concurrency] = run_level(
+                    args.port, usernames, car_ids, concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f'{"connections":<14}{"mode":<8}{"requests":>10}{"errors":>8}{"req/s":>10}'
+          f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for concurrency in args.concurrency:
+        for mode in ('wsgi', 'asgi'):
+            data = results[mode][concurrency]
+            print(f'{concurrency:<14}{mode:<8}{data["requests"]:>10}{data["errors"]:>8}{data["throughput"]:>10.1f}'
+                  f'{data["p50"]:>10.2f}{data["p95"]:>10.2f}{data["p99"]:>10.2f}')
+
+    with open(args.output, 'w') as f:
+        json.dump({'date': datetime.utcnow().isoformat(), 'config': vars(args), 'results': results}, f, indent=2)
+    print(f'\nresults saved in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
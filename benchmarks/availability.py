@@ -0,0 +1,88 @@
+"""
+Latency of GET /cars/available as the reservation history grows.
+
+usage: python -m benchmarks.availability [number_of_cars] [number_of_reservations]
+The history is filled in steps up to number_of_reservations (cancelled reservations plus one
+active reservation for a car out of ten), the search is timed after each step.
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, Reservation, User
+
+app = create_app()
+
+STEPS = 4
+REPEAT = 20
+
+
+def seed_fleet(number_of_cars):
+    prefix = f'AV{int(time.time())}'
+    db.session.execute(Car.__table__.insert(), [
+        {'license_plate': f'{prefix}{i}', 'company': 'bench', 'model': 'bench', 'fabrication_year': '2020',
+         'number_of_seats': 4, 'is_available': True}
+        for i in range(number_of_cars)
+    ])
+    user = User(username=prefix, email=f'{prefix}@rentcars.local', password='-')
+    db.session.add(user)
+    db.session.commit()
+    car_ids = [car_id for car_id, in db.session.query(Car.id).filter(Car.license_plate.like(f'{prefix}%'))]
+    return car_ids, user.id
+
+
+def seed_history(car_ids, user_id, number_of_reservations, offset):
+    origin = datetime(2020, 1, 1)
+    rows = []
+    for i in range(offset, offset + number_of_reservations):
+        start = origin + timedelta(hours=i)
+        rows.append({'car_id': car_ids[i % len(car_ids)], 'user_id': user_id, 'status': 'cancelled',
+                     'reservation_start_date': start, 'reservation_end_date': start + timedelta(days=2),
+                     'date_created': start})
+    for start in range(0, len(rows), 10000):
+        db.session.execute(Reservation.__table__.insert(), rows[start:start + 10000])
+    db.session.commit()
+
+
+def timed(client, url):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        res = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert res.status_code == 200, res.json
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    app.app_context().push()
+    upgrade(db.engine)
+    number_of_cars = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    number_of_reservations = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    car_ids, user_id = seed_fleet(number_of_cars)
+
+    # one active reservation for a car out of ten, one user per active reservation
+    for i, car_id in enumerate(car_ids[::10]):
+        user = User(username=f'av{user_id}_{i}', email=f'av{user_id}_{i}@rentcars.local', password='-')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Reservation(car_id=car_id, user_id=user.id, reservation_start_date=datetime(2030, 1, 1),
+                                   reservation_end_date=datetime(2030, 1, 8)))
+    db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    url = '/cars/available?start=2030-01-03 10:00&end=2030-01-04 10:00&pagination=cursor&limit=50'
+
+    step = number_of_reservations // STEPS
+    for i in range(STEPS):
+        seed_history(car_ids, user_id, step, i * step)
+        print(f'{(i + 1) * step:>8} reservations in history  median {timed(client, url):8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Fire parallel bookings of the same car and check that exactly one succeeds and the others
+get a clean 409 (no 500 caused by an IntegrityError).
+
+usage: python -m benchmarks.booking_stress [number_of_bookings] [number_of_threads]
+Works against the configured Postgres database, or a SQLite stand-in (where the unique
+constraints take over from the row lock).
+"""
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# the bookings are fired by a few users, the limits would only measure 429s
+os.environ.setdefault('RATE_LIMITING', 'off')
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, User
+
+app = create_app()
+
+
+def seed(number_of_users):
+    car = Car(license_plate=f'STRESS{int(time.time())}', company='stress', model='stress', fabrication_year='2020',
+              number_of_seats=4, is_available=True)
+    users = [User(username=f'stress{int(time.time())}_{i}', email=f'stress{int(time.time())}_{i}@rentcars.local',
+                  password='-') for i in range(number_of_users)]
+    db.session.add(car)
+    db.session.add_all(users)
+    db.session.commit()
+    return car.id, [user.id for user in users]
+
+
+def book(car_id, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    res = client.post('/reservations', json={
+        'car_id': car_id,
+        'reservation_start_date': '2030-01-01 10:00',
+        'reservation_end_date': '2030-01-05 10:00',
+    })
+    return res.status_code
+
+
+def main():
+    app.app_context().push()
+    upgrade(db.engine)
+    number_of_bookings = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    number_of_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    car_id, user_ids = seed(number_of_bookings)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(number_of_threads) as executor:
+        statuses = Counter(executor.map(lambda user_id: book(car_id, user_id), user_ids))
+    elapsed = time.perf_counter() - start
+
+    print(f'{number_of_bookings} bookings in {elapsed:.2f}s: {dict(statuses)}')
+    assert statuses[200] == 1, 'exactly one booking must succeed'
+    assert statuses[409] == number_of_bookings - 1, 'every other booking must get a 409'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Check that the cached listing of the base users (GET /cars) and car detail are never stale once a reservation
+is committed: a car is booked, the reservation cancelled, the car booked again and the reservation expired by
+the sweeper. Right after each commit, the next read must see the active reservations of the car as they are,
+while reader threads keep refilling the cache from the database concurrently.
+
+usage: python -m benchmarks.cache_staleness [--rounds 200] [--readers 4]
+The exit status is 1 when a stale listing or detail is served. The schema of the configured database is
+upgraded first.
+"""
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+# the rounds are run by a single user, the limits would only measure 429s
+os.environ.setdefault('RATE_LIMITING', 'off')
+# the cache is only enabled with the memory sessions (a single process)
+os.environ['SESSION_BACKEND'] = 'memory'
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, User
+from rent_cars.utils import expiry
+from rent_cars.utils.cache import cache
+
+app = create_app()
+
+# newest cars first: the seeded car is on the first page
+LISTING = '/cars?pagination=cursor&sort=-id&limit=10'
+DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def seed(number_of_users):
+    prefix = f'stale{int(time.time())}'
+    car = Car(license_plate=prefix[-15:], company='cache', model='cache', fabrication_year='2020',
+              number_of_seats=4, is_available=True)
+    users = [User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@rentcars.local', password='-')
+             for i in range(number_of_users)]
+    db.session.add(car)
+    db.session.add_all(users)
+    db.session.commit()
+    return car.id, [user.id for user in users]
+
+
+def logged_client(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client
+
+
+def active_reservations(car):
+    return [reservation['id'] for reservation in car['active_reservations']]
+
+
+def read(client, car_id):
+    """
+    (active reservations in the listing, active reservations in the detail) of the car
+    """
+    listed = [car for car in client.get(LISTING).json['data']['results'] if car['id'] == car_id]
+    detail = client.get(f'/cars/{car_id}/car').json['data']
+    return active_reservations(listed[0]) if listed else None, active_reservations(detail)
+
+
+def book(client, car_id, start, end):
+    res = client.post('/reservations', json={'car_id': car_id, 'reservation_start_date': start.strftime(DATE_FORMAT),
+                                             'reservation_end_date': end.strftime(DATE_FORMAT)})
+    assert res.status_code == 200, res.json
+    return res.json['data']['id']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+
+    app.app_context().push()
+    upgrade(db.engine)
+    car_id, user_ids = seed(args.readers + 1)
+    writer = logged_client(user_ids[0])
+
+    stop = threading.Event()
+
+    def keep_reading(user_id):
+        client = logged_client(user_id)
+        while not stop.is_set():
+            read(client, car_id)
+
+    readers = [threading.Thread(target=keep_reading, args=(user_id,)) for user_id in user_ids[1:]]
+    for reader in readers:
+        reader.start()
+
+    stale = []
+
+    def check(step, *expected):
+        if read(writer, car_id) != (list(expected), list(expected)):
+            stale.append(step)
+
+    start = time.perf_counter()
+    try:
+        for i in range(args.rounds):
+            now = datetime.utcnow().replace(second=0, microsecond=0)
+            reservation_id = book(writer, car_id, now + timedelta(days=1), now + timedelta(days=2))
+            check('booking', reservation_id)
+            assert writer.patch(f'/reservations/{reservation_id}/cancel').status_code == 200
+            check('cancel')
+
+            # already ended: completed by the next expiry round
+            reservation_id = book(writer, car_id, now - timedelta(days=2), now - timedelta(days=1))
+            check('booking', reservation_id)
+            expiry.sweep()
+            check('expiry')
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    elapsed = time.perf_counter() - start
+
+    stats = cache.stats()
+    print(f'{args.rounds} rounds of 4 commits in {elapsed:.2f}s, {args.readers} reader(s), '
+          f'cache hits {stats["hits"]} misses {stats["misses"]}')
+    print(f'stale reads: {len(stale)}' + (f' {sorted(set(stale))}' if stale else ''))
+    raise SystemExit(1 if stale else 0)
+
+
+if __name__ == '__main__':
+    main()
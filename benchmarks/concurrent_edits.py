@@ -0,0 +1,93 @@
+"""
+Concurrent edits of the same car by several admins: each edit reads the car (GET, ETag) and writes back
+its number of seats plus one (PATCH). With If-Match every lost race is answered 412 and retried, so no
+edit is lost: the car ends with one seat and one version per accepted edit. Without If-Match (--blind)
+the edits overwrite each other and the lost ones are reported.
+
+usage: python -m benchmarks.concurrent_edits [--edits 200] [--threads 8] [--blind]
+The exit status is 1 when an edit is lost with If-Match or a request fails (5xx).
+The schema of the configured database is upgraded first.
+"""
+import argparse
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# the edits are fired by a few admins, the limits would only measure 429s
+os.environ.setdefault('RATE_LIMITING', 'off')
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, User
+
+app = create_app()
+
+
+def seed(number_of_admins):
+    car = Car(license_plate=f'EDIT{int(time.time())}', company='edits', model='edits', fabrication_year='2020',
+              number_of_seats=0, is_available=False)
+    admins = [User(username=f'edit{int(time.time())}_{i}', email=f'edit{int(time.time())}_{i}@rentcars.local',
+                   password='-', is_admin=True) for i in range(number_of_admins)]
+    db.session.add(car)
+    db.session.add_all(admins)
+    db.session.commit()
+    return car.id, [admin.id for admin in admins]
+
+
+def edit(car_id, admin_id, blind):
+    """
+    add a seat to the car, returns the statuses of the attempts
+    """
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = admin_id
+    statuses = []
+    while True:
+        res = client.get(f'/cars/{car_id}/car')
+        headers = {} if blind else {'If-Match': res.headers['ETag']}
+        res = client.patch(f'/cars/{car_id}/car', json={'number_of_seats': res.json['data']['number_of_seats'] + 1},
+                           headers=headers)
+        statuses.append(res.status_code)
+        if res.status_code != 412:
+            return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edits', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--blind', action='store_true', help='edit without If-Match')
+    args = parser.parse_args()
+
+    app.app_context().push()
+    upgrade(db.engine)
+    car_id, admin_ids = seed(args.threads)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        attempts = list(executor.map(lambda i: edit(car_id, admin_ids[i % len(admin_ids)], args.blind),
+                                     range(args.edits)))
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for statuses in attempts for status in statuses)
+    accepted = statuses[200]
+    db.session.remove()
+    car = db.session.get(Car, car_id)
+    lost = accepted - car.number_of_seats
+    print(f'{args.edits} edits {"without" if args.blind else "with"} If-Match in {elapsed:.2f}s, '
+          f'{args.threads} threads: {dict(statuses)}')
+    print(f'accepted {accepted}, seats {car.number_of_seats}, version {car.version}, lost {lost}')
+
+    errors = []
+    if any(status >= 500 for status in statuses):
+        errors.append('some requests failed')
+    if not args.blind and (lost or car.version != accepted + 1):
+        errors.append('edits were lost despite If-Match')
+    for error in errors:
+        print(f'FAILED {error}')
+    raise SystemExit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
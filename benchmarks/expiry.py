@@ -0,0 +1,142 @@
+"""
+Duration of the reservation expiry batches against a large history: --history past reservations
+(cancelled or completed) and --expired active reservations past their end date are seeded, then
+expired by sweep() rounds run from --workers threads at once.
+
+    python -m benchmarks.expiry --history 5000000 --expired 20000 --workers 4
+
+The batch duration must not grow with the history (the batches read the partial index of the active
+reservation ends). Every expired reservation must be expired once, whatever the number of workers: none
+is left active and exactly one outbox event is published per reservation.
+The exit status is 1 when a check fails. The schema of the configured database is upgraded first.
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, OutboxEvent, Reservation, User
+from rent_cars.utils import expiry
+
+app = create_app()
+
+
+def seed(number_of_history, number_of_expired):
+    """
+    returns the ids of the cars of the expired reservations
+    """
+    prefix = f'ex{int(time.time())}'
+    now = datetime.utcnow()
+    for start in range(0, number_of_expired, 10000):
+        end = min(start + 10000, number_of_expired)
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'{prefix}_{i}', 'email': f'{prefix}_{i}@rentcars.local', 'password': '-',
+             'date_created': now, 'date_last_update': now}
+            for i in range(start, end)
+        ])
+        db.session.execute(Car.__table__.insert(), [
+            {'license_plate': f'{prefix[-8:]}{i}', 'company': 'expiry', 'model': 'expiry', 'fabrication_year': '2020',
+             'number_of_seats': 4, 'is_available': True, 'date_last_update': now}
+            for i in range(start, end)
+        ])
+    db.session.commit()
+    user_ids = [user_id for user_id, in db.session.query(User.id).filter(User.username.like(f'{prefix}%'))]
+    car_ids = [car_id for car_id, in db.session.query(Car.id).filter(Car.license_plate.like(f'{prefix[-8:]}%'))]
+
+    origin = datetime(2015, 1, 1)
+    for start in range(0, number_of_history, 10000):
+        rows = []
+        for i in range(start, min(start + 10000, number_of_history)):
+            reservation_start = origin + timedelta(minutes=i)
+            rows.append({'car_id': random.choice(car_ids), 'user_id': random.choice(user_ids),
+                         'status': random.choice(('cancelled', 'completed')),
+                         'reservation_start_date': reservation_start,
+                         'reservation_end_date': reservation_start + timedelta(days=2),
+                         'date_created': reservation_start})
+        db.session.execute(Reservation.__table__.insert(), rows)
+        db.session.commit()
+
+    db.session.execute(Reservation.__table__.insert(), [
+        {'car_id': car_id, 'user_id': user_id, 'status': 'reserved',
+         'reservation_start_date': now - timedelta(days=3), 'reservation_end_date': now - timedelta(minutes=i % 1440),
+         'date_created': now - timedelta(days=4)}
+        for i, (car_id, user_id) in enumerate(zip(car_ids, user_ids))
+    ])
+    db.session.commit()
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('ANALYZE')
+    return car_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', type=int, default=200000)
+    parser.add_argument('--expired', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=expiry.RESERVATION_SWEEP_BATCH_SIZE)
+    args = parser.parse_args()
+
+    app.app_context().push()
+    upgrade(db.engine)
+    car_ids = seed(args.history, args.expired)
+    db.session.query(OutboxEvent).filter_by(topic='reservation.expired').delete()
+    db.session.commit()
+
+    batches, rounds = [], []
+    observe = expiry.SWEEP_BATCH_DURATION.observe
+    lock = threading.Lock()
+
+    def record_batch(duration):
+        with lock:
+            batches.append(duration)
+        observe(duration)
+
+    def work():
+        with app.app_context():
+            while True:
+                start = time.perf_counter()
+                expired = expiry.sweep(batch_size=args.batch_size)
+                with lock:
+                    rounds.append(time.perf_counter() - start)
+                if not expired:
+                    return
+
+    expiry.SWEEP_BATCH_DURATION.observe = record_batch
+    workers = [threading.Thread(target=work) for _ in range(args.workers)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    expiry.SWEEP_BATCH_DURATION.observe = observe
+
+    batches.sort()
+    print(f'{args.expired} reservations expired in {elapsed:.2f}s by {args.workers} worker(s), '
+          f'history of {args.history} reservations')
+    print(f'batches of {args.batch_size}: {len(batches)}, p50 {statistics.median(batches) * 1000:.1f} ms, '
+          f'p95 {batches[int(len(batches) * 0.95)] * 1000:.1f} ms, max {batches[-1] * 1000:.1f} ms')
+    print(f'rounds: {len(rounds)}, max {max(rounds) * 1000:.1f} ms, '
+          f'lag after the last one {expiry._last_round["lag"]:.0f}s')
+
+    errors = []
+    active = db.session.query(func.count()).select_from(Reservation).filter(
+        Reservation.car_id.in_(car_ids), Reservation.status == expiry.RESERVED).scalar()
+    events = db.session.query(func.count()).select_from(OutboxEvent).filter_by(topic='reservation.expired').scalar()
+    if active:
+        errors.append(f'{active} reservation(s) still active')
+    if events != args.expired:
+        errors.append(f'{events} expiry events for {args.expired} reservations')
+    for error in errors:
+        print(f'FAILED {error}')
+    raise SystemExit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
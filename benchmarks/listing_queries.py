@@ -0,0 +1,84 @@
+"""
+Check that the listings of the users and cars run a fixed number of queries whatever the page size, in page
+and cursor modes: a relationship loaded row by row (N+1) makes the count grow with the page.
+
+usage: python -m benchmarks.listing_queries
+The listings are requested by an admin after a first request, so the principal and the collection
+validators are cached: only the queries of the page are counted. The exit status is 1 when a count
+differs from QUERIES. The schema of the configured database is upgraded first.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# the counts are the ones of the listings, not of the session store
+os.environ['SESSION_BACKEND'] = 'memory'
+
+from rent_cars import create_app, db
+from rent_cars.config import MAX_ROWS_PER_PAGE
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, License, Location, Reservation, User
+from rent_cars.utils.queries import assert_num_queries
+
+app = create_app()
+
+# (page mode, cursor mode): the page and its total count, the relationships loaded by IN batches
+QUERIES = {
+    '/users': (4, 3),  # users, licenses, active reservations
+    '/cars': (3, 2),  # cars with their location joined in the same SELECT, active reservations
+}
+PAGE_SIZES = (1, 10, MAX_ROWS_PER_PAGE)
+
+
+def seed(number_of_rows):
+    """
+    users with a license and cars with a location, one out of two with an active reservation
+    """
+    prefix = f'lq{int(time.time())}'
+    now = datetime.utcnow()
+    for i in range(number_of_rows):
+        user = User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@rentcars.local', password='-',
+                    licenses=License(license_number=f'{prefix[-6:]}{i:06}', date_issued=now,
+                                     date_expiry=now + timedelta(days=365)))
+        car = Car(license_plate=f'{prefix[-8:]}{i}', company='queries', model='queries', fabrication_year='2020',
+                  number_of_seats=4, is_available=bool(i % 2), current_location=Location(latitude=48.8, longitude=2.3))
+        db.session.add_all([user, car])
+        if not i % 2:
+            db.session.add(Reservation(car=car, user=user, reservation_start_date=now + timedelta(days=1),
+                                       reservation_end_date=now + timedelta(days=2)))
+    admin = User(username=f'{prefix}_admin', email=f'{prefix}_admin@rentcars.local', password='-', is_admin=True)
+    db.session.add(admin)
+    db.session.commit()
+    return admin.id
+
+
+def main():
+    app.app_context().push()
+    upgrade(db.engine)
+    admin_id = seed(MAX_ROWS_PER_PAGE)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = admin_id
+
+    failures = []
+    for path, expected_counts in QUERIES.items():
+        for mode, expected in zip(('page', 'cursor'), expected_counts):
+            for limit in PAGE_SIZES:
+                url = f'{path}?limit={limit}' + ('&pagination=cursor' if mode == 'cursor' else '')
+                assert client.get(url).status_code == 200
+                try:
+                    with assert_num_queries(expected) as counter:
+                        res = client.get(url)
+                except AssertionError as e:
+                    failures.append(url)
+                    print(f'FAILED {url}: {e}', file=sys.stderr)
+                    continue
+                print(f'{url:<40} {len(res.json["data"]["results"]):>4} rows {counter.count:>3} queries')
+
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""
+Reproducible load test of the HTTP API.
+
+The configured database is seeded with users, cars, locations and reservation history,
+then a realistic mix of scenarios (login, car listings / details, booking + cancellation,
+own reservations, admin listings) is driven by concurrent virtual users against the app,
+through the Flask test client and / or a real waitress server.
+Throughput and p50 / p95 / p99 latencies are reported per scenario and saved as JSON with the
+current commit, so runs can be compared across commits:
+
+    python -m benchmarks.loadtest --mode both --duration 30 --output before.json
+    python -m benchmarks.loadtest --mode both --duration 30 --output after.json
+    python -m benchmarks.loadtest --compare before.json after.json
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+# the virtual users share one address, the limits would only measure 429s
+os.environ.setdefault('RATE_LIMITING', 'off')
+
+from waitress.server import create_server
+from werkzeug.security import generate_password_hash
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, Location, Reservation, User
+
+app = create_app()
+
+PASSWORD = 'bench-password'
+
+# scenario: weight
+MIX = {
+    'list_cars': 40,
+    'get_car': 15,
+    'search_available_cars': 5,
+    'book_and_cancel': 10,
+    'list_reservations': 15,
+    'login': 5,
+    'admin_list_users': 5,
+    'admin_list_reservations': 5,
+}
+
+
+def seed(number_of_users, number_of_cars, number_of_reservations):
+    """
+    returns the usernames of the seeded users (the first one is an admin) and the seeded car ids
+    """
+    prefix = f'lt{int(time.time())}'
+    plate_prefix = f'L{int(time.time()) % 100000}'
+    password_hash = generate_password_hash(PASSWORD)
+
+    usernames = [f'{prefix}_{i}' for i in range(number_of_users)]
+    db.session.execute(User.__table__.insert(), [
+        {'username': username, 'email': f'{username}@rentcars.local', 'password': password_hash,
+         'is_admin': i == 0, 'date_created': datetime.utcnow()}
+        for i, username in enumerate(usernames)
+    ])
+    for start in range(0, number_of_cars, 10000):
+        db.session.execute(Car.__table__.insert(), [
+            {'license_plate': f'{plate_prefix}{i}', 'company': 'bench', 'model': f'model{i % 20}',
+             'fabrication_year': '2020', 'number_of_seats': 2 + i % 6, 'is_available': True}
+            for i in range(start, min(start + 10000, number_of_cars))
+        ])
+    db.session.commit()
+
+    car_ids = [car_id for car_id, in db.session.query(Car.id).filter(Car.license_plate.like(f'{plate_prefix}%'))]
+    user_ids = [user_id for user_id, in db.session.query(User.id).filter(User.username.like(f'{prefix}%'))]
+    db.session.execute(Location.__table__.insert(), [
+        {'car_id': car_id, 'latitude': 48.85 + random.uniform(-0.2, 0.2),
+         'longitude': 2.35 + random.uniform(-0.2, 0.2)}
+        for car_id in car_ids
+    ])
+
+    # cancelled history, it does not block any car
+    origin = datetime(2020, 1, 1)
+    for start in range(0, number_of_reservations, 10000):
+        rows = []
+        for i in range(start, min(start + 10000, number_of_reservations)):
+            reservation_start = origin + timedelta(hours=i)
+            rows.append({'car_id': random.choice(car_ids), 'user_id': random.choice(user_ids), 'status': 'cancelled',
+                         'reservation_start_date': reservation_start,
+                         'reservation_end_date': reservation_start + timedelta(days=2),
+                         'date_created': reservation_start})
+        db.session.execute(Reservation.__table__.insert(), rows)
+    db.session.commit()
+
+    return usernames, car_ids
+
+
+class TestClientDriver:
+    name = 'test-client'
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, url, body=None):
+        res = self.client.open(url, method=method, json=body)
+        return res.status_code, res.json
+
+
+class HttpDriver:
+    name = 'waitress'
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, url, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + url, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            with self.opener.open(req) as res:
+                return res.status, json.loads(res.read() or 'null')
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+class VirtualUser:
+    def __init__(self, driver, username, car_ids, is_admin, deadline):
+        self.driver = driver
+        self.username = username
+        self.car_ids = car_ids
+        self.is_admin = is_admin
+        self.deadline = deadline
+        self.samples = []
+
+    def timed(self, scenario, method, url, body=None):
+        start = time.perf_counter()
+        status, data = self.driver.request(method, url, body)
+        self.samples.append((scenario, time.perf_counter() - start, status < 500))
+        return status, data
+
+    def login(self):
+        return self.timed('login', 'POST', '/login', {'username': self.username, 'password': PASSWORD})
+
+    def book_and_cancel(self):
+        car_id = random.choice(self.car_ids)
+        start = datetime(2030, 1, 1) + timedelta(days=random.randint(0, 365))
+        status, data = self.timed('book_and_cancel', 'POST', '/reservations', {
+            'car_id': car_id,
+            'reservation_start_date': start.strftime('%Y-%m-%d %H:%M'),
+            'reservation_end_date': (start + timedelta(days=3)).strftime('%Y-%m-%d %H:%M'),
+        })
+        if status == 200:
+            self.timed('cancel', 'PATCH', f"/reservations/{data['data']['id']}/cancel")
+
+    def run(self):
+        self.login()
+        scenarios = [scenario for scenario in MIX if self.is_admin or not scenario.startswith('admin')]
+        weights = [MIX[scenario] for scenario in scenarios]
+        while time.monotonic() < self.deadline:
+            scenario = random.choices(scenarios, weights)[0]
+            if scenario == 'login':
+                self.login()
+            elif scenario == 'book_and_cancel':
+                self.book_and_cancel()
+            elif scenario == 'list_cars':
+                self.timed(scenario, 'GET', f'/cars?limit=10&page={random.randint(1, 20)}')
+            elif scenario == 'get_car':
+                self.timed(scenario, 'GET', f'/cars/{random.choice(self.car_ids)}/car')
+            elif scenario == 'search_available_cars':
+                self.timed(scenario, 'GET', '/cars/available?start=2030-06-01%2010:00&end=2030-06-03%2010:00&limit=10')
+            elif scenario == 'list_reservations':
+                self.timed(scenario, 'GET', '/reservations?limit=10')
+            elif scenario == 'admin_list_users':
+                self.timed(scenario, 'GET', f'/users?limit=20&page={random.randint(1, 5)}')
+            elif scenario == 'admin_list_reservations':
+                self.timed(scenario, 'GET', '/reservations?pagination=cursor&limit=20')
+
+
+def percentile(sorted_values, rank):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * rank))]
+
+
+def summarize(samples, elapsed):
+    scenarios = {}
+    for scenario, latency, ok in samples:
+        scenarios.setdefault(scenario, {'latencies': [], 'errors': 0})
+        scenarios[scenario]['latencies'].append(latency)
+        scenarios[scenario]['errors'] += not ok
+
+    summary = {}
+    for scenario, data in sorted(scenarios.items()):
+        latencies = sorted(data['latencies'])
+        summary[scenario] = {
+            'requests': len(latencies),
+            'errors': data['errors'],
+            'throughput': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+        }
+    summary['total'] = {'requests': len(samples), 'throughput': len(samples) / elapsed}
+    return summary
+
+
+def run_mix(make_driver, usernames, car_ids, workers, duration):
+    deadline = time.monotonic() + duration
+    virtual_users = [
+        VirtualUser(make_driver(), usernames[i % len(usernames)], car_ids, i % len(usernames) == 0, deadline)
+        for i in range(workers)
+    ]
+    threads = [threading.Thread(target=virtual_user.run) for virtual_user in virtual_users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return summarize([sample for virtual_user in virtual_users for sample in virtual_user.samples], elapsed)
+
+
+def run_waitress(usernames, car_ids, workers, duration, threads):
+    server = create_server(app, host='127.0.0.1', port=0, threads=threads)
+    server_thread = threading.Thread(target=server.run, daemon=True)
+    server_thread.start()
+    try:
+        base_url = f'http://127.0.0.1:{server.effective_port}'
+        return run_mix(lambda: HttpDriver(base_url), usernames, car_ids, workers, duration)
+    finally:
+        # let the worker threads finish the last responses before closing the sockets
+        server.task_dispatcher.shutdown()
+        server.close()
+
+
+def print_summary(mode, summary):
+    print(f'\n{mode}: {summary["total"]["requests"]} requests, {summary["total"]["throughput"]:.1f} req/s')
+    print(f'{"scenario":<26}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for scenario, data in summary.items():
+        if scenario == 'total':
+            continue
+        print(f'{scenario:<26}{data["requests"]:>10}{data["errors"]:>8}{data["throughput"]:>10.1f}'
+              f'{data["p50"]:>10.2f}{data["p95"]:>10.2f}{data["p99"]:>10.2f}')
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print(f'{before["commit"]} -> {after["commit"]}')
+    for mode in after['results']:
+        if mode not in before['results']:
+            continue
+        print(f'\n{mode}')
+        print(f'{"scenario":<26}{"req/s":>18}{"p95 ms":>22}')
+        for scenario, data in after['results'][mode].items():
+            previous = before['results'][mode].get(scenario)
+            if not previous or scenario == 'total':
+                continue
+            print(f'{scenario:<26}{previous["throughput"]:>8.1f} -> {data["throughput"]:<8.1f}'
+                  f'{previous["p95"]:>10.2f} -> {data["p95"]:<8.2f}')
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--cars', type=int, default=5000)
+    parser.add_argument('--reservations', type=int, default=50000, help='size of the reservation history')
+    parser.add_argument('--workers', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per mode')
+    parser.add_argument('--mode', choices=['test-client', 'waitress', 'both'], default='both')
+    parser.add_argument('--waitress-threads', type=int, default=4)
+    parser.add_argument('--random-seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    random.seed(args.random_seed)
+    app.app_context().push()
+    upgrade(db.engine)
+    usernames, car_ids = seed(args.users, args.cars, args.reservations)
+
+    results = {}
+    if args.mode in ('test-client', 'both'):
+        results['test-client'] = run_mix(TestClientDriver, usernames, car_ids, args.workers, args.duration)
+        print_summary('test-client', results['test-client'])
+    if args.mode in ('waitress', 'both'):
+        results['waitress'] = run_waitress(usernames, car_ids, args.workers, args.duration, args.waitress_threads)
+        print_summary('waitress', results['waitress'])
+
+    with open(args.output, 'w') as f:
+        json.dump({'commit': current_commit(), 'date': datetime.utcnow().isoformat(), 'config': vars(args),
+                   'results': results}, f, indent=2)
+    print(f'\nresults saved in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
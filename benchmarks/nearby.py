@@ -0,0 +1,79 @@
+"""
+Latency of GET /cars/nearby with a fleet of 100k cars spread over a metropolitan area,
+and of the bulk location ingest (POST /cars/locations) for the whole fleet.
+
+usage: python -m benchmarks.nearby [number_of_cars]
+"""
+import random
+import sys
+import time
+
+from werkzeug.security import generate_password_hash
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, User
+
+app = create_app()
+
+CENTER = (48.8566, 2.3522)
+SPREAD = 0.5  # degrees around the center
+BATCH = 5000
+REPEAT = 20
+
+
+def seed(number_of_cars):
+    prefix = f'NB{int(time.time())}'
+    for start in range(0, number_of_cars, 10000):
+        db.session.execute(Car.__table__.insert(), [
+            {'license_plate': f'{prefix}{i}', 'company': 'bench', 'model': 'bench', 'fabrication_year': '2020',
+             'number_of_seats': 4, 'is_available': i % 3 != 0}
+            for i in range(start, min(start + 10000, number_of_cars))
+        ])
+    admin = User(username=prefix, email=f'{prefix}@rentcars.local', password=generate_password_hash('bench'),
+                 is_admin=True)
+    db.session.add(admin)
+    db.session.commit()
+    car_ids = [car_id for car_id, in db.session.query(Car.id).filter(Car.license_plate.like(f'{prefix}%'))]
+    return car_ids, admin.username
+
+
+def random_location(car_id):
+    return {'car_id': car_id, 'latitude': CENTER[0] + random.uniform(-SPREAD, SPREAD),
+            'longitude': CENTER[1] + random.uniform(-SPREAD, SPREAD)}
+
+
+def timed(client, url):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        res = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert res.status_code == 200, res.json
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    app.app_context().push()
+    upgrade(db.engine)
+    number_of_cars = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    car_ids, username = seed(number_of_cars)
+
+    client = app.test_client()
+    client.post('/login', json={'username': username, 'password': 'bench'})
+
+    start = time.perf_counter()
+    for batch in range(0, len(car_ids), BATCH):
+        res = client.post('/cars/locations', json={'locations': [random_location(car_id)
+                                                                 for car_id in car_ids[batch:batch + BATCH]]})
+        assert res.status_code == 200, res.json
+    print(f'ingest of {len(car_ids)} locations in batches of {BATCH}: {time.perf_counter() - start:.2f} s')
+
+    for radius in (0.5, 2, 10):
+        url = f'/cars/nearby?lat={CENTER[0]}&lon={CENTER[1]}&radius={radius}&limit=10'
+        print(f'nearby search, radius {radius:>4} km  median {timed(client, url):8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
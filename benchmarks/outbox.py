@@ -0,0 +1,104 @@
+"""
+Throughput of the outbox drain loop: --events events are inserted in the outbox, then drained by
+utils.outbox.drain from 1 to --concurrency threads, for each batch size. The handler of the benchmark
+topic records the deliveries and sleeps --handler-ms to stand for a remote call.
+
+    python -m benchmarks.outbox --events 20000 --concurrency 8 --batch-sizes 10,100,500 --handler-ms 1
+
+Every event must be delivered, duplicates (allowed by the at least once delivery, expected without
+SKIP LOCKED, e.g. on sqlite) are reported. Run it on a database whose outbox has no other events:
+they would be delivered to their handlers as well. The schema of the configured database is upgraded first.
+"""
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import OutboxEvent
+from rent_cars.utils.outbox import HANDLERS, drain
+
+app = create_app()
+
+TOPIC = 'benchmark'
+
+
+def fill(number_of_events):
+    now = datetime.utcnow()
+    for start in range(0, number_of_events, 10000):
+        db.session.execute(OutboxEvent.__table__.insert(), [
+            {'topic': TOPIC, 'payload': json.dumps({'id': i}), 'created_at': now, 'available_at': now, 'attempts': 0}
+            for i in range(start, min(start + 10000, number_of_events))
+        ])
+    db.session.commit()
+
+
+def run(number_of_events, threads, batch_size, handler_ms):
+    deliveries = Counter()
+    lock = threading.Lock()
+
+    def handle(topic, payload):
+        if handler_ms:
+            time.sleep(handler_ms / 1000)
+        with lock:
+            deliveries[payload['id']] += 1
+
+    HANDLERS[TOPIC] = [handle]
+    fill(number_of_events)
+    batches = []
+
+    def work():
+        with app.app_context():
+            while True:
+                start = time.perf_counter()
+                delivered, failed = drain(batch_size)
+                if not delivered + failed:
+                    return
+                batches.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'events_per_second': len(deliveries) / elapsed,
+        'batch_ms': sorted(batches)[len(batches) // 2] * 1000 if batches else 0,
+        'missing': number_of_events - len(deliveries),
+        'duplicates': sum(deliveries.values()) - len(deliveries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=8, help='highest number of threads')
+    parser.add_argument('--batch-sizes', default='10,100,500')
+    parser.add_argument('--handler-ms', type=float, default=0, help='duration of the handler of an event')
+    args = parser.parse_args()
+
+    app.app_context().push()
+    upgrade(db.engine)
+
+    thread_counts = sorted({1, 2, 4, args.concurrency} & set(range(1, args.concurrency + 1)))
+    print(f'{"threads":>8}{"batch":>7}{"events/s":>11}{"batch p50 ms":>14}{"missing":>9}{"duplicates":>12}')
+    failed = False
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        for threads in thread_counts:
+            result = run(args.events, threads, batch_size, args.handler_ms)
+            failed = failed or bool(result['missing'])
+            print(f'{threads:>8}{batch_size:>7}{result["events_per_second"]:>11.0f}{result["batch_ms"]:>14.1f}'
+                  f'{result["missing"]:>9}{result["duplicates"]:>12}')
+    if failed:
+        print('FAILED events were not delivered')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
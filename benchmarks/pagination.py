@@ -0,0 +1,71 @@
+"""
+Compare latency of the first and a deep page of GET /cars in page (OFFSET) and cursor (keyset) modes.
+
+usage: python -m benchmarks.pagination [number_of_cars]
+The database configured in rent_cars/config.py is used, the car table is filled up to number_of_cars rows.
+"""
+import sys
+import time
+
+from werkzeug.security import generate_password_hash
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, User
+from rent_cars.utils.core import encode_cursor
+
+app = create_app()
+
+LIMIT = 10
+DEEP_PAGE = 10000
+REPEAT = 20
+
+
+def seed(number_of_cars):
+    if not User.query.filter_by(username='bench_admin').first():
+        db.session.add(User(username='bench_admin', email='bench_admin@rentcars.local',
+                            password=generate_password_hash('bench'), is_admin=True))
+    existing = Car.query.count()
+    rows = [
+        {'license_plate': f'BENCH{i:09}', 'company': 'bench', 'model': 'bench', 'fabrication_year': '2020',
+         'number_of_seats': 4, 'is_available': True}
+        for i in range(existing, number_of_cars)
+    ]
+    for start in range(0, len(rows), 10000):
+        db.session.execute(Car.__table__.insert(), rows[start:start + 10000])
+    db.session.commit()
+
+
+def timed(client, url):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        res = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert res.status_code == 200, res.json
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    app.app_context().push()
+    upgrade(db.engine)
+    number_of_cars = int(sys.argv[1]) if len(sys.argv) > 1 else LIMIT * (DEEP_PAGE + 1)
+    seed(number_of_cars)
+
+    client = app.test_client()
+    client.post('/login', json={'username': 'bench_admin', 'password': 'bench'})
+
+    last_id = db.session.query(Car.id).order_by(Car.id).offset(LIMIT * (DEEP_PAGE - 1) - 1).limit(1).scalar()
+    cases = {
+        'page mode, page 1': f'/cars?page=1&limit={LIMIT}',
+        f'page mode, page {DEEP_PAGE}': f'/cars?page={DEEP_PAGE}&limit={LIMIT}',
+        'cursor mode, page 1': f'/cars?pagination=cursor&limit={LIMIT}',
+        f'cursor mode, page {DEEP_PAGE}': f'/cars?after={encode_cursor([last_id])}&limit={LIMIT}',
+    }
+    for name, url in cases.items():
+        print(f'{name:<28} median {timed(client, url):8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Query plan regression check of the hot routes: each scenario is requested through the test client,
+its SELECT statements are recorded and EXPLAINed against the configured database, seeded first with
+a realistic shape (few available cars, a long cancelled history, one active reservation per user).
+
+A scenario fails when a statement reads a table of more than --min-rows rows with a sequential scan,
+unless the table is listed in its full_scans (e.g. the total count of an admin listing has to read it all):
+
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --cars 50000 --reservations 500000 --verbose
+
+Postgres is the reference (EXPLAIN (FORMAT JSON)), SQLite is checked with EXPLAIN QUERY PLAN.
+The exit status is 1 when a check fails. The schema of the configured database is upgraded first.
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, select
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+from rent_cars.models import Car, Location, Reservation, User
+from rent_cars.utils.cache import AVAILABLE_CARS, cache, car_namespace, principal_namespace
+
+app = create_app()
+
+# name: (user, url, tables read entirely on purpose)
+SCENARIOS = {
+    'cars.list': ('user', '/cars?limit=10&page=3', ()),
+    'cars.list.cursor': ('user', '/cars?pagination=cursor&limit=10&sort=-id', ()),
+    'cars.detail': ('user', '/cars/{car_id}/car', ()),
+    # every car without an overlapping reservation is counted
+    'cars.available': ('user', '/cars/available?start=2031-03-01%2010:00&end=2031-03-04%2010:00&limit=10', ('car',)),
+    'reservations.list': ('user', '/reservations?limit=10', ()),
+    'reservations.list.cursor': ('user', '/reservations?pagination=cursor&limit=10&sort=-date_created', ()),
+    'reservations.admin.cursor': ('admin', '/reservations?pagination=cursor&limit=20', ()),
+}
+
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+
+
+def seed(number_of_cars, number_of_users, number_of_reservations, available_ratio):
+    """
+    returns the ids of an admin, of a user with a reservation history and of a car
+    """
+    prefix = f'qp{int(time.time())}'
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'{prefix}_{i}', 'email': f'{prefix}_{i}@rentcars.local', 'password': '-',
+         'is_admin': i == 0, 'date_created': datetime.utcnow(), 'date_last_update': datetime.utcnow()}
+        for i in range(number_of_users)
+    ])
+    for start in range(0, number_of_cars, 10000):
+        db.session.execute(Car.__table__.insert(), [
+            {'license_plate': f'{prefix[-8:]}{i}', 'company': 'plans', 'model': f'model{i % 20}',
+             'fabrication_year': '2020', 'number_of_seats': 2 + i % 6,
+             'is_available': random.random() < available_ratio, 'date_last_update': datetime.utcnow()}
+            for i in range(start, min(start + 10000, number_of_cars))
+        ])
+    db.session.commit()
+
+    user_ids = [user_id for user_id, in db.session.query(User.id).filter(User.username.like(f'{prefix}%'))]
+    car_ids = [car_id for car_id, in db.session.query(Car.id).filter(Car.license_plate.like(f'{prefix[-8:]}%'))]
+    db.session.execute(Location.__table__.insert(), [
+        {'car_id': car_id, 'latitude': 48.85 + random.uniform(-0.2, 0.2), 'longitude': 2.35 + random.uniform(-0.2, 0.2)}
+        for car_id in car_ids
+    ])
+
+    origin = datetime(2020, 1, 1)
+    for start in range(0, number_of_reservations, 10000):
+        rows = []
+        for i in range(start, min(start + 10000, number_of_reservations)):
+            reservation_start = origin + timedelta(minutes=30 * i)
+            rows.append({'car_id': random.choice(car_ids), 'user_id': random.choice(user_ids), 'status': 'cancelled',
+                         'reservation_start_date': reservation_start,
+                         'reservation_end_date': reservation_start + timedelta(days=2),
+                         'date_created': reservation_start})
+        db.session.execute(Reservation.__table__.insert(), rows)
+
+    # one upcoming reservation per user, on distinct cars
+    upcoming = datetime(2031, 1, 1)
+    db.session.execute(Reservation.__table__.insert(), [
+        {'car_id': car_id, 'user_id': user_id, 'status': 'reserved',
+         'reservation_start_date': upcoming + timedelta(hours=i),
+         'reservation_end_date': upcoming + timedelta(days=1 + i % 90), 'date_created': datetime.utcnow()}
+        for i, (user_id, car_id) in enumerate(zip(user_ids, car_ids))
+    ])
+    db.session.commit()
+
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('ANALYZE')
+    return user_ids[0], user_ids[1], car_ids[0]
+
+
+def record_statements(url, user_id):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    cache.invalidate(AVAILABLE_CARS, principal_namespace(user_id))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        res = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    if res.status_code != 200:
+        raise RuntimeError(f'GET {url}: {res.status_code} {res.get_data(as_text=True)}')
+    return statements
+
+
+def postgres_scans(connection, statement, parameters):
+    plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters).scalar()
+    nodes, scans = [plan[0]['Plan']], []
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            scans.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', ()))
+    return scans, plan
+
+
+def sqlite_scans(connection, statement, parameters):
+    plan = [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+    scans = []
+    for detail in plan:
+        match = SQLITE_SCAN.match(detail)
+        if not match or 'USING' in match.group(2):
+            continue
+        table = match.group(1)
+        # the table is stored in the order of its id: a scan sorted on it stops after LIMIT rows
+        in_id_order = (re.search(rf'ORDER BY {table}\.id (ASC|DESC)\s+LIMIT', statement)
+                       and not any('TEMP B-TREE' in step for step in plan))
+        if not in_id_order:
+            scans.append(table)
+    return scans, plan
+
+
+def check(scenarios, min_rows, verbose):
+    tables = db.Model.metadata.tables
+    explain = postgres_scans if db.engine.dialect.name == 'postgresql' else sqlite_scans
+    sizes = {}
+    errors = []
+    with db.engine.connect() as connection:
+        for name, (statements, full_scans) in scenarios.items():
+            for statement, parameters in statements:
+                scans, plan = explain(connection, statement, parameters)
+                for table in scans:
+                    if table not in tables or table in full_scans:
+                        continue
+                    if table not in sizes:
+                        sizes[table] = connection.execute(select(func.count()).select_from(tables[table])).scalar()
+                    if sizes[table] > min_rows:
+                        errors.append(f'{name}: sequential scan of {table} ({sizes[table]} rows)\n'
+                                      f'  {" ".join(statement.split())}')
+                if verbose:
+                    print(f'\n[{name}] {" ".join(statement.split())}\n{plan}')
+            print(f'{name:<28}{len(statements):>4} statements')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--reservations', type=int, default=200000)
+    parser.add_argument('--available-ratio', type=float, default=0.05, help='share of the cars available')
+    parser.add_argument('--min-rows', type=int, default=1000, help='smaller tables may be scanned')
+    parser.add_argument('--verbose', action='store_true', help='print the plans')
+    args = parser.parse_args()
+
+    app.app_context().push()
+    upgrade(db.engine)
+    admin_id, user_id, car_id = seed(args.cars, args.users, args.reservations, args.available_ratio)
+
+    scenarios = {}
+    for name, (user, url, full_scans) in SCENARIOS.items():
+        cache.invalidate(car_namespace(car_id))
+        statements = record_statements(url.format(car_id=car_id), admin_id if user == 'admin' else user_id)
+        scenarios[name] = (statements, full_scans)
+
+    errors = check(scenarios, args.min_rows, args.verbose)
+    for error in errors:
+        print(f'FAILED {error}')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Compare the previous serialization path of a listing page (jsonify per row, then jsonify of the
+whole response) with rent_cars.utils.serializer at 10, 100 and 1,000 rows.
+
+usage: python -m benchmarks.serialization
+No row is written to the database, the cars are built in memory.
+"""
+import timeit
+from datetime import datetime
+
+from flask import jsonify
+
+from rent_cars import create_app
+from rent_cars.models import Car, Location, Reservation
+from rent_cars.utils.formatter import response
+
+app = create_app()
+
+SIZES = (10, 100, 1000)
+REPEAT = 20
+
+
+def build_cars(size):
+    cars = []
+    for i in range(size):
+        car = Car(id=i, license_plate=f'BENCH{i:09}', company='bench', model='bench', fabrication_year='2020',
+                  number_of_seats=4, is_available=bool(i % 2))
+        car.current_location = Location(id=i, car_id=i, latitude=48.85, longitude=2.35)
+        car.active_reservations = [
+            Reservation(id=i, car_id=i, user_id=i, reservation_start_date=datetime(2022, 6, 1),
+                        reservation_end_date=datetime(2022, 6, 5), date_created=datetime.utcnow())
+        ]
+        cars.append(car)
+    return cars
+
+
+def previous_path(cars):
+    results = [jsonify(row).json for row in cars]
+    return jsonify({'message': 'Cars fetched successfully', 'data': {'count': len(cars), 'results': results}}).data
+
+
+def current_path(cars):
+    return response('Cars fetched successfully', data={'count': len(cars), 'results': cars}).data
+
+
+def main():
+    with app.test_request_context():
+        for size in SIZES:
+            cars = build_cars(size)
+            previous = min(timeit.repeat(lambda: previous_path(cars), number=1, repeat=REPEAT)) * 1000
+            current = min(timeit.repeat(lambda: current_path(cars), number=1, repeat=REPEAT)) * 1000
+            print(f'{size:>5} rows  jsonify {previous:8.2f} ms  serializer {current:8.2f} ms  '
+                  f'speedup x{previous / current:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Startup time of a worker: import of rent_cars, create_app() and first request (POST /login, which opens the
+first database connection), each measured in a fresh interpreter, --runs times (medians are reported).
+
+It also guards the startup contract:
+- importing rent_cars works without any setting (SECRET_KEY, database credentials...)
+- no connection is opened before the first request (import and create_app do no I/O)
+and, with --baseline, fails when a phase is more than --max-regression slower than in a previous run:
+
+    python -m benchmarks.startup --output startup.json
+    python -m benchmarks.startup --baseline startup.json
+
+The exit status is 1 when a check fails. The schema of the configured database is upgraded first.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from rent_cars import create_app, db
+from rent_cars.migrations import upgrade
+
+PHASES = ('import', 'create_app', 'first_request', 'process')
+REQUIRED_SETTINGS = ('SECRET_KEY', 'DATABASE_URI', 'POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB')
+
+# run in a fresh interpreter, prints the durations (ms) and the connections opened by each phase
+WORKER = '''
+import json, socket, time
+start = time.perf_counter()
+connections = []
+connect = socket.socket.connect
+def recording_connect(sock, address):
+    connections.append(address)
+    return connect(sock, address)
+socket.socket.connect = recording_connect
+
+import rent_cars
+imported = time.perf_counter()
+import_connections = len(connections)
+if {import_only}:
+    print(json.dumps({{'import_connections': import_connections}}))
+    raise SystemExit
+
+app = rent_cars.create_app()
+created = time.perf_counter()
+create_app_connections = len(connections) - import_connections
+
+res = app.test_client().post('/login', json={{'username': 'startup-benchmark', 'password': '-'}})
+first_request = time.perf_counter()
+print(json.dumps({{
+    'import': (imported - start) * 1000,
+    'create_app': (created - imported) * 1000,
+    'first_request': (first_request - created) * 1000,
+    'status': res.status_code,
+    'import_connections': import_connections,
+    'create_app_connections': create_app_connections,
+}}))
+'''
+
+
+def run_worker(env, import_only=False):
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', WORKER.format(import_only=import_only)], env=env,
+                               capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if completed.returncode:
+        raise RuntimeError(f'worker failed:\n{completed.stderr}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process'] = elapsed
+    return result
+
+
+def check_contract(runs):
+    errors = []
+    bare_env = {name: value for name, value in os.environ.items() if name not in REQUIRED_SETTINGS}
+    try:
+        bare = run_worker(bare_env, import_only=True)
+        if bare['import_connections']:
+            errors.append(f'importing rent_cars opened {bare["import_connections"]} connection(s)')
+    except RuntimeError as e:
+        errors.append(f'importing rent_cars without settings failed: {e}')
+
+    if any(run['import_connections'] or run['create_app_connections'] for run in runs):
+        errors.append('connections were opened before the first request')
+    if any(run['status'] != 400 for run in runs):
+        errors.append(f'unexpected status of the first request: {sorted({run["status"] for run in runs})}')
+    return errors
+
+
+def check_regressions(medians, baseline_file, max_regression):
+    with open(baseline_file) as f:
+        baseline = json.load(f)['medians']
+    return [
+        f'{phase}: {medians[phase]:.1f} ms, baseline {baseline[phase]:.1f} ms'
+        for phase in PHASES if medians[phase] > baseline[phase] * (1 + max_regression)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', default='startup.json')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='tolerated slowdown per phase (0.2: 20%%)')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        upgrade(db.engine)
+
+    runs = [run_worker(dict(os.environ)) for _ in range(args.runs)]
+    medians = {phase: statistics.median(run[phase] for run in runs) for phase in PHASES}
+
+    print(f'{"phase":<16}{"median ms":>12}{"min ms":>10}{"max ms":>10}')
+    for phase in PHASES:
+        values = [run[phase] for run in runs]
+        print(f'{phase:<16}{medians[phase]:>12.1f}{min(values):>10.1f}{max(values):>10.1f}')
+
+    errors = check_contract(runs)
+    if args.baseline:
+        errors += check_regressions(medians, args.baseline, args.max_regression)
+
+    with open(args.output, 'w') as f:
+        json.dump({'date': datetime.utcnow().isoformat(), 'config': vars(args), 'medians': medians, 'runs': runs},
+                  f, indent=2)
+    print(f'\nresults saved in {args.output}')
+
+    for error in errors:
+        print(f'FAILED {error}')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
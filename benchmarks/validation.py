@@ -0,0 +1,124 @@
+"""
+Overhead of the request validation: time per call in µs of the compiled schemas (utils/schema.py) and of
+the former validator classes of utils/validators.py, on valid and invalid bodies and query strings.
+
+    python -m benchmarks.validation --calls 100000
+
+The former validators are read from git: the last revision of rent_cars/utils/validators.py defining
+BaseValidator, or --revision. The checks that need the database (uniqueness, availability of the car)
+are the same for both and not measured. No database is needed.
+"""
+import argparse
+import os
+import subprocess
+import time
+import types
+from datetime import datetime, timedelta
+
+from werkzeug.datastructures import MultiDict
+
+from rent_cars.utils.custom_exceptions import CustomException
+from rent_cars.utils.schema import compile_schema
+from rent_cars.utils import validators
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VALIDATORS_PATH = 'rent_cars/utils/validators.py'
+
+LICENSE_EXPIRY = (datetime.today() + timedelta(days=400)).strftime('%Y-%m-%d')
+REGISTRATION_BODY = {'username': 'jane', 'email': 'jane@rentcars.local', 'password1': 'secret', 'password2': 'secret',
+                     'license_number': 'AB1234567', 'date_issued': '2020-01-01', 'date_expiry': LICENSE_EXPIRY}
+RESERVATION_BODY = {'car_id': 12, 'reservation_start_date': '2031-03-01 10:00',
+                    'reservation_end_date': '2031-03-04 10:00'}
+
+# name: (schema, data, former validator class, its call)
+SCENARIOS = {
+    'login': (validators.LOGIN, {'username': 'jane', 'password': 'secret'}, 'AccountsValidator',
+              lambda validator, data: validator.login()),
+    'login.missing': (validators.LOGIN, {}, 'AccountsValidator', lambda validator, data: validator.login()),
+    'registration': (validators.REGISTRATION, REGISTRATION_BODY, 'AccountsValidator',
+                     lambda validator, data: validator.registration()),
+    'registration.invalid': (validators.REGISTRATION, dict(REGISTRATION_BODY, license_number='x', date_issued='2020'),
+                             'AccountsValidator', lambda validator, data: validator.registration()),
+    'reservation': (validators.RESERVATION, RESERVATION_BODY, 'ReservationsValidator',
+                    lambda validator, data: validator.reservation_fields()),
+    'reservation.wrong_date': (validators.RESERVATION, dict(RESERVATION_BODY, reservation_end_date='2031-03-04'),
+                               'ReservationsValidator', lambda validator, data: validator.reservation_fields()),
+    'cars.available': (validators.AVAILABILITY_WINDOW, MultiDict({'start': '2031-03-01 10:00',
+                                                                  'end': '2031-03-04 10:00'}),
+                       'CarsValidator', lambda validator, data: validator.availability_window(data)),
+    'cars.nearby': (validators.NEARBY_SEARCH, MultiDict({'lat': '48.85', 'lon': '2.35', 'radius': '5'}),
+                    'CarsValidator', lambda validator, data: validator.nearby_search(data)),
+    'reports.window': (validators.REPORT_WINDOW, MultiDict({'start': '2031-01-01', 'end': '2031-03-01'}),
+                       'ReportsValidator', lambda validator, data: validator.report_window(data)),
+}
+
+
+class StubRequest:
+    def __init__(self, body):
+        self.json = body
+
+
+def git(*args):
+    return subprocess.run(('git',) + args, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+
+
+def load_former_validators(revision=None):
+    if revision is None:
+        source = git('show', f'HEAD:{VALIDATORS_PATH}')
+        if 'class BaseValidator' not in source:
+            # the parent of the revision which removed it
+            removed = git('log', '-1', '--format=%H', '-S', 'class BaseValidator', '--', VALIDATORS_PATH).strip()
+            revision = f'{removed}^'
+    if revision is not None:
+        source = git('show', f'{revision}:{VALIDATORS_PATH}')
+
+    module = types.ModuleType('rent_cars.utils.former_validators')
+    # its relative imports resolve to the current package
+    module.__package__ = 'rent_cars.utils'
+    exec(compile(source, f'{revision or "HEAD"}:{VALIDATORS_PATH}', 'exec'), module.__dict__)
+    return module
+
+
+def per_call(f, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        try:
+            f()
+        except CustomException:
+            pass
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--revision', help='git revision of the former validators')
+    args = parser.parse_args()
+
+    former = load_former_validators(args.revision)
+
+    print(f'{"scenario":<26}{"schema µs":>11}{"former µs":>11}{"speedup":>9}  errors (schema / former)')
+    for name, (schema, data, class_name, call) in SCENARIOS.items():
+        validate = compile_schema(schema)
+        validator_class = getattr(former, class_name)
+        request = StubRequest(data)
+
+        def run_former():
+            # a validator per request, as in the routes
+            call(validator_class(request), data)
+
+        errors = []
+        for f in (lambda: validate(data), run_former):
+            try:
+                f()
+                errors.append(0)
+            except CustomException as e:
+                errors.append(len(getattr(e, 'errors', ())) or 1)
+
+        schema_us = per_call(lambda: validate(data), args.calls)
+        former_us = per_call(run_former, args.calls)
+        print(f'{name:<26}{schema_us:>11.2f}{former_us:>11.2f}{former_us / schema_us:>8.1f}x  {errors[0]} / {errors[1]}')
+
+
+if __name__ == '__main__':
+    main()
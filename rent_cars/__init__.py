@@ -1,21 +1,64 @@
+"""
+Application factory: importing the package only declares the extensions, models and routes.
+The database engine is created on first use, and the schema is created / upgraded by a separate
+migration step (`flask db-upgrade`, see rent_cars/migrations.py), never when a worker starts.
+"""
 from datetime import timedelta
 
 from flask import Flask
 from flask_cors import CORS
-from flask_sqlalchemy import SQLAlchemy
-import os
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from rent_cars.config import SECRET_KEY, DATABASE_URI, SESSION_LIFETIME, INSTRUMENTATION, PROXY_COUNT
+from rent_cars.utils.replicas import RoutingSQLAlchemy, init_replicas, replica_binds
+
+db = RoutingSQLAlchemy()
+
+# modules using the models, imported once db is declared
 from rent_cars.utils.accounts import login_required, admin_required
-from rent_cars.config import SECRET_KEY, DATABASE_URI, SESSION_LIFETIME
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = SECRET_KEY
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=SESSION_LIFETIME)
-app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
-app.app_context().push()
-CORS(app)
-db = SQLAlchemy(app)
-db.init_app(app)
-db.create_all()
-
-from rent_cars.routes import accounts, users, cars, reservations
+
+
+def create_app(settings=None):
+    """
+    settings override the configuration of rent_cars/config.py (e.g. SQLALCHEMY_DATABASE_URI)
+    """
+    from rent_cars.migrations import upgrade_command
+    from rent_cars.routes import accounts, users, cars, reservations, metrics, reports
+    from rent_cars.utils.database import engine_options, init_database
+    from rent_cars.utils.expiry import expire_command, init_expiry
+    from rent_cars.utils.instrumentation import init_instrumentation
+    from rent_cars.utils.outbox import worker_command
+    from rent_cars.utils.sessions import init_sessions
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=SESSION_LIFETIME)
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    app.config['SQLALCHEMY_BINDS'] = replica_binds()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(settings or {})
+
+    missing_settings = [name for name in ('SECRET_KEY', 'SQLALCHEMY_DATABASE_URI') if not app.config.get(name)]
+    if missing_settings:
+        raise RuntimeError(f'Missing settings: {missing_settings}, see rent_cars/config.py')
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    if PROXY_COUNT:
+        # request.remote_addr is the client address, used by the rate limits
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_COUNT)
+    CORS(app)
+    db.init_app(app)
+    init_database(app, db)
+    init_replicas(app)
+    if INSTRUMENTATION:
+        init_instrumentation(app)
+    init_sessions(app, db)
+    init_expiry(app)
+
+    for module in (accounts, users, cars, reservations, metrics, reports):
+        app.register_blueprint(module.bp)
+    app.cli.add_command(upgrade_command)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(expire_command)
+
+    return app
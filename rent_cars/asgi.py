@@ -0,0 +1,257 @@
+"""
+ASGI application (asgi_server.py).
+
+The hot endpoints run on asyncio with the async engine: a request waiting on the database does not
+hold a thread, so many more concurrent connections are served with the same resources:
+- POST /login
+- GET /cars, GET /cars/<id>/car
+- GET /reservations, POST /reservations
+Every other request is served by the Flask app through a thread pool (WsgiBridge).
+Models, validators, serializer, cache and sessions are shared with the WSGI app,
+both answer the same way and a client can be served by either of them.
+"""
+import re
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm.exc import StaleDataError
+
+from rent_cars import create_app
+from rent_cars.config import ASGI_WSGI_THREADS, INSTRUMENTATION, REPLICA_STICKY_SECONDS
+from rent_cars.models import Car, Reservation, User
+from rent_cars.routes.cars import CARS_SORT_FIELDS, car_detail
+from rent_cars.routes.reservations import RESERVATIONS_SORT_FIELDS
+from rent_cars.utils.accounts import async_login_required, login_user
+from rent_cars.utils.asgi import AsgiRequest, WsgiBridge, read_body, send_response, run_in_thread
+from rent_cars.utils.async_database import async_session, dispose_async_engine
+from rent_cars.utils.cache import cache, AVAILABLE_CARS, ALL_CARS, car_namespace
+from rent_cars.utils.conditional import (touch, resource_version, collection_version, resource_validators,
+                                         collection_validators, not_modified, not_modified_response, with_validators)
+from rent_cars.utils.core import paginate_select
+from rent_cars.utils.database import (pool_timeout_response, database_error_response, stale_data_response,
+                                      error_code, QUERY_CANCELED, LOCK_NOT_AVAILABLE)
+from rent_cars.utils.expiry import start_sweeper
+from rent_cars.utils.formatter import response
+from rent_cars.utils.instrumentation import REQUEST_LATENCY
+from rent_cars.utils.loading import with_profile
+from rent_cars.utils.outbox import publish
+from rent_cars.utils.passwords import hash_password, verify_password, needs_rehash
+from rent_cars.utils.ratelimit import async_rate_limited
+from rent_cars.utils.replicas import REPLICA_BINDS
+from rent_cars.utils.schema import async_validated
+from rent_cars.utils.validators import (LOGIN, RESERVATION, check_car_availability, check_no_overlap,
+                                        overlapping_reservation)
+
+app = create_app()
+
+ROUTES = []
+
+
+def route(method, pattern):
+    def decorator(handler):
+        ROUTES.append((method, re.compile(f'{pattern}$'), handler))
+        return handler
+
+    return decorator
+
+
+@route('POST', '/login')
+@async_rate_limited('login')
+@async_validated(LOGIN)
+async def login(request):
+    body = request.validated
+    async with async_session() as db_session:
+        row = await db_session.scalar(select(User).filter_by(username=body['username']))
+        if not row or not await run_in_thread(verify_password, row.password, body['password']):
+            return response('Invalid Credentials', 400)
+
+        # a single UPDATE: concurrent logins of the user do not conflict on its version
+        values = {'last_login': datetime.utcnow()}
+        if needs_rehash(row.password):
+            values['password'] = await run_in_thread(hash_password, body['password'])
+        await db_session.execute(touch(User, row.id, values=values))
+        await db_session.commit()
+
+    login_user(request.session, row)
+    return response('You are logged in successfully.')
+
+
+@route('GET', '/cars')
+@async_login_required
+@async_validated()
+async def list_cars(request):
+    cars = with_profile(select(Car), 'cars.list')
+    async with async_session() as db_session:
+        async def load_version(*criteria):
+            return tuple((await db_session.execute(collection_version(Car, *criteria))).one())
+
+        if request.user['is_admin']:
+            version = await cache.get_or_set_async(ALL_CARS, 'version', load_version)
+        else:
+            version = await cache.get_or_set_async(AVAILABLE_CARS, 'version', lambda: load_version(
+                Car.is_available.is_(True)))
+        etag = collection_validators(request, *version)
+        if not_modified(request, etag, None):
+            return not_modified_response(etag, None)
+
+        if request.user['is_admin']:
+            res = await paginate_select(db_session, cars, Car, request, CARS_SORT_FIELDS)
+        else:
+            res = await cache.get_or_set_async(AVAILABLE_CARS, request.url, lambda: paginate_select(
+                db_session, cars.filter(Car.is_available.is_(True)), Car, request, CARS_SORT_FIELDS))
+
+    return with_validators(response("Cars fetched successfully", data=res), etag, None)
+
+
+@route('GET', r'/cars/(?P<car_id>\d+)/car')
+@async_login_required
+async def get_car(request, car_id):
+    car_id = int(car_id)
+
+    async def load_validators():
+        async with async_session() as db_session:
+            return resource_validators(car_id, (await db_session.execute(resource_version(Car, car_id))).first())
+
+    async def load_car():
+        async with async_session() as db_session:
+            return car_detail(await db_session.scalar(with_profile(select(Car), 'cars.detail').filter_by(id=car_id)))
+
+    validators = await cache.get_or_set_async(car_namespace(car_id), 'validators', load_validators)
+    if not validators:
+        return response('Car not found', 404)
+    if not_modified(request, *validators):
+        return not_modified_response(*validators)
+
+    # cached with the validators of the same row, as in the WSGI route
+    detail = await cache.get_or_set_async(car_namespace(car_id), 'detail', load_car)
+    if detail:
+        validators, car = detail
+        return with_validators(response('Car fetched successfully', data=car), *validators)
+    else:
+        return response('Car not found', 404)
+
+
+@route('GET', '/reservations')
+@async_login_required
+@async_validated()
+async def list_reservations(request):
+    reservations = select(Reservation)
+    if not request.user['is_admin']:
+        # get reservations of current user only
+        reservations = reservations.filter_by(user_id=request.user['id'])
+
+    async with async_session() as db_session:
+        res = await paginate_select(db_session, reservations, Reservation, request, RESERVATIONS_SORT_FIELDS)
+
+    return response("Reservations fetched successfully", data=res)
+
+
+@route('POST', '/reservations')
+@async_login_required
+@async_rate_limited('booking')
+@async_validated(RESERVATION)
+async def add_reservation(request):
+    params = dict(request.validated)
+    async with async_session() as db_session:
+        car = await db_session.scalar(select(Car).filter_by(id=params['car_id']).with_for_update())
+        check_car_availability(car, params['car_id'])
+        # written before the overlap check, as in lock_available_car: serializes the bookings of the car
+        await db_session.execute(touch(Car, car.id))
+        check_no_overlap(await db_session.scalar(overlapping_reservation(
+            car.id, params['reservation_start_date'], params['reservation_end_date'])), car.id)
+
+        params['user_id'] = request.user['id']
+        # the reservation is part of the user details. Run before the reservation is added:
+        # the statement flushes the session, a conflict must only be raised by the commit below
+        await db_session.execute(touch(User, request.user['id']))
+
+        reservation = Reservation(**params)
+        db_session.add(reservation)
+        publish('reservation.created', reservation, db_session)
+
+        try:
+            await db_session.commit()
+        except IntegrityError:
+            await db_session.rollback()
+            return response('Reservation conflicts with an existing one', 409)
+
+    cache.invalidate(AVAILABLE_CARS, car_namespace(car.id))
+    return response('Reservation created successfully', data=reservation)
+
+
+def match_route(method, path):
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.match(path)
+        if match and route_method == method:
+            return handler, match.groupdict()
+    return None, None
+
+
+async def handle(handler, request, params):
+    try:
+        return await handler(request, **params)
+    except PoolTimeoutError:
+        return pool_timeout_response()
+    except StaleDataError:
+        return stale_data_response()
+    except DBAPIError as e:
+        # asyncpg reports the statement / lock timeouts as generic database errors
+        if not isinstance(e, OperationalError) and error_code(e) not in (QUERY_CANCELED, LOCK_NOT_AVAILABLE):
+            raise
+        return database_error_response(e)
+
+
+wsgi_bridge = WsgiBridge(app, ASGI_WSGI_THREADS)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_sweeper(app)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await dispose_async_engine()
+            wsgi_bridge.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def open_session(request):
+    # the store may read the database (SESSION_BACKEND=database): run in the thread pool, not on the event loop
+    with app.app_context():
+        return app.session_interface.open_session(app, request)
+
+
+def save_session(session, res):
+    with app.app_context():
+        app.session_interface.save_session(app, session, res)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    start = time.perf_counter()
+    body = await read_body(receive)
+    handler, params = match_route(scope['method'], scope['path'])
+    if handler is None:
+        return await wsgi_bridge(scope, body, send)
+
+    request = AsgiRequest(scope, body)
+    with app.app_context():
+        request.session = await run_in_thread(open_session, request)
+        res = await handle(handler, request, params)
+        # same read-after-write stickiness as the WSGI app for the requests it serves from the replicas
+        if REPLICA_BINDS and request.method != 'GET' and res.status_code < 400:
+            request.session['primary_until'] = time.time() + REPLICA_STICKY_SECONDS
+        await run_in_thread(save_session, request.session, res)
+
+    await send_response(send, res)
+    if INSTRUMENTATION:
+        REQUEST_LATENCY.labels(endpoint=f'asgi.{handler.__name__}', method=request.method,
+                               status=res.status_code).observe(time.perf_counter() - start)
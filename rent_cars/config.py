@@ -6,12 +6,117 @@ or user env-variables
 import os
 
 ROWS_PER_PAGE = 2
-SECRET_KEY = os.environ['SECRET_KEY']
+MAX_ROWS_PER_PAGE = 100
+# SECRET_KEY and the database credentials are required by create_app(), importing the package needs none of them
+SECRET_KEY = os.environ.get('SECRET_KEY')
 SESSION_LIFETIME = 60
+# server side sessions, the cookie only holds the session id: 'memory' (in-process LRU, one process only)
+# or 'database' (shared by every process serving the app, needed by ASGI_WORKERS > 1 or several servers)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')
+SESSION_MAX_ENTRIES = 100000
+SESSION_PURGE_INTERVAL = 300  # seconds between two deletions of the expired sessions (database backend)
 
-user = os.environ['POSTGRES_USER']
-password = os.environ['POSTGRES_PASSWORD']
-database = os.environ['POSTGRES_DB']
+user = os.environ.get('POSTGRES_USER')
+password = os.environ.get('POSTGRES_PASSWORD')
+database = os.environ.get('POSTGRES_DB')
 host = os.environ.get('POSTGRES_HOST', 'localhost')
 
-DATABASE_URI = f'postgresql://{user}:{password}@{host}/{database}'
+if os.environ.get('DATABASE_URI'):
+    DATABASE_URI = os.environ['DATABASE_URI']
+elif user and password and database:
+    DATABASE_URI = f'postgresql://{user}:{password}@{host}/{database}'
+else:
+    DATABASE_URI = None
+
+# read replicas, full URIs (DATABASE_REPLICA_URIS) or hosts sharing the primary credentials (POSTGRES_REPLICA_HOSTS)
+if os.environ.get('DATABASE_REPLICA_URIS'):
+    DATABASE_REPLICA_URIS = os.environ['DATABASE_REPLICA_URIS'].split(',')
+else:
+    DATABASE_REPLICA_URIS = [
+        f'postgresql://{user}:{password}@{replica_host}/{database}'
+        for replica_host in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',') if replica_host
+    ]
+# seconds during which the requests of a session go to the primary after a write (read-after-write)
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+# number of proxies (load balancer...) in front of the app, the client address is then read from X-Forwarded-For
+PROXY_COUNT = int(os.environ.get('PROXY_COUNT', 0))
+
+# rate limiting (token buckets, utils/ratelimit.py): per route, (key, requests, seconds) limits
+# a client to `requests` requests per `seconds`, bursts included.
+# key is 'ip' (client address), 'user' (logged in user) or 'endpoint' (all the clients of the route)
+RATE_LIMITING = os.environ.get('RATE_LIMITING', 'on') == 'on'
+RATE_LIMITS = {
+    'login': [('ip', 10, 60), ('endpoint', 50, 1)],
+    'register': [('ip', 5, 300), ('endpoint', 20, 1)],
+    'booking': [('user', 10, 60), ('ip', 60, 60)],
+}
+RATE_LIMIT_MAX_KEYS = 100000
+
+# in-process cache of the car listings / details, enabled with SESSION_BACKEND=memory (a single process)
+CACHE_TTL = 30  # seconds
+CACHE_MAX_ENTRIES = 1024
+
+# nearby cars search, in km
+NEARBY_DEFAULT_RADIUS = 5
+NEARBY_MAX_RADIUS = 100
+
+# reporting: the daily summary is refreshed when read, at most every REPORT_REFRESH_INTERVAL seconds,
+# from the reservations changed since the previous refresh minus REPORT_REFRESH_OVERLAP seconds
+REPORT_REFRESH_INTERVAL = int(os.environ.get('REPORT_REFRESH_INTERVAL', 300))
+REPORT_REFRESH_OVERLAP = 300
+REPORT_DEFAULT_DAYS = 30
+REPORT_MAX_DAYS = 366
+
+# transactional outbox (utils/outbox.py): side effects of the bookings are delivered by `flask outbox-worker`,
+# OUTBOX_CONCURRENCY threads claiming batches of OUTBOX_BATCH_SIZE events
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_CONCURRENCY = int(os.environ.get('OUTBOX_CONCURRENCY', 2))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1))  # seconds between polls of an empty outbox
+OUTBOX_LEASE = 300  # seconds a claimed batch is hidden from the other workers, it is delivered again after that
+OUTBOX_RETRY_DELAY = 5  # seconds before retrying a failed event, doubled at each attempt
+OUTBOX_MAX_RETRY_DELAY = 3600
+
+# expiry of the reservations past their end date (utils/expiry.py): every RESERVATION_SWEEP_INTERVAL seconds
+# (0: never) each worker completes them, at most RESERVATION_SWEEP_MAX_BATCHES batches per round
+RESERVATION_SWEEP_INTERVAL = int(os.environ.get('RESERVATION_SWEEP_INTERVAL', 60))
+RESERVATION_SWEEP_BATCH_SIZE = 500
+RESERVATION_SWEEP_MAX_BATCHES = 20
+
+# rows validated / inserted / fetched at once by the bulk import and export endpoints
+BULK_CHUNK_SIZE = 1000
+
+# password hashing, see werkzeug.security.generate_password_hash for the method format
+# stored hashes made with another method are upgraded on login
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+PASSWORD_SALT_LENGTH = 16
+# size of the process pool computing the hashes, 0 to hash in the request thread
+PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+
+# request instrumentation (latency, SQL and serialization metrics on /metrics)
+INSTRUMENTATION = os.environ.get('INSTRUMENTATION', 'off') == 'on'
+# add a Server-Timing header (app, db and serialization durations) to the responses
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'off') == 'on'
+# dump the sampled stacks of requests slower than PROFILE_SLOW_REQUESTS seconds (0: profiler off)
+# as flame graph compatible (collapsed) stacks in PROFILE_DIR
+PROFILE_SLOW_REQUESTS = float(os.environ.get('PROFILE_SLOW_REQUESTS', 0))
+PROFILE_INTERVAL = 0.005  # seconds between two samples
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# database connection pool, sized from the number of waitress threads: each thread holds at most
+# one connection, the overflow absorbs the background work (password pool, sweepers...)
+WAITRESS_THREADS = int(os.environ.get('WAITRESS_THREADS', 4))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', WAITRESS_THREADS))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', max(2, WAITRESS_THREADS // 2)))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # seconds waiting for a free connection
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # seconds
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'on') == 'on'
+# server side timeouts (postgres), in milliseconds, 0 to disable
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 5000))
+DB_LOCK_TIMEOUT = int(os.environ.get('DB_LOCK_TIMEOUT', 2000))
+
+# ASGI serving mode (asgi_server.py): uvicorn processes, connections of the async pool of the hot endpoints,
+# and threads serving the other endpoints through the Flask app
+ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', 1))
+ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 10))
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', WAITRESS_THREADS))
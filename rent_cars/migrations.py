@@ -0,0 +1,217 @@
+"""
+Versioned schema migrations, applied by a separate step before the new code is served:
+
+    flask db-upgrade
+
+The version of the schema is kept in the schema_version table. The pending MIGRATIONS are applied
+in order, each one in its own transaction with the record of its version. On postgres an advisory
+lock serializes concurrent runs (e.g. several containers starting at once).
+
+The baseline creates the missing tables of the current models, so a new database is complete at version 1.
+The following migrations bring databases created before them up to date: they only add what is missing.
+Migrations are appended to MIGRATIONS and never modified once released.
+"""
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, Integer, MetaData, String, Table, TIMESTAMP, func, inspect, select, text
+
+from rent_cars import db
+
+# pg_advisory_lock key of the migrations
+MIGRATIONS_LOCK = 4261
+
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', TIMESTAMP, nullable=False),
+)
+
+
+def _model_table(table_name):
+    return db.Model.metadata.tables[table_name]
+
+
+def add_columns(connection, table_name, *column_names):
+    """
+    add the columns of the model missing in the table, existing rows get the column default
+    """
+    table = _model_table(table_name)
+    existing = {column['name'] for column in inspect(connection).get_columns(table_name)}
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        column_type = column.type.compile(dialect=connection.dialect)
+        # user is a reserved word on postgres
+        quoted_table = connection.dialect.identifier_preparer.quote(table_name)
+        connection.execute(text(f'ALTER TABLE {quoted_table} ADD COLUMN {name} {column_type}'))
+
+        default = column.default.arg if column.default is not None else None
+        if callable(default):
+            default = default(None)
+        if default is not None:
+            connection.execute(table.update().values({name: default}))
+        if not column.nullable and connection.dialect.name == 'postgresql':
+            # sqlite can't add the constraint to an existing column, the ORM fills it anyway
+            connection.execute(text(f'ALTER TABLE {quoted_table} ALTER COLUMN {name} SET NOT NULL'))
+
+
+def create_indexes(connection, table_name, *index_names):
+    """
+    create the indexes of the model missing in the table, the ones removed from the model since (dropped by
+    a later migration) are skipped
+    """
+    indexes = {index.name: index for index in _model_table(table_name).indexes}
+    for name in index_names:
+        if name in indexes:
+            indexes[name].create(connection, checkfirst=True)
+
+
+def drop_indexes(connection, *index_names):
+    preparer = connection.dialect.identifier_preparer
+    for name in index_names:
+        connection.execute(text(f'DROP INDEX IF EXISTS {preparer.quote(name)}'))
+
+
+def drop_unique_constraints(connection, table_name, *column_names):
+    """
+    drop the single column unique constraints of the columns, created by older models. sqlite can't drop
+    a constraint: the table is rebuilt from the model and its rows copied
+    """
+    unique_columns = {tuple(constraint['column_names']): constraint['name']
+                      for constraint in inspect(connection).get_unique_constraints(table_name)}
+    names = [unique_columns[(name,)] for name in column_names if (name,) in unique_columns]
+    if not names:
+        return
+    preparer = connection.dialect.identifier_preparer
+    if connection.dialect.name != 'sqlite':
+        for name in names:
+            connection.execute(text(f'ALTER TABLE {preparer.quote(table_name)} DROP CONSTRAINT {preparer.quote(name)}'))
+        return
+
+    table = _model_table(table_name)
+    existing = inspect(connection)
+    copied = ', '.join(preparer.quote(column['name']) for column in existing.get_columns(table_name)
+                       if column['name'] in table.c)
+    for index in existing.get_indexes(table_name):
+        connection.execute(text(f'DROP INDEX {preparer.quote(index["name"])}'))
+    connection.execute(text(f'ALTER TABLE {preparer.quote(table_name)} RENAME TO {table_name}_rebuilt'))
+    table.create(connection)
+    connection.execute(text(f'INSERT INTO {preparer.quote(table_name)} ({copied}) '
+                            f'SELECT {copied} FROM {table_name}_rebuilt'))
+    connection.execute(text(f'DROP TABLE {table_name}_rebuilt'))
+
+
+def baseline(connection):
+    db.Model.metadata.create_all(connection)
+
+
+def last_update_columns(connection):
+    for table_name in ('car', 'user'):
+        add_columns(connection, table_name, 'date_last_update')
+        create_indexes(connection, table_name, f'ix_{table_name}_date_last_update')
+
+
+def reservation_indexes(connection):
+    create_indexes(connection, 'reservation', 'ix_reservation_active_car', 'ix_reservation_active_user',
+                   'ix_reservation_active_period', 'ix_reservation_date_created', 'ix_reservation_date_last_update')
+
+
+def hot_filter_indexes(connection):
+    create_indexes(connection, 'car', 'ix_car_available')
+    create_indexes(connection, 'reservation', 'ix_reservation_active_end', 'ix_reservation_user_history',
+                   'ix_reservation_car_history')
+
+
+def outbox_table(connection):
+    _model_table('outbox_event').create(connection, checkfirst=True)
+
+
+def completed_status(connection):
+    # a native enum on postgres only (VARCHAR on sqlite), added in a transaction since postgres 12
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("ALTER TYPE reservationstatus ADD VALUE IF NOT EXISTS 'completed'"))
+
+
+def version_columns(connection):
+    for table_name in ('car', 'user'):
+        add_columns(connection, table_name, 'version')
+
+
+def reservation_history(connection):
+    # the first models allowed a single reservation per car and per user, ever: the active one is now
+    # enforced by the partial unique indexes of migration 3
+    drop_unique_constraints(connection, 'reservation', 'car_id', 'user_id')
+
+
+def reservation_periods(connection):
+    # a car is booked for periods that do not overlap, its availability is no longer set by the bookings:
+    # the cars made unavailable by their active reservation are in service again (a new version, see
+    # utils/conditional.py)
+    drop_indexes(connection, 'ix_reservation_active_car')
+    car, reservation = _model_table('car'), _model_table('reservation')
+    active = select(reservation.c.car_id).where(reservation.c.status == 'reserved')
+    connection.execute(car.update().where(car.c.id.in_(active), car.c.is_available.is_(False)).values(
+        is_available=True, version=car.c.version + 1, date_last_update=datetime.utcnow()))
+
+
+MIGRATIONS = [
+    (1, 'baseline: tables of the models', baseline),
+    (2, 'date_last_update of the cars and users (conditional requests)', last_update_columns),
+    (3, 'indexes of the reservations added before the versioned migrations', reservation_indexes),
+    (4, 'indexes of the hot filters: available cars, history of the users and cars, active reservation ends',
+     hot_filter_indexes),
+    (5, 'transactional outbox of the side effects', outbox_table),
+    (6, 'completed status of the expired reservations', completed_status),
+    (7, 'version of the cars and users (optimistic concurrency of the edits)', version_columns),
+    (8, 'history of the reservations: drop the unique car_id and user_id of the first models', reservation_history),
+    (9, 'bookings by period: several active reservations per car', reservation_periods),
+]
+
+
+def current_version(connection):
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine):
+    """
+    apply the pending migrations, returns their versions
+    """
+    applied = []
+    with engine.connect() as connection:
+        is_postgres = connection.dialect.name == 'postgresql'
+        if is_postgres:
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATIONS_LOCK})
+        try:
+            with connection.begin():
+                schema_version.create(connection, checkfirst=True)
+            version = current_version(connection)
+
+            for migration_version, description, migrate in MIGRATIONS:
+                if migration_version <= version:
+                    continue
+                with connection.begin():
+                    migrate(connection)
+                    connection.execute(schema_version.insert().values(
+                        version=migration_version, description=description, applied_at=datetime.utcnow()))
+                applied.append(migration_version)
+        finally:
+            if is_postgres:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATIONS_LOCK})
+    return applied
+
+
+@click.command('db-upgrade')
+@with_appcontext
+def upgrade_command():
+    """
+    apply the pending schema migrations
+    """
+    applied = upgrade(db.engine)
+    if applied:
+        click.echo(f'schema upgraded to version {applied[-1]} (applied: {applied})')
+    else:
+        click.echo('schema is up to date')
@@ -1,5 +1,6 @@
 from datetime import datetime
 from dataclasses import dataclass, field
+from typing import List
 from sqlalchemy.orm import backref
 import enum
 
@@ -23,10 +24,31 @@ class Reservation(db.Model):
     class ReservationStatus(enum.Enum):
         reserved = 'reserved'
         cancelled = 'cancelled'
+        completed = 'completed'  # ended, set by the expiry sweeper (utils/expiry.py)
+
+    # a car can have several active (reserved) reservations on periods that do not overlap, checked by the
+    # booking under the lock of the car row, a user only one. The overlap search on the reservation period
+    # is served by the partial index on active reservations, its size does not grow with the history of
+    # cancelled/past reservations.
+    __table_args__ = (
+        db.Index('ix_reservation_active_user', 'user_id', unique=True,
+                 postgresql_where=db.text("status = 'reserved'"), sqlite_where=db.text("status = 'reserved'")),
+        db.Index('ix_reservation_active_period', 'car_id', 'reservation_start_date', 'reservation_end_date',
+                 postgresql_where=db.text("status = 'reserved'"), sqlite_where=db.text("status = 'reserved'")),
+        # active reservations still running after a date: future time windows, expired reservations
+        db.Index('ix_reservation_active_end', 'reservation_end_date',
+                 postgresql_where=db.text("status = 'reserved'"), sqlite_where=db.text("status = 'reserved'")),
+        # history of a user (listing sorted on the id, cursor pagination) and of a car (cascade delete)
+        db.Index('ix_reservation_user_history', 'user_id', 'id'),
+        db.Index('ix_reservation_car_history', 'car_id'),
+        # incremental refresh of the reporting summary
+        db.Index('ix_reservation_date_created', 'date_created'),
+        db.Index('ix_reservation_date_last_update', 'date_last_update'),
+    )
 
     id: int = db.Column(db.Integer, primary_key=True)
-    car_id: int = db.Column(db.Integer, db.ForeignKey('car.id'), unique=True, nullable=False)
-    user_id: int = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    car_id: int = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
+    user_id: int = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     status = db.Column(db.Enum(ReservationStatus), default=ReservationStatus.reserved, nullable=False)
     reservation_start_date: datetime = db.Column(db.TIMESTAMP, nullable=False)
     reservation_end_date: datetime = db.Column(db.TIMESTAMP, nullable=False)
@@ -41,7 +63,10 @@ class Reservation(db.Model):
 class User(db.Model):
     id: int = db.Column(db.Integer, primary_key=True)
     licenses: License = db.relationship('License', backref='user', uselist=False, cascade='all,delete')
-    reservation: Reservation = db.relationship('Reservation', backref='user', uselist=False, cascade='all,delete')
+    reservation: Reservation = db.relationship(
+        'Reservation', uselist=False, viewonly=True,
+        primaryjoin="and_(User.id == Reservation.user_id, Reservation.status == 'reserved')")
+    reservations = db.relationship('Reservation', backref='user', cascade='all,delete')
     username: str = db.Column(db.String(25), unique=True, nullable=False)
     email: str = db.Column(db.String(150), unique=True, nullable=False)
     last_login: datetime = db.Column(db.TIMESTAMP, nullable=True)
@@ -49,6 +74,12 @@ class User(db.Model):
     is_admin: bool = db.Column(db.Boolean, default=False)
 
     password = db.Column(db.String(150), nullable=False)
+    # validator of the conditional requests (utils/conditional.py)
+    date_last_update = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                                 index=True)
+    # optimistic lock of the writes and ETag of the user, bumped by every update of the row
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f"User({self.username}, {self.email})"
@@ -56,6 +87,11 @@ class User(db.Model):
 
 @dataclass
 class Location(db.Model):
+    # bounding box prefilter of the nearby cars search
+    __table_args__ = (
+        db.Index('ix_location_coordinates', 'latitude', 'longitude'),
+    )
+
     id: int = db.Column(db.Integer, primary_key=True)
     car_id: int = db.Column(db.Integer, db.ForeignKey('car.id'), unique=True, nullable=False)
     latitude: float = db.Column(db.Float, nullable=False)
@@ -67,15 +103,60 @@ class Location(db.Model):
 
 @dataclass
 class Car(db.Model):
+    # listing of the base users and its validators (count, last update) read the available cars only.
+    # sqlite only matches the predicate written as in the queries
+    __table_args__ = (
+        db.Index('ix_car_available', 'id', 'date_last_update',
+                 postgresql_where=db.text('is_available'), sqlite_where=db.text('is_available IS 1')),
+    )
+
     id: int = db.Column(db.Integer, primary_key=True)
     current_location: Location = db.relationship('Location', backref='car', uselist=False, cascade='all,delete')
-    reservation: Reservation = db.relationship('Reservation', backref='car', uselist=False, cascade='all,delete')
+    active_reservations: List[Reservation] = db.relationship(
+        'Reservation', viewonly=True, order_by='Reservation.reservation_start_date',
+        primaryjoin="and_(Car.id == Reservation.car_id, Reservation.status == 'reserved')")
+    reservations = db.relationship('Reservation', backref='car', cascade='all,delete')
     license_plate: str = db.Column(db.String(15), unique=True, nullable=False)
     company: str = db.Column(db.String(15), nullable=False)
     model: str = db.Column(db.String(20), nullable=False)
     fabrication_year: str = db.Column(db.String(4), nullable=False)
     number_of_seats: int = db.Column(db.Integer, nullable=False)
+    # in service, set by the admins. A booking does not change it: the car stays bookable on other periods
     is_available: bool = db.Column(db.Boolean, default=True)
+    # validator of the conditional requests (utils/conditional.py)
+    date_last_update = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                                 index=True)
+    # optimistic lock of the writes and ETag of the car, bumped by every update of the row
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f"Car({self.license_plate}, {self.model}, {self.is_available})"
+
+
+class UserSession(db.Model):
+    # server side sessions of the database backend (utils/sessions.py), the cookie only holds the sid
+    sid = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.TIMESTAMP, nullable=False, index=True)
+
+
+class OutboxEvent(db.Model):
+    # side effects of the writes, inserted in their transaction and delivered by the outbox worker (utils/outbox.py)
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow)
+    # due date of the next delivery: pushed back while claimed by a worker and after a failure
+    available_at = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(200), nullable=True)
+
+
+class ReservationDailySummary(db.Model):
+    # reporting aggregates per day of creation of the reservations, maintained by utils/reporting.py
+    day = db.Column(db.Date, primary_key=True)
+    reservations = db.Column(db.Integer, nullable=False)
+    cancellations = db.Column(db.Integer, nullable=False)
+    rental_hours = db.Column(db.Float, nullable=False)  # of the reservations not cancelled
+    refreshed_at = db.Column(db.TIMESTAMP, nullable=False)
@@ -1,74 +1,84 @@
 import werkzeug.exceptions
-from flask import request, session, jsonify
-from rent_cars import app, db
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, request, session
+from rent_cars import db
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 
 from rent_cars import login_required
+from rent_cars.utils.accounts import login_user
+from rent_cars.utils.conditional import touch
 from rent_cars.models import User, License
 from rent_cars.utils.formatter import response
-from rent_cars.utils.validators import AccountsValidator
-from rent_cars.utils.custom_exceptions import (PasswordsNotMatching, WrongFormat,
-                                               MissingMandatoryFields, InputNotAcceptable, RecordAlreadyExists)
+from rent_cars.utils.passwords import hash_password, verify_password, needs_rehash
+from rent_cars.utils.ratelimit import rate_limited
+from rent_cars.utils.schema import validated
+from rent_cars.utils.serializer import serialize
+from rent_cars.utils.validators import LOGIN, REGISTRATION, registration_conflicts
 
+bp = Blueprint('accounts', __name__)
 
-@app.route('/')
+
+@bp.route('/')
 @login_required
 def hello_world():  # put application's code here
-    passhash = generate_password_hash('chouaib')
+    passhash = hash_password('chouaib')
     return passhash
 
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
+@rate_limited('login')
+@validated(LOGIN)
 def login():
-    valid_body = AccountsValidator(request)
-    try:
-        valid_body.login()
-    except MissingMandatoryFields as e:
-        return response(e.message, e.status_code)
-
-    body = request.json
+    body = request.validated
     try:
         row = User.query.filter_by(username=body['username']).first_or_404()
     except werkzeug.exceptions.NotFound:
         return response('Invalid Credentials', 400)
 
-    if not check_password_hash(row.password, body['password']):
+    if not verify_password(row.password, body['password']):
         return response('Invalid Credentials', 400)
 
-    row.last_login = datetime.utcnow()
+    # a single UPDATE: concurrent logins of the user do not conflict on its version
+    values = {'last_login': datetime.utcnow()}
+    # upgrade hashes made with outdated parameters, the password is only known at login
+    if needs_rehash(row.password):
+        values['password'] = hash_password(body['password'])
+    db.session.execute(touch(User, row.id, values=values))
     db.session.commit()
-    session['user'] = jsonify(row).json
+    login_user(session, row)
 
     return response('You are logged in successfully.')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
-    if 'username' in session:
-        session.pop('username', None)
+    session.clear()
 
     return response('You are logged out successfully.')
 
 
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
+@rate_limited('register')
+@validated(REGISTRATION)
 def register():
-    valid_body = AccountsValidator(request)
-    try:
-        valid_body.registration()
-    except (MissingMandatoryFields, WrongFormat, InputNotAcceptable, PasswordsNotMatching, RecordAlreadyExists) as e:
-        return response(e.message, e.status_code)
-
-    body = request.json
-    hashed_password = generate_password_hash(body['password1'])
-    user = User(username=body['username'], email=body['email'], password=hashed_password)
+    body = request.validated
+    hashed_password = hash_password(body['password1'])
+    user = User(username=body['username'], email=body['email'], password=hashed_password,
+                licenses=License(license_number=body['license_number'], date_issued=body['date_issued'],
+                                 date_expiry=body['date_expiry']))
     db.session.add(user)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # the unique constraints are checked by the inserts, one query tells which of them failed
+        db.session.rollback()
+        registration_conflicts(body)
+        return response('User already exists', 400)
+
+    # a new user has no reservation, serialized before the commit expires its attributes
+    set_committed_value(user, 'reservation', None)
+    data = serialize(user)
     db.session.commit()
 
-    license = License(license_number=body['license_number'], date_issued=body['date_issued'],
-                      date_expiry=body['date_expiry'], user_id=user.id)
-    db.session.add(license)
-    db.session.commit()
-
-    return response("User created successfully", data=user)
-
+    return response("User created successfully", data=data)
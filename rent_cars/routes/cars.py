@@ -1,86 +1,258 @@
+import heapq
+
 from werkzeug.security import generate_password_hash
 
-from rent_cars import app, login_required, admin_required, db
-from rent_cars.models import Car
-from flask import request, session
+from rent_cars import login_required, admin_required, db
+from rent_cars.models import Car, Reservation, Location
+from flask import Blueprint, current_app, request, stream_with_context
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 
-from rent_cars.utils.core import paginate_results
-from rent_cars.utils.custom_exceptions import (WrongType, InputNotAcceptable, RecordAlreadyExists,
-                                               MissingMandatoryFields, WrongFormat, PasswordsNotMatching)
+from rent_cars.utils.accounts import current_user
+from rent_cars.utils.bulk import read_rows, import_rows, export_rows, export_format
+from rent_cars.utils.cache import (cache, invalidate_on_commit, invalidate_car, AVAILABLE_CARS, ALL_CARS,
+                                   car_namespace)
+from rent_cars.utils.conditional import (touch, resource_version, collection_version, resource_validators,
+                                         collection_validators, not_modified, not_modified_response, with_validators,
+                                         versioned_update, if_match_versions)
+from rent_cars.utils.core import paginate_query, get_page_size
 from rent_cars.utils.formatter import response
-from rent_cars.utils.validators import CarsValidator
-from rent_cars.config import ROWS_PER_PAGE
+from rent_cars.utils.geo import haversine, bounding_box
+from rent_cars.utils.serializer import serialize
+from rent_cars.utils.loading import with_profile
+from rent_cars.utils.replicas import primary
+from rent_cars.utils.schema import validated
+from rent_cars.utils.validators import (CAR, CAR_UPDATE, CAR_UPDATE_ADMIN, AVAILABILITY_WINDOW, NEARBY_SEARCH,
+                                        BULK_LOCATIONS, validate_uniqueness, check_cars_exist, reservation_overlaps)
+
+bp = Blueprint('cars', __name__)
+
+CARS_SORT_FIELDS = ('id', 'license_plate', 'company', 'model', 'fabrication_year', 'number_of_seats')
+CARS_IMPORT_FIELDS = ('license_plate', 'company', 'model', 'fabrication_year', 'number_of_seats', 'is_available')
+
 
+def _from_primary(loader, *args):
+    # cache entries are filled from the primary, a lagging replica would cache stale data
+    # right after an invalidation
+    with primary():
+        return loader(*args)
 
-@app.route('/cars', methods=['GET', 'POST'])
+
+def car_detail(car):
+    """
+    (validators, serialized car) of a loaded car, None when it does not exist
+    """
+    if car is None:
+        return None
+    return resource_validators(car.id, (car.date_last_update, car.version)), serialize(car)
+
+
+@bp.route('/cars', methods=['GET', 'POST'])
 @login_required
+@validated(CAR, methods=('POST',))
 def manage_cars():
     """
     Base user will get only the cars that are available (is_available=True)
     Admin user will get all the cars (available and unavailable)
     only admin can add new car
     """
-    if session['user']['is_admin'] and request.method == 'POST':
-        car_validator = CarsValidator(request)
-        try:
-            mandatory_fields = car_validator.add_car()
-        except (MissingMandatoryFields, WrongFormat, InputNotAcceptable,
-                PasswordsNotMatching, RecordAlreadyExists) as e:
-            return response(e.message, e.status_code)
-        body = request.json
-        params = {field: body.get(field) for field in mandatory_fields}
+    if current_user()['is_admin'] and request.method == 'POST':
+        params = request.validated
+        validate_uniqueness((Car, 'license_plate', params['license_plate']))
 
         car = Car(**params)
         db.session.add(car)
+        invalidate_on_commit(AVAILABLE_CARS)
         db.session.commit()
 
         return response('Car created successfully', data=car)
 
-    page = request.args.get('page', 1, type=int)
-    if session['user']['is_admin']:
-        cars = Car.query.paginate(page=page, per_page=ROWS_PER_PAGE)
+    if current_user()['is_admin']:
+        # invalidated by every write of the cars
+        version = cache.get_or_set(ALL_CARS, 'version', lambda: _from_primary(
+            lambda: tuple(db.session.execute(collection_version(Car)).one())))
     else:
-        cars = Car.query.filter_by(is_available=True).paginate(page=page, per_page=ROWS_PER_PAGE)
-    res = paginate_results(cars, request)
+        # cached with the listing, both are invalidated by the same writes
+        version = cache.get_or_set(AVAILABLE_CARS, 'version', lambda: _from_primary(
+            lambda: tuple(db.session.execute(collection_version(Car, Car.is_available.is_(True))).one())))
+    etag = collection_validators(request, *version)
+    if not_modified(request, etag, None):
+        return not_modified_response(etag, None)
+
+    if current_user()['is_admin']:
+        res = paginate_query(with_profile(Car.query, 'cars.list'), Car, request, CARS_SORT_FIELDS)
+    else:
+        cars = with_profile(Car.query, 'cars.list').filter(Car.is_available.is_(True))
+        res = cache.get_or_set(
+            AVAILABLE_CARS, request.url,
+            lambda: _from_primary(paginate_query, cars, Car, request, CARS_SORT_FIELDS)
+        )
+
+    return with_validators(response("Cars fetched successfully", data=res), etag, None)
+
+
+@bp.route('/cars/bulk', methods=['POST'])
+@admin_required
+@login_required
+@validated()
+def import_cars():
+    """
+    create cars from a CSV (text/csv) or NDJSON (application/x-ndjson) body,
+    returns the number of created cars and the errors of the rejected rows
+    """
+    res = import_rows(Car, read_rows(request), CARS_IMPORT_FIELDS)
+
+    if res['created']:
+        cache.invalidate(AVAILABLE_CARS)
+    return response('Cars imported', data=res)
+
+
+@bp.route('/cars/export', methods=['GET'])
+@admin_required
+@login_required
+@validated()
+def export_cars():
+    mimetype = export_format(request)
+    rows = export_rows(Car, ('id',) + CARS_IMPORT_FIELDS, mimetype)
+    return current_app.response_class(stream_with_context(rows), mimetype=mimetype)
+
+
+@bp.route('/cars/available', methods=['GET'])
+@login_required
+@validated(AVAILABILITY_WINDOW)
+def search_available_cars():
+    """
+    cars bookable for [start, end), by the rule of the booking: available (not disabled by an admin) and
+    without any active reservation overlapping the window.
+    start and end are query parameters of format YYYY-MM-DD HH:MM
+    """
+    start, end = request.validated['start'], request.validated['end']
+
+    overlapping_reservation = db.session.query(Reservation.id).filter(
+        Reservation.car_id == Car.id, *reservation_overlaps(start, end)
+    ).exists()
+    cars = with_profile(Car.query, 'cars.list').filter(Car.is_available.is_(True), ~overlapping_reservation)
+    res = paginate_query(cars, Car, request, CARS_SORT_FIELDS)
 
     return response("Cars fetched successfully", data=res)
 
 
-@app.route('/cars/<car_id>/car', methods=['GET', 'DELETE', 'PATCH'])
+@bp.route('/cars/nearby', methods=['GET'])
 @login_required
+@validated(NEARBY_SEARCH)
+def search_nearby_cars():
+    """
+    nearest available cars around (lat, lon), at most radius km away, sorted by distance (in km).
+    Candidates are prefiltered in SQL with a bounding box on the location index,
+    then ranked with the exact haversine distance.
+    """
+    latitude, longitude, radius = request.validated['lat'], request.validated['lon'], request.validated['radius']
+    limit = get_page_size(request)
+
+    min_lat, max_lat, longitude_ranges = bounding_box(latitude, longitude, radius)
+    candidates = db.session.query(Location.car_id, Location.latitude, Location.longitude).join(
+        Car, Car.id == Location.car_id
+    ).filter(
+        Car.is_available.is_(True),
+        Location.latitude.between(min_lat, max_lat),
+        or_(*[Location.longitude.between(min_lon, max_lon) for min_lon, max_lon in longitude_ranges]),
+    )
+    distances = ((haversine(latitude, longitude, lat, lon), car_id) for car_id, lat, lon in candidates)
+    nearest = heapq.nsmallest(limit, (item for item in distances if item[0] <= radius))
+
+    cars = with_profile(Car.query, 'cars.list').filter(
+        Car.id.in_([car_id for _, car_id in nearest]), Car.is_available.is_(True))
+    cars_by_id = {car.id: car for car in cars}
+    # a candidate deleted or disabled since the first query is skipped
+    results = [dict(serialize(cars_by_id[car_id]), distance=round(distance, 3))
+               for distance, car_id in nearest if car_id in cars_by_id]
+
+    return response("Cars fetched successfully", data={'count': len(results), 'results': results})
+
+
+@bp.route('/cars/locations', methods=['POST'])
+@admin_required
+@login_required
+@validated(BULK_LOCATIONS)
+def ingest_locations():
+    """
+    update the positions of a fleet in one batch, locations of cars without one are created
+    """
+    positions = {
+        location['car_id']: (location['latitude'], location['longitude'])
+        for location in request.validated['locations']
+    }
+    check_cars_exist(positions)
+
+    existing = dict(db.session.query(Location.car_id, Location.id).filter(Location.car_id.in_(positions)))
+    updated = [
+        {'id': existing[car_id], 'latitude': latitude, 'longitude': longitude}
+        for car_id, (latitude, longitude) in positions.items() if car_id in existing
+    ]
+    created = [
+        {'car_id': car_id, 'latitude': latitude, 'longitude': longitude}
+        for car_id, (latitude, longitude) in positions.items() if car_id not in existing
+    ]
+    db.session.bulk_update_mappings(Location, updated)
+    db.session.bulk_insert_mappings(Location, created)
+    # the location is part of the car details
+    db.session.execute(touch(Car, *positions))
+    for car_id in positions:
+        invalidate_car(car_id)
+    db.session.commit()
+
+    return response('Locations updated successfully', data={'updated': len(updated), 'created': len(created)})
+
+
+@bp.route('/cars/<int:car_id>/car', methods=['GET', 'DELETE', 'PATCH'])
+@login_required
+@validated(CAR_UPDATE, methods=('PATCH',), admin_schema=CAR_UPDATE_ADMIN)
 def get_car(car_id):
-    car = Car.query.filter_by(id=car_id).first()
-    is_admin = session['user']['is_admin']
+    is_admin = current_user()['is_admin']
 
     if request.method == 'GET':
-        if car:
-            return response('Car fetched successfully', data=car)
-        else:
+        validators = cache.get_or_set(car_namespace(car_id), 'validators', lambda: _from_primary(
+            lambda: resource_validators(car_id, db.session.execute(resource_version(Car, car_id)).first())))
+        if not validators:
             return response('Car not found', 404)
-    elif request.method == 'PATCH' and is_admin:
-        if not car:
+        if not_modified(request, *validators):
+            return not_modified_response(*validators)
+
+        # the detail is cached with the validators of the same row: the ETag sent with a body is always its own
+        detail = cache.get_or_set(car_namespace(car_id), 'detail', lambda: _from_primary(
+            lambda: car_detail(with_profile(Car.query, 'cars.detail').filter_by(id=car_id).first())))
+        if detail:
+            validators, car = detail
+            return with_validators(response('Car fetched successfully', data=car), *validators)
+        else:
             return response('Car not found', 404)
 
-        car_validator = CarsValidator(request)
+    if request.method == 'PATCH' and is_admin:
+        # a single UPDATE of the validated fields, at the version of If-Match if sent
+        versions = if_match_versions(request, car_id)
         try:
-            allowed_fields = car_validator.update_car()
-        except (WrongType, InputNotAcceptable, RecordAlreadyExists) as e:
-            return response(e.message, e.status_code)
+            updated = db.session.execute(versioned_update(Car, car_id, request.validated, versions)).rowcount
+        except IntegrityError:
+            db.session.rollback()
+            return response('license_plate already exists', 400)
+        if not updated:
+            db.session.rollback()
+            if versions is None or not db.session.query(Car.id).filter_by(id=car_id).first():
+                return response('Car not found', 404)
+            return response('Car was modified since it was fetched', 412)
 
-        body = request.json
-        for field_name, field_value in body.items():
-            if field_name in allowed_fields:
-                car.field_name = field_value
-
-        if is_admin and 'is_available' in body:
-            car.is_admin = body['is_available']
+        invalidate_car(car_id)
         db.session.commit()
-        return response(f"Car {car.id} updated successfully")
+        return response(f"Car {car_id} updated successfully")
     else:  # DELETE
         if not is_admin:
             return response('Access to this resource is denied', 403)
+        car = with_profile(Car.query, 'cars.detail').filter_by(id=car_id).first()
+        if not car:
+            return response('Car not found', 404)
 
         db.session.delete(car)
+        invalidate_car(car.id)
         db.session.commit()
 
         return response('Car deleted successfully')
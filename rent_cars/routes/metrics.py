@@ -0,0 +1,13 @@
+from flask import Blueprint, current_app
+
+from rent_cars.utils.metrics import render_metrics
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus text format, request / SQL / serialization metrics need INSTRUMENTATION=on
+    """
+    return current_app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,68 @@
+import click
+from flask import Blueprint, request
+
+from rent_cars import login_required, admin_required
+from rent_cars.utils.core import get_page_size
+from rent_cars.utils.formatter import response
+from rent_cars.utils.reporting import (daily_reservations, reservations_summary, car_utilisation,
+                                       refresh_daily_summary, refresh_if_stale)
+from rent_cars.utils.schema import validated
+from rent_cars.utils.validators import REPORT_WINDOW
+
+# the CLI commands are registered at the top level: flask refresh-reports
+bp = Blueprint('reports', __name__, cli_group=None)
+
+
+@bp.route('/reports/reservations/daily', methods=['GET'])
+@admin_required
+@login_required
+@validated(REPORT_WINDOW)
+def report_daily_reservations():
+    """
+    reservations, cancellations and rental hours per day of creation, ?start=YYYY-MM-DD&end=YYYY-MM-DD
+    """
+    start, end = request.validated['start'], request.validated['end']
+
+    refresh_if_stale()
+    return response('Report fetched successfully', data=daily_reservations(start, end))
+
+
+@bp.route('/reports/reservations/summary', methods=['GET'])
+@admin_required
+@login_required
+@validated(REPORT_WINDOW)
+def report_reservations_summary():
+    """
+    cancellation rate and average rental duration of the reservations created during the window
+    """
+    start, end = request.validated['start'], request.validated['end']
+
+    refresh_if_stale()
+    data = reservations_summary(start, end)
+    data.update(start=start.isoformat(), end=end.isoformat())
+    return response('Report fetched successfully', data=data)
+
+
+@bp.route('/reports/cars/utilisation', methods=['GET'])
+@admin_required
+@login_required
+@validated(REPORT_WINDOW)
+def report_car_utilisation():
+    """
+    share of the window during which each car was rented, most used cars first, paginated with ?limit=&page=
+    """
+    start, end = request.validated['start'], request.validated['end']
+
+    limit = get_page_size(request)
+    page = max(1, request.args.get('page', 1, type=int))
+    return response('Report fetched successfully', data=car_utilisation(start, end, limit, (page - 1) * limit))
+
+
+@bp.cli.command('refresh-reports')
+@click.option('--full', is_flag=True, help='recompute every day, needed after reservations were deleted')
+def refresh_reports(full):
+    """
+    refresh the daily reservations summary, to be run by a scheduler
+    """
+    days = refresh_daily_summary(full=full)
+    click.echo(f'{days} day(s) refreshed')
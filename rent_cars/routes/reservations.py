@@ -1,65 +1,100 @@
+from datetime import datetime, timedelta
+
 from werkzeug.security import generate_password_hash
 
-from rent_cars import app, login_required, admin_required, db
+from rent_cars import login_required, admin_required, db
 from rent_cars.models import User, Reservation, Car
-from flask import request, session
-
-from rent_cars.utils.core import paginate_results
-from rent_cars.utils.custom_exceptions import (WrongType, InputNotAcceptable, RecordAlreadyExists,
-                                               MissingMandatoryFields, WrongFormat, PasswordsNotMatching)
+from flask import Blueprint, current_app, request, stream_with_context
+from sqlalchemy.exc import IntegrityError
+
+from rent_cars.utils.accounts import current_user
+from rent_cars.utils.bulk import export_rows, export_format
+from rent_cars.utils.cache import invalidate_car
+from rent_cars.utils.conditional import touch
+from rent_cars.utils.core import paginate_query
 from rent_cars.utils.formatter import response
-from rent_cars.utils.validators import AccountsValidator, ReservationsValidator
-from rent_cars.config import ROWS_PER_PAGE
+from rent_cars.utils.outbox import publish
+from rent_cars.utils.ratelimit import rate_limited
+from rent_cars.utils.schema import validated
+from rent_cars.utils.validators import RESERVATION, REPORT_WINDOW, lock_available_car
+
+bp = Blueprint('reservations', __name__)
+
+RESERVED = Reservation.ReservationStatus.reserved
+
+RESERVATIONS_SORT_FIELDS = ('id', 'reservation_start_date', 'reservation_end_date', 'date_created')
+RESERVATIONS_EXPORT_FIELDS = ('id', 'car_id', 'user_id', 'status', 'reservation_start_date', 'reservation_end_date',
+                              'date_created', 'date_last_update')
 
 
-@app.route('/reservations', methods=['GET', 'POST'])
+@bp.route('/reservations', methods=['GET', 'POST'])
 @login_required
+@rate_limited('booking', methods=('POST',))
+@validated(RESERVATION, methods=('POST',))
 def manage_reservations():
     """
     admin user can list all reservations
     base user can add new reservation
     """
     if request.method == 'POST':
-        reservation_validator = ReservationsValidator(request)
-        try:
-            mandatory_fields = reservation_validator.add_reservation()
-        except (MissingMandatoryFields, WrongFormat, InputNotAcceptable,
-                PasswordsNotMatching, RecordAlreadyExists) as e:
-            return response(e.message, e.status_code)
-        body = request.json
-        car_id = body.get('car_id')
-        params = {field: body.get(field) for field in mandatory_fields}
-        current_user_id = session['user']['id']
+        params = dict(request.validated)
+        # done last: the car row stays locked until the end of the transaction
+        car = lock_available_car(params['car_id'], params['reservation_start_date'], params['reservation_end_date'])
+        current_user_id = current_user()['id']
         params['user_id'] = current_user_id
+        # the reservation is part of the user details. Run before the reservation is added:
+        # the statement flushes the session, a conflict must only be raised by the commit below
+        db.session.execute(touch(User, current_user_id))
 
         reservation = Reservation(**params)
         db.session.add(reservation)
+        publish('reservation.created', reservation)
+        invalidate_car(car.id)
 
-        # car not available anymore
-        car = Car.query.filter_by(id=car_id).first()
-        car.is_available = False
-
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # the user has an active reservation already, booked concurrently
+            db.session.rollback()
+            return response('Reservation conflicts with an existing one', 409)
         return response('Reservation created successfully', data=reservation)
 
     else:
-        page = request.args.get('page', 1, type=int)
-        if session['user']['is_admin']:
-            reservations = Reservation.query.paginate(page=page, per_page=ROWS_PER_PAGE)
+        if current_user()['is_admin']:
+            reservations = Reservation.query
         else:
             # get reservations of current user only
-            current_user_id = session['user']['id']
-            reservations = Reservation.query.filter_by(user_id=current_user_id).paginate(page=page, per_page=ROWS_PER_PAGE)
+            current_user_id = current_user()['id']
+            reservations = Reservation.query.filter_by(user_id=current_user_id)
 
-        res = paginate_results(reservations, request)
+        res = paginate_query(reservations, Reservation, request, RESERVATIONS_SORT_FIELDS)
         return response("Reservations fetched successfully", data=res)
 
 
-@app.route('/reservations/<reservation_id>/reservation', methods=['GET'])
+@bp.route('/reservations/export', methods=['GET'])
+@admin_required
+@login_required
+@validated(REPORT_WINDOW)
+def export_reservations():
+    """
+    reservation history as NDJSON (default) or CSV, streamed from a server-side cursor,
+    optionally restricted to the reservations created during ?start=YYYY-MM-DD&end=YYYY-MM-DD
+    """
+    criteria = []
+    mimetype = export_format(request)
+    if 'start' in request.args or 'end' in request.args:
+        start, end = request.validated['start'], request.validated['end']
+        criteria = [Reservation.date_created >= start, Reservation.date_created < end + timedelta(days=1)]
+
+    rows = export_rows(Reservation, RESERVATIONS_EXPORT_FIELDS, mimetype, *criteria)
+    return current_app.response_class(stream_with_context(rows), mimetype=mimetype)
+
+
+@bp.route('/reservations/<reservation_id>/reservation', methods=['GET'])
 @login_required
 def get_reservation(reservation_id):
     reservation = Reservation.query.filter_by(id=reservation_id).first()
-    current_user_id = session['user']['id']
+    current_user_id = current_user()['id']
 
     if not reservation or reservation.id != current_user_id:
         return response('Reservation not found', 404)
@@ -67,24 +102,39 @@ def get_reservation(reservation_id):
     return response('Reservation fetched successfully', data=reservation)
 
 
-@app.route('/reservations/<reservation_id>/cancel', methods=['PATCH'])
+@bp.route('/reservations/<reservation_id>/cancel', methods=['PATCH'])
 @login_required
 def cancel_reservation(reservation_id):
-    reservation = Reservation.query.filter_by(id=reservation_id).first()
-    if not reservation:
+    """
+    the owner of an active reservation, or an admin, can cancel it: its period is free again
+    """
+    reservation = Reservation.query.filter_by(id=reservation_id).with_for_update().first()
+    user = current_user()
+    if not reservation or (reservation.user_id != user['id'] and not user['is_admin']):
         return response('Reservation not found', 404)
-
-    #
-    car = Car.query.filter_by(id=reservation.car_id).first()
-    reservation.status = 'cancelled'
-    car.is_available = True
+    if reservation.status != RESERVED:
+        return response('Reservation is not active', 409)
+
+    # picked up by the incremental refresh of the reports
+    updated = Reservation.query.filter_by(id=reservation.id, status=RESERVED).update(
+        {'status': Reservation.ReservationStatus.cancelled, 'date_last_update': datetime.utcnow()})
+    if not updated:
+        # without row locks (e.g. sqlite) a concurrent cancel or expiry ended it first
+        db.session.rollback()
+        return response('Reservation is not active', 409)
+    # the reservation is part of the car and user details. Single UPDATEs: concurrent edits of the car
+    # do not conflict on its version
+    db.session.execute(touch(Car, reservation.car_id))
+    db.session.execute(touch(User, reservation.user_id))
+    invalidate_car(reservation.car_id)
+    publish('reservation.cancelled', reservation)
 
     db.session.commit()
 
     return response('Reservation cancelled successfully')
 
 
-@app.route('/reservations/<reservation_id>/reservation', methods=['DELETE'])
+@bp.route('/reservations/<reservation_id>/reservation', methods=['DELETE'])
 @admin_required
 @login_required
 def delete_reservation(reservation_id):
@@ -94,6 +144,10 @@ def delete_reservation(reservation_id):
         return response('Reservation not found', 404)
 
     db.session.delete(reservation)
+    # the reservation is part of the car and user details
+    db.session.execute(touch(Car, reservation.car_id))
+    db.session.execute(touch(User, reservation.user_id))
+    invalidate_car(reservation.car_id)
     db.session.commit()
 
     return response('Reservation deleted successfully')
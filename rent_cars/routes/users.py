@@ -1,92 +1,178 @@
-from werkzeug.security import generate_password_hash
+from rent_cars import login_required, admin_required, db
+from rent_cars.models import User, Car, License
+from flask import Blueprint, current_app, request, stream_with_context
+from sqlalchemy.exc import IntegrityError
+
+from rent_cars.utils.accounts import current_user
+from rent_cars.utils.bulk import read_rows, import_rows, export_rows, export_format
+from rent_cars.utils.cache import cache, invalidate_car, invalidate_on_commit, principal_namespace, ALL_USERS
+from rent_cars.utils.conditional import (touch, resource_version, collection_version, resource_validators,
+                                         collection_validators, not_modified, not_modified_response, with_validators,
+                                         versioned_update, if_match_versions)
+from rent_cars.utils.core import paginate_query
+from rent_cars.utils.formatter import response
+from rent_cars.utils.passwords import hash_password, hash_passwords
+from rent_cars.utils.replicas import primary
+from rent_cars.utils.loading import with_profile
+from rent_cars.utils.schema import validated
+from rent_cars.utils.validators import (REGISTRATION, USER_UPDATE, USER_UPDATE_ADMIN, registration_conflicts,
+                                        validate_uniqueness)
 
-from rent_cars import app, login_required, admin_required, db
-from rent_cars.models import User
-from flask import request, session
+bp = Blueprint('users', __name__)
 
-from rent_cars.utils.core import paginate_results
-from rent_cars.utils.custom_exceptions import (WrongType, InputNotAcceptable, RecordAlreadyExists,
-                                               MissingMandatoryFields, WrongFormat, PasswordsNotMatching)
-from rent_cars.utils.formatter import response
-from rent_cars.utils.validators import AccountsValidator
-from rent_cars.config import ROWS_PER_PAGE
+USERS_SORT_FIELDS = ('id', 'username', 'email', 'date_created')
+USERS_IMPORT_FIELDS = ('username', 'email', 'password', 'is_admin')
+USERS_EXPORT_FIELDS = ('id', 'username', 'email', 'is_admin', 'last_login', 'date_created')
 
 
-@app.route('/users', methods=['GET', 'POST'])
+@bp.route('/users', methods=['GET', 'POST'])
 @admin_required
 @login_required
+@validated(REGISTRATION, methods=('POST',))
 def manage_users():
     """
     admin users can fetch all the users info
     admin can use this endpoint for POST
     """
-    if session['user']['is_admin'] and request.method == 'POST':
-        user_validator = AccountsValidator(request)
-        try:
-            mandatory_fields = user_validator.registration()
-        except (MissingMandatoryFields, WrongFormat, InputNotAcceptable,
-                PasswordsNotMatching, RecordAlreadyExists) as e:
-            return response(e.message, e.status_code)
-        body = request.json
-        params = {field: body.get(field) for field in mandatory_fields}
-
-        user = User(**params)
+    if current_user()['is_admin'] and request.method == 'POST':
+        body = request.validated
+        user = User(username=body['username'], email=body['email'], password=hash_password(body['password1']),
+                    licenses=License(license_number=body['license_number'], date_issued=body['date_issued'],
+                                     date_expiry=body['date_expiry']))
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            registration_conflicts(body)
+            return response('User already exists', 400)
 
         return response('User created successfully')
 
-    page = request.args.get('page', 1, type=int)
-    users = User.query.paginate(page=page, per_page=ROWS_PER_PAGE)
-    res = paginate_results(users, request)
+    def load_version():
+        # cached: read from the primary, a lagging replica would cache stale data right after an invalidation
+        with primary():
+            return tuple(db.session.execute(collection_version(User)).one())
+
+    # invalidated by every write of the users
+    version = cache.get_or_set(ALL_USERS, 'version', load_version)
+    etag = collection_validators(request, *version)
+    if not_modified(request, etag, None):
+        return not_modified_response(etag, None)
+
+    res = paginate_query(with_profile(User.query, 'users.list'), User, request, USERS_SORT_FIELDS)
 
-    return response("Users fetched successfully", data=res)
+    return with_validators(response("Users fetched successfully", data=res), etag, None)
 
 
-@app.route('/users/<user_id>/user', methods=['GET', 'DELETE', 'PATCH'])
+def _hash_passwords(rows):
+    for row, password_hash in zip(rows, hash_passwords([row['password'] for row in rows])):
+        row['password'] = password_hash
+    return rows
+
+
+@bp.route('/users/bulk', methods=['POST'])
+@admin_required
 @login_required
+@validated()
+def import_users():
+    """
+    create users from a CSV (text/csv) or NDJSON (application/x-ndjson) body,
+    returns the number of created users and the errors of the rejected rows
+    """
+    res = import_rows(User, read_rows(request), USERS_IMPORT_FIELDS, prepare_rows=_hash_passwords)
+
+    return response('Users imported', data=res)
+
+
+@bp.route('/users/export', methods=['GET'])
+@admin_required
+@login_required
+@validated()
+def export_users():
+    mimetype = export_format(request)
+    rows = export_rows(User, USERS_EXPORT_FIELDS, mimetype)
+    return current_app.response_class(stream_with_context(rows), mimetype=mimetype)
+
+
+@bp.route('/users/<user_id>/user', methods=['GET', 'DELETE', 'PATCH'])
+@login_required
+@validated(USER_UPDATE, methods=('PATCH',), admin_schema=USER_UPDATE_ADMIN)
 def mange_user(user_id):
     """
     admin user can fetch any user info
     base user can fetch only his user info
     only admin user delete accounts
     """
-    user = User.query.filter_by(id=user_id).first()
-    current_user_id = session['user']['id']
-    is_admin = session['user']['is_admin']
+    current_user_id = current_user()['id']
+    is_admin = current_user()['is_admin']
 
     if request.method == 'GET':
         # admin can fetch any user
         # base user will fetch only his user info
-        if user and is_admin or user and user.id == current_user_id:
-            return response('User fetched successfully', data=user)
-        else:
+        validators = None
+        if is_admin or str(user_id) == str(current_user_id):
+            validators = resource_validators(user_id, db.session.execute(resource_version(User, user_id)).first())
+        if not validators:
             return response('user not found', 404)
-    elif request.method == 'PATCH':
-        if not user or current_user_id != user.id:
+        if not_modified(request, *validators):
+            return not_modified_response(*validators)
+
+        user = with_profile(User.query, 'users.detail').filter_by(id=user_id).first()
+        if not user:
+            return response('user not found', 404)
+        # the validators of the loaded row: a concurrent update may have committed since the first read
+        validators = resource_validators(user.id, (user.date_last_update, user.version))
+        return with_validators(response('User fetched successfully', data=user), *validators)
+
+    if request.method == 'PATCH':
+        if str(user_id) != str(current_user_id):
             return response('User not found', 404)
 
-        user_validator = AccountsValidator(request)
-        try:
-            user_validator.update_user()
-        except (WrongType, InputNotAcceptable, RecordAlreadyExists) as e:
-            return response(e.message, e.status_code)
+        body = request.validated
+        validate_uniqueness((User, 'username', body.get('username')))
 
-        body = request.json
+        values = {}
         if body.get('username'):
-            user.username = body['username']
+            values['username'] = body['username']
         if body.get('password'):
-            user.password = generate_password_hash(body['password'])
+            values['password'] = hash_password(body['password'])
 
         if is_admin and body.get('is_admin'):
-            user.is_admin = body['is_admin']
+            values['is_admin'] = body['is_admin']
 
+        # a single UPDATE, at the version of If-Match if sent
+        versions = if_match_versions(request, current_user_id)
+        try:
+            updated = db.session.execute(versioned_update(User, current_user_id, values, versions)).rowcount
+        except IntegrityError:
+            # username taken between the validation and the update
+            db.session.rollback()
+            return response('username already exists', 400)
+        if not updated:
+            db.session.rollback()
+            if versions is None:
+                return response('User not found', 404)
+            return response('User was modified since it was fetched', 412)
+
+        # the sessions of the user see the change at once
+        invalidate_on_commit(principal_namespace(current_user_id))
         db.session.commit()
-        return response(f"user {user.id} updated successfully")
+        return response(f"user {current_user_id} updated successfully")
     else:  # DELETE
         if not is_admin:
             return response('Access to this resource is denied', 403)
 
+        user = with_profile(User.query, 'users.detail').filter_by(id=user_id).first()
+        if not user:
+            return response('user not found', 404)
+
+        if user.reservation:
+            # the active reservation is deleted in cascade, it is part of the car details
+            db.session.execute(touch(Car, user.reservation.car_id))
+            invalidate_car(user.reservation.car_id)
+        # the sessions of a deleted user are rejected from now on
+        invalidate_on_commit(principal_namespace(user.id))
         db.session.delete(user)
         db.session.commit()
 
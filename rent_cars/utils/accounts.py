@@ -1,10 +1,62 @@
-from flask import session, jsonify
+from flask import session
+from sqlalchemy import select
+
+from rent_cars import db
+from rent_cars.config import SESSION_BACKEND
+from rent_cars.models import User
+from .cache import cache, principal_namespace
 from .formatter import response
+from .replicas import primary
+
+
+# the invalidations of the cache only reach the current process: the principals are cached with the memory
+# sessions (a single process), the processes sharing the database sessions read them on every request
+CACHE_PRINCIPALS = SESSION_BACKEND == 'memory'
+
+
+def principal(user):
+    """
+    compact identity of a logged in user, kept apart from its sessions so that changes
+    of the user (is_admin, deletion) apply to them at once
+    """
+    return {'id': user.id, 'is_admin': bool(user.is_admin)}
+
+
+def _load_principal(user_id):
+    # cache entries are filled from the primary, see routes/cars.py
+    with primary():
+        row = db.session.query(User.id, User.is_admin).filter_by(id=user_id).first()
+    return principal(row) if row else None
+
+
+def current_user():
+    """
+    principal of the logged in user, None when logged out or when the user was deleted.
+    Read from the cache (CACHE_PRINCIPALS), one query on a miss.
+    """
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+
+    if CACHE_PRINCIPALS:
+        user = cache.get_or_set(principal_namespace(user_id), 'principal', lambda: _load_principal(user_id))
+    else:
+        user = _load_principal(user_id)
+    if user is None:
+        session.clear()
+    return user
+
+
+def login_user(user_session, user):
+    user_session.rotate()
+    user_session['user_id'] = user.id
+    if CACHE_PRINCIPALS:
+        cache.get_or_set(principal_namespace(user.id), 'principal', lambda: principal(user))
 
 
 def login_required(f):
     def wrapper(*args, **kwargs):
-        if 'user' not in session:
+        if current_user() is None:
             return response('Unauthorized', 401)
         return f(*args, **kwargs)
     #  to fix: View function mapping is overwriting an existing endpoint function: decorator_function
@@ -15,10 +67,42 @@ def login_required(f):
 
 def admin_required(f):
     def wrapper(*args, **kwargs):
-        if not session.get('user', {}).get('is_admin'):
+        user = current_user()
+        if not user or not user['is_admin']:
             return response('Access to this resource is denied', 403)
         return f(*args, **kwargs)
     #  to fix: View function mapping is overwriting an existing endpoint function: decorator_function
     wrapper.__name__ = f.__name__
 
     return wrapper
+
+
+async def _load_principal_async(user_id):
+    # the async engine is only needed by the ASGI app, the WSGI workers don't import it
+    from .async_database import async_session
+
+    async with async_session() as db_session:
+        row = (await db_session.execute(select(User.id, User.is_admin).filter_by(id=user_id))).first()
+    return principal(row) if row else None
+
+
+def async_login_required(f):
+    """
+    login_required of the async endpoints (rent_cars.asgi), the session and the principal (request.user)
+    are attached to their request
+    """
+    async def wrapper(request, *args, **kwargs):
+        user_id = request.session.get('user_id')
+        request.user = None
+        if user_id is not None and CACHE_PRINCIPALS:
+            request.user = await cache.get_or_set_async(principal_namespace(user_id), 'principal',
+                                                        lambda: _load_principal_async(user_id))
+        elif user_id is not None:
+            request.user = await _load_principal_async(user_id)
+        if request.user is None:
+            request.session.clear()
+            return response('Unauthorized', 401)
+        return await f(request, *args, **kwargs)
+    wrapper.__name__ = f.__name__
+
+    return wrapper
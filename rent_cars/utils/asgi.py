@@ -0,0 +1,171 @@
+"""
+ASGI plumbing of the async serving mode (rent_cars.asgi): request parsing, sending of the Flask responses,
+and a bridge serving the requests that have no async endpoint with the Flask (WSGI) app in a thread pool.
+"""
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.exceptions import BadRequest
+from werkzeug.http import parse_cookie, parse_date, parse_etags
+
+
+class AsgiRequest:
+    """
+    the attributes of flask.request used by the validators, the pagination, the conditional requests,
+    the rate limits and the session interface
+    """
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.body = body
+        self.headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']])
+        self.query_string = scope['query_string'].decode('latin-1')
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.cookies = parse_cookie(self.headers.get('Cookie', ''))
+        # behind proxies, uvicorn sets the client from X-Forwarded-For (--proxy-headers)
+        self.remote_addr = (scope.get('client') or ('', 0))[0]
+        self.session = None
+        self.user = None
+        self.validated = None
+
+    @property
+    def base_url(self):
+        host = self.headers.get('Host') or '{}:{}'.format(*self.scope['server'])
+        return f"{self.scope.get('scheme', 'http')}://{host}{self.scope.get('root_path', '')}{self.path}"
+
+    @property
+    def url(self):
+        return f'{self.base_url}?{self.query_string}' if self.query_string else self.base_url
+
+    @cached_property
+    def if_none_match(self):
+        return parse_etags(self.headers.get('If-None-Match'))
+
+    @cached_property
+    def if_modified_since(self):
+        return parse_date(self.headers.get('If-Modified-Since'))
+
+    @cached_property
+    def json(self):
+        # same as flask: None when the body is not sent as json, 400 when it can't be decoded
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise BadRequest('Failed to decode JSON object')
+
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+def _asgi_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def send_response(send, res):
+    await send({'type': 'http.response.start', 'status': res.status_code,
+                'headers': _asgi_headers(res.headers.to_wsgi_list())})
+    await send({'type': 'http.response.body', 'body': res.get_data()})
+
+
+async def run_in_thread(function, *args):
+    """
+    run a blocking call (e.g. password hashing) without blocking the event loop
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ[name] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class WsgiBridge:
+    """
+    serve ASGI requests with a WSGI app running in a thread pool.
+    The app and the iteration of its response run in the same thread (stream_with_context relies on the
+    request context of the thread), the chunks are handed over to the event loop as they are produced.
+    """
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, body, send):
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+
+        def put(message):
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+
+        done = loop.run_in_executor(self.executor, self._run, wsgi_environ(scope, body), put)
+        while True:
+            message = await messages.get()
+            if message is None:
+                break
+            await send(message)
+        # raises the exception of the app, if any
+        await done
+
+    def _run(self, environ, put):
+        def start_response(status, headers, exc_info=None):
+            put({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                 'headers': _asgi_headers(headers)})
+
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if chunk:
+                        put({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+            put({'type': 'http.response.body', 'body': b''})
+        finally:
+            put(None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
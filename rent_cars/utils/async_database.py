@@ -0,0 +1,61 @@
+"""
+Async engine of the ASGI endpoints (rent_cars.asgi), connected to the same database as the Flask-SQLAlchemy
+engine through an asyncio driver (asyncpg for postgres, aiosqlite for sqlite).
+The engine is created on first use, from the event loop of the server, with the database URI of the app.
+"""
+from flask import current_app
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from rent_cars.config import (ASYNC_DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+                              DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT, DB_LOCK_TIMEOUT)
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+_engine = None
+_session_factory = None
+
+
+def async_database_uri(database_uri):
+    scheme, location = database_uri.split('://', 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{location}"
+
+
+def async_engine_options(database_uri):
+    if not database_uri.startswith('postgresql'):
+        return {}
+
+    return {
+        'pool_size': ASYNC_DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'connect_args': {'server_settings': {
+            'statement_timeout': str(DB_STATEMENT_TIMEOUT),
+            'lock_timeout': str(DB_LOCK_TIMEOUT),
+        }},
+    }
+
+
+def get_async_engine():
+    global _engine, _session_factory
+    if _engine is None:
+        database_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
+        _engine = create_async_engine(async_database_uri(database_uri), **async_engine_options(database_uri))
+        # objects stay loaded after the commit, lazy loads are not possible in async code
+        _session_factory = sessionmaker(_engine, class_=AsyncSession, expire_on_commit=False)
+    return _engine
+
+
+def async_session():
+    get_async_engine()
+    return _session_factory()
+
+
+async def dispose_async_engine():
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+
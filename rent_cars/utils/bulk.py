@@ -0,0 +1,253 @@
+"""
+Streaming bulk import / export of model rows, as CSV or NDJSON (one JSON object per line).
+
+Imports are read from the request stream and processed by chunks of BULK_CHUNK_SIZE rows:
+the rows are converted and validated against the model columns, the unique columns are checked
+with one query per chunk, then the valid rows are inserted with a single multi-row INSERT. A chunk
+refused by the database (e.g. conflicting with rows inserted meanwhile) is inserted again row by row, the
+refused rows are reported with the others.
+Exports iterate over a server-side cursor and are sent as a generator, so the memory used does
+not depend on the size of the table.
+"""
+import csv
+import enum
+import io
+import json
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import or_
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+
+from rent_cars import db
+from rent_cars.config import BULK_CHUNK_SIZE
+from .custom_exceptions import WrongFormat
+
+CSV = 'text/csv'
+NDJSON = 'application/x-ndjson'
+TRUE_VALUES = {'true', '1', 'yes'}
+FALSE_VALUES = {'false', '0', 'no', ''}
+
+
+def read_rows(request):
+    """
+    yield (row number, row) from the body of the request
+    """
+    if request.mimetype not in (CSV, NDJSON):
+        raise WrongFormat(f'Content-Type should be {CSV} or {NDJSON}', 415)
+
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='' if request.mimetype == CSV else None)
+    try:
+        if request.mimetype == CSV:
+            yield from enumerate(csv.DictReader(stream), start=1)
+            return
+
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None
+    except UnicodeDecodeError:
+        raise WrongFormat('Body should be encoded in UTF-8')
+    except csv.Error as e:
+        raise WrongFormat(f'CSV body is not valid: {e}')
+
+
+def _convert(value, column):
+    python_type = column.type.python_type
+    if python_type is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in TRUE_VALUES | FALSE_VALUES:
+            return value.lower() in TRUE_VALUES
+        raise ValueError
+    if python_type is int and isinstance(value, bool):
+        raise ValueError
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    return python_type(value)
+
+
+def _default(column):
+    default = column.default.arg if column.default is not None else None
+    return default(None) if callable(default) else default
+
+
+def _validate_row(row, columns):
+    if not isinstance(row, dict):
+        return None, ['row should be an object']
+
+    values = {}
+    errors = []
+    for column in columns:
+        value = row.get(column.name)
+        if value is None or value == '':
+            if not column.nullable and column.default is None:
+                errors.append(f'{column.name} is mandatory')
+            else:
+                # every row of a chunk has the same keys, they are inserted by a single statement
+                values[column.name] = _default(column)
+            continue
+        try:
+            value = _convert(value, column)
+        except (TypeError, ValueError):
+            errors.append(f'{column.name} should be of type {column.type.python_type.__name__}')
+            continue
+        if getattr(column.type, 'length', None) and len(value) > column.type.length:
+            errors.append(f'{column.name} should be at most {column.type.length} characters')
+            continue
+        values[column.name] = value
+
+    return values, errors
+
+
+def _existing_values(unique_columns, rows):
+    """
+    values of the unique columns of rows already in the table, by column name
+    """
+    existing = db.session.query(*unique_columns).filter(or_(*[
+        column.in_([values[column.name] for _, values in rows]) for column in unique_columns
+    ])).all()
+    return {column.name: {row[i] for row in existing} for i, column in enumerate(unique_columns)}
+
+
+def _conflicts(unique_columns, values, existing):
+    return [
+        f'{column.name} already exists' for column in unique_columns
+        if values[column.name] in existing[column.name]
+    ]
+
+
+def _is_row_error(e):
+    # the rows are refused (constraints, values, parameters), other database errors (connection, timeouts)
+    # are answered by the error handlers of utils/database.py
+    return isinstance(e, (IntegrityError, DataError)) or not isinstance(e, DBAPIError)
+
+
+def _insert_rows(model, rows, unique_columns, errors):
+    """
+    insert the rows in one INSERT, or row by row when it fails (e.g. conflicts with rows inserted meanwhile).
+    returns the number of created rows, the errors of the refused rows are added to errors
+    """
+    try:
+        db.session.execute(model.__table__.insert(), [values for _, values in rows])
+        db.session.commit()
+        return len(rows)
+    except StatementError as e:
+        db.session.rollback()
+        if not _is_row_error(e):
+            raise
+
+    created = 0
+    for number, values in rows:
+        try:
+            db.session.execute(model.__table__.insert(), [values])
+            db.session.commit()
+            created += 1
+        except StatementError as e:
+            db.session.rollback()
+            if not _is_row_error(e):
+                raise
+            if isinstance(e, IntegrityError) and unique_columns:
+                row_errors = _conflicts(unique_columns, values, _existing_values(unique_columns, [(number, values)]))
+            else:
+                row_errors = []
+            errors.append({'row': number, 'errors': row_errors or ['row refused by the database']})
+    return created
+
+
+def import_rows(model, rows, fields, prepare_rows=None):
+    """
+    insert the valid rows and return the number of created rows with the errors of the others
+    prepare_rows is called on the valid rows of each chunk before their insertion
+    """
+    columns = [model.__table__.columns[field] for field in fields]
+    unique_columns = [column for column in columns if column.unique]
+    seen = {column.name: set() for column in unique_columns}
+    created = 0
+    errors = []
+
+    while True:
+        try:
+            chunk = list(islice(rows, BULK_CHUNK_SIZE))
+        except WrongFormat as e:
+            # the previous chunks are committed
+            if not created:
+                raise
+            raise WrongFormat(f'{e.message}, {created} row(s) were created before the error')
+        if not chunk:
+            break
+
+        valid_rows = []
+        for number, row in chunk:
+            values, row_errors = _validate_row(row, columns)
+            row_errors += [
+                f'{column.name} is duplicated in the import' for column in unique_columns
+                if values and values.get(column.name) in seen[column.name]
+            ]
+            if row_errors:
+                errors.append({'row': number, 'errors': row_errors})
+                continue
+            for column in unique_columns:
+                seen[column.name].add(values.get(column.name))
+            valid_rows.append((number, values))
+
+        if unique_columns and valid_rows:
+            existing = _existing_values(unique_columns, valid_rows)
+
+            rows_to_insert = []
+            for number, values in valid_rows:
+                row_errors = _conflicts(unique_columns, values, existing)
+                if row_errors:
+                    errors.append({'row': number, 'errors': row_errors})
+                else:
+                    rows_to_insert.append((number, values))
+            valid_rows = rows_to_insert
+
+        if valid_rows:
+            if prepare_rows:
+                valid_rows = list(zip([number for number, _ in valid_rows],
+                                      prepare_rows([values for _, values in valid_rows])))
+            created += _insert_rows(model, valid_rows, unique_columns, errors)
+
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'errors': errors}
+
+
+def _export_value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_rows(model, fields, export_format, *criteria):
+    """
+    generator of the CSV / NDJSON lines of the rows of model matching criteria, read through a server-side cursor
+    """
+    query = db.session.query(*[getattr(model, field) for field in fields]).filter(*criteria).order_by(model.id)
+    rows = query.execution_options(stream_results=True).yield_per(BULK_CHUNK_SIZE)
+
+    if export_format == CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow([_export_value(value) for value in row])
+            if buffer.tell() > 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for row in rows:
+            yield json.dumps({field: _export_value(value) for field, value in zip(fields, row)}) + '\n'
+
+
+def export_format(request):
+    formats = {'csv': CSV, 'ndjson': NDJSON}
+    requested = request.args.get('format', 'ndjson')
+    if requested not in formats:
+        raise WrongFormat(f'format should be one of: {list(formats)}')
+    return formats[requested]
@@ -0,0 +1,207 @@
+"""
+Read-through cache of the car availability listing, the car details, the validators of the listings and the
+principals of the sessions.
+
+Every cached entry belongs to a namespace whose version number is part of the entry key.
+Invalidating a namespace bumps its version once the session commits, entries of the previous
+version are never read again and fall off the LRU. A reader that queried the database before
+the commit stores its (stale) result under the previous version, so once a write is committed
+no stale data can be served.
+
+The namespaces of TABLE_NAMESPACES (validators of the admin listings) are invalidated by the commit of any
+write to their table, whether flushed by the ORM or executed as an INSERT / UPDATE / DELETE statement.
+
+The in-process LRUBackend is used by default: its invalidations only reach the current process, so the cache
+is only enabled when a single process serves the app, i.e. with the memory sessions (utils/sessions.py).
+Processes sharing the database sessions read the database on every request. A shared backend (e.g. redis)
+only has to implement CacheBackend and be assigned to cache.backend, with cache.enabled set.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from itertools import chain
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from rent_cars import db
+from rent_cars.config import CACHE_TTL, CACHE_MAX_ENTRIES, SESSION_BACKEND
+from .metrics import register_collector
+
+AVAILABLE_CARS = 'cars:available'
+ALL_CARS = 'cars:all'
+ALL_USERS = 'users:all'
+# namespaces invalidated by every committed write of a table
+TABLE_NAMESPACES = {'car': ALL_CARS, 'user': ALL_USERS}
+
+
+def car_namespace(car_id):
+    return f'car:{car_id}'
+
+
+def principal_namespace(user_id):
+    return f'principal:{user_id}'
+
+
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        """
+        increment an integer counter atomically and return its new value
+        """
+        raise NotImplementedError
+
+
+class LRUBackend(CacheBackend):
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return self._counters.get(key)
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        # counters are kept apart from the entries, they must not be evicted
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class Cache:
+    def __init__(self, backend, ttl=CACHE_TTL, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, namespace, key, loader):
+        """
+        return the cached value of key, call loader and cache its result on a miss
+        (None results are not cached)
+        """
+        if not self.enabled:
+            return loader()
+        entry_key, value = self._lookup(namespace, key)
+        if value is None:
+            value = loader()
+            self._store(entry_key, value)
+        return value
+
+    async def get_or_set_async(self, namespace, key, loader):
+        """
+        get_or_set of the async endpoints, loader returns an awaitable
+        """
+        if not self.enabled:
+            return await loader()
+        entry_key, value = self._lookup(namespace, key)
+        if value is None:
+            value = await loader()
+            self._store(entry_key, value)
+        return value
+
+    def _lookup(self, namespace, key):
+        version = self.backend.get(f'{namespace}:version') or 0
+        entry_key = f'{namespace}:{version}:{key}'
+
+        value = self.backend.get(entry_key)
+        if value is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry_key, value
+
+    def _store(self, entry_key, value):
+        if value is not None:
+            self.backend.set(entry_key, value, self.ttl)
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.incr(f'{namespace}:version')
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+cache = Cache(LRUBackend(), enabled=SESSION_BACKEND == 'memory')
+
+
+@register_collector
+def _cache_metrics():
+    stats = cache.stats()
+    return [
+        ('cache_hits_total', 'counter', 'Car cache hits', {(): stats['hits']}),
+        ('cache_misses_total', 'counter', 'Car cache misses', {(): stats['misses']}),
+    ]
+
+
+def invalidate_on_commit(*namespaces):
+    """
+    invalidate namespaces once the current transaction is committed
+    """
+    db.session.info.setdefault('cache_invalidations', set()).update(namespaces)
+
+
+def invalidate_car(car_id):
+    invalidate_on_commit(AVAILABLE_CARS, car_namespace(car_id))
+
+
+def _invalidate_table_on_commit(session, table):
+    namespace = TABLE_NAMESPACES.get(table.name)
+    if namespace:
+        session.info.setdefault('cache_invalidations', set()).add(namespace)
+
+
+# on every session, the sync session of an AsyncSession included
+@event.listens_for(Session, 'after_flush')
+def _invalidate_flushed_tables(session, flush_context):
+    for instance in chain(session.new, session.dirty, session.deleted):
+        _invalidate_table_on_commit(session, instance.__table__)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _invalidate_written_tables(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _invalidate_table_on_commit(orm_execute_state.session, orm_execute_state.statement.table)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    cache.invalidate(*session.info.pop('cache_invalidations', ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('cache_invalidations', None)
@@ -0,0 +1,114 @@
+"""
+HTTP conditional requests (ETag / Last-Modified, answered with 304 Not Modified) of the car and user resources.
+
+The validators are built from the version and date_last_update columns of the cars and users. Both are
+set by every update of the row (version_id_col of the mapper and onupdate), the write paths that change
+what a car / user embeds without updating its row (reservations, locations) update them with touch().
+- a single resource is validated by its id and version (ETag) and its date_last_update (Last-Modified)
+- a collection by the number of rows and their last date_last_update, plus the requested page (ETag only:
+  the last update does not change when a row leaves the collection). Counting the rows reads the whole
+  table: the listings cache them (utils/cache.py), until a write of the table
+
+The validators are read before the rows are loaded, so a 304 skips the query of the rows and
+their serialization.
+
+The edits are conditional as well: a client sending If-Match with the ETag it fetched only updates the
+resource if it is still at that version (412 Precondition Failed otherwise), in a single UPDATE.
+"""
+import hashlib
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import func, select, update
+
+
+def _version(model):
+    # mapped attribute of the version_id_col of the model
+    mapper = model.__mapper__
+    return getattr(model, mapper.get_property_by_column(mapper.version_id_col).key)
+
+
+def touch(model, *ids, values=None):
+    """
+    UPDATE statement marking rows of model as modified now (a new version), setting values if given
+    """
+    version = _version(model)
+    return update(model).where(model.id.in_(ids)).values(
+        {version.key: version + 1, 'date_last_update': datetime.utcnow(), **(values or {})})
+
+
+def versioned_update(model, resource_id, values, versions=None):
+    """
+    UPDATE statement setting values of a resource without loading it. With versions (see if_match_versions),
+    only a resource still at one of them is updated: a statement updating no row lost the race
+    """
+    version = _version(model)
+    statement = update(model).where(model.id == resource_id)
+    if versions is not None:
+        statement = statement.where(version.in_(versions))
+    return statement.values({version.key: version + 1, **values}).execution_options(synchronize_session=False)
+
+
+def resource_version(model, resource_id):
+    return select(model.date_last_update, model.version).filter_by(id=resource_id)
+
+
+def collection_version(model, *criteria):
+    return select(func.count(), func.max(model.date_last_update)).select_from(model).filter(*criteria)
+
+
+def resource_validators(resource_id, row):
+    """
+    (etag, last modified) of a resource from its resource_version row, None when it does not exist
+    """
+    if row is None:
+        return None
+    last_update, version = row
+    return f'{resource_id}-{version}', last_update
+
+
+def if_match_versions(request, resource_id):
+    """
+    versions of the resource matched by the If-Match header, None without precondition (no header or *).
+    Weak etags never match an If-Match
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    prefix = f'{resource_id}-'
+    return [int(etag[len(prefix):]) for etag in request.if_match.as_set()
+            if etag.startswith(prefix) and etag[len(prefix):].isdigit()]
+
+
+def collection_validators(request, count, last_update):
+    """
+    etag of the page of a collection requested by request. Collections have no last modified: the latest
+    update does not change when a row leaves the collection (deleted or filtered out), the count does
+    """
+    version = f'{request.url}:{count}:{last_update.isoformat() if last_update else ""}'
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+def not_modified(request, etag, last_modified):
+    """
+    whether the client already has the current representation, If-None-Match takes precedence
+    over If-Modified-Since (RFC 7232)
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    return False
+
+
+def with_validators(res, etag, last_modified):
+    res.set_etag(etag)
+    if last_modified:
+        res.last_modified = last_modified
+    # clients revalidate every time, shared caches do not store user data
+    res.cache_control.private = True
+    res.cache_control.no_cache = True
+    return res
+
+
+def not_modified_response(etag, last_modified):
+    return with_validators(current_app.response_class(status=304), etag, last_modified)
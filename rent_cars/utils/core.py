@@ -1,10 +1,166 @@
-from flask import jsonify
+import base64
+import json
+from datetime import datetime
+from urllib.parse import urlencode
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import func, select, tuple_
+
+from rent_cars.config import ROWS_PER_PAGE, MAX_ROWS_PER_PAGE
+from .custom_exceptions import WrongFormat, InputNotAcceptable
+from .instrumentation import timed_serialization
+from .serializer import serialize_rows
 
 
 def paginate_results(pagination, request):
+    with timed_serialization():
+        results = serialize_rows(pagination.items)
+
     return {
         'count': pagination.total,
-        'next': f"{request.url}?page={pagination.next_num}" if pagination.next_num else None,
-        'previous': f"{request.url}?page={pagination.prev_num}" if pagination.prev_num else None,
-        'results': [jsonify(row).json for row in pagination.items],
+        'next': _page_url(request, page=pagination.next_num) if pagination.next_num else None,
+        'previous': _page_url(request, page=pagination.prev_num) if pagination.prev_num else None,
+        'results': results,
+    }
+
+
+def get_page_size(request):
+    """
+    number of rows requested through ?limit=, capped server side by MAX_ROWS_PER_PAGE
+    """
+    limit = request.args.get('limit', ROWS_PER_PAGE, type=int)
+    return max(1, min(limit, MAX_ROWS_PER_PAGE))
+
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        raise WrongFormat('Pagination cursor is not valid')
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise WrongFormat('Pagination cursor is not valid')
+
+    try:
+        return [_cursor_value(column, value) for column, value in zip(columns, values)]
+    except (TypeError, ValueError):
+        raise WrongFormat('Pagination cursor is not valid')
+
+
+def _cursor_value(column, value):
+    """
+    value of the cursor converted to the type of its column, TypeError when it is not of this type:
+    the database would fail on the comparison (500) instead of a 400
+    """
+    python_type = column.type.python_type
+    if python_type is datetime:
+        if not isinstance(value, str):
+            raise TypeError(value)
+        return datetime.fromisoformat(value)
+    # bool is an int for isinstance, never a value of the sort columns
+    if isinstance(value, bool) and python_type is not bool:
+        raise TypeError(value)
+    if python_type is float and isinstance(value, int):
+        return float(value)
+    if not isinstance(value, python_type):
+        raise TypeError(value)
+    return value
+
+
+def _page_url(request, **params):
+    args = request.args.to_dict()
+    args.update(params)
+    return f"{request.base_url}?{urlencode(args)}"
+
+
+def is_cursor_pagination(request):
+    return 'after' in request.args or request.args.get('pagination') == 'cursor'
+
+
+def paginate_query(query, model, request, sort_fields=('id',)):
+    """
+    paginate a listing query, two modes are available:
+    - page mode (default): ?page=<n>&limit=<n>, based on OFFSET and returns the total count
+    - cursor mode: ?after=<token>&limit=<n>&sort=<field|-field>, seeks on (sort field, id) so every page
+      costs the same whatever its depth. The total count is skipped unless ?count=true is sent.
+      Send ?pagination=cursor (or an empty ?after=) to get the first page.
+    """
+    limit = get_page_size(request)
+    if not is_cursor_pagination(request):
+        page = request.args.get('page', 1, type=int)
+        return paginate_results(query.paginate(page=page, per_page=limit), request)
+
+    count = query.order_by(None).count() if request.args.get('count') == 'true' else None
+    query, columns = cursor_query(query, model, request, sort_fields)
+    rows = query.limit(limit + 1).all()
+    return cursor_results(rows, columns, limit, request, count)
+
+
+async def paginate_select(session, statement, model, request, sort_fields=('id',)):
+    """
+    paginate_query of the async endpoints: same modes and results for a select() run on an AsyncSession
+    """
+    limit = get_page_size(request)
+    cursor_pagination = is_cursor_pagination(request)
+    count = None
+    if not cursor_pagination or request.args.get('count') == 'true':
+        count = await session.scalar(select(func.count()).select_from(statement.order_by(None).subquery()))
+
+    if not cursor_pagination:
+        page = max(1, request.args.get('page', 1, type=int))
+        rows = (await session.execute(statement.limit(limit).offset((page - 1) * limit))).unique().scalars().all()
+        return paginate_results(Pagination(None, page, limit, count, rows), request)
+
+    statement, columns = cursor_query(statement, model, request, sort_fields)
+    rows = (await session.execute(statement.limit(limit + 1))).unique().scalars().all()
+    return cursor_results(rows, columns, limit, request, count)
+
+
+def cursor_query(query, model, request, sort_fields):
+    """
+    seek after the cursor of the request and order on the sort columns,
+    works on a Query as well as on a select() of the async endpoints. Returns the query and the sort columns
+    """
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    sort_field = sort.lstrip('-')
+    if sort_field not in sort_fields:
+        raise InputNotAcceptable(f'Sorting is allowed only on: {list(sort_fields)}')
+
+    columns = [getattr(model, sort_field)] if sort_field == 'id' else [getattr(model, sort_field), model.id]
+
+    after = request.args.get('after')
+    if after:
+        values = decode_cursor(after, columns)
+        key, boundary = (columns[0], values[0]) if len(columns) == 1 else (tuple_(*columns), tuple(values))
+        query = query.filter(key < boundary if descending else key > boundary)
+
+    return query.order_by(*[column.desc() if descending else column.asc() for column in columns]), columns
+
+
+def cursor_results(rows, columns, limit, request, count=None):
+    """
+    page of a cursor query fetched with limit + 1 rows, the extra row tells if there is a next page
+    """
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+
+    next_url = None
+    if has_next:
+        last = rows[-1]
+        token = encode_cursor([getattr(last, column.key) for column in columns])
+        next_url = _page_url(request, after=token, limit=limit)
+
+    with timed_serialization():
+        results = serialize_rows(rows)
+
+    return {
+        'count': count,
+        'next': next_url,
+        'previous': None,
+        'results': results,
     }
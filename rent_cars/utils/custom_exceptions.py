@@ -30,3 +30,8 @@ class RecordNotFound(CustomException):
 
 class WrongType(CustomException):
     pass
+
+
+class RecordConflict(CustomException):
+    def __init__(self, message, status_code=409):
+        super().__init__(message, status_code)
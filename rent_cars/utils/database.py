@@ -0,0 +1,110 @@
+"""
+Engine / pool configuration and mapping of the database timeouts to HTTP responses:
+- no free connection in the pool after DB_POOL_TIMEOUT: 503
+- lock not acquired in DB_LOCK_TIMEOUT: 503
+- statement cancelled after DB_STATEMENT_TIMEOUT: 504
+and of the optimistic lock of the cars and users: a row updated by another request since it was loaded, 409
+"""
+import time
+
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.pool import QueuePool
+
+from rent_cars.config import (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+                              DB_STATEMENT_TIMEOUT, DB_LOCK_TIMEOUT)
+from .formatter import response
+from .metrics import HistogramFamily, CounterFamily, register_collector
+
+POOL_CHECKOUT_WAIT = HistogramFamily('db_pool_checkout_wait_seconds', 'Time waited for a connection of the pool',
+                                     buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5))
+DB_TIMEOUTS = CounterFamily('db_timeouts_total', 'Database timeouts by kind (pool, lock, statement)', ('kind',))
+
+# postgres error codes
+QUERY_CANCELED = '57014'
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool recording the time spent waiting for a connection
+    """
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels().observe(time.perf_counter() - start)
+
+
+def engine_options(database_uri):
+    if not database_uri.startswith('postgresql'):
+        return {}
+
+    options = [f'-c statement_timeout={DB_STATEMENT_TIMEOUT}', f'-c lock_timeout={DB_LOCK_TIMEOUT}']
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'connect_args': {'options': ' '.join(options)},
+    }
+
+
+def pool_timeout_response():
+    DB_TIMEOUTS.labels(kind='pool').inc()
+    res = response('Service temporarily overloaded, retry later', 503)
+    res.headers['Retry-After'] = '1'
+    return res
+
+
+def error_code(e):
+    # psycopg2 exposes the error code as pgcode, asyncpg as sqlstate
+    return getattr(e.orig, 'pgcode', None) or getattr(e.orig, 'sqlstate', None)
+
+
+def database_error_response(e):
+    code = error_code(e)
+    if code == QUERY_CANCELED:
+        DB_TIMEOUTS.labels(kind='statement').inc()
+        return response('The request took too long to complete', 504)
+    if code == LOCK_NOT_AVAILABLE:
+        DB_TIMEOUTS.labels(kind='lock').inc()
+        res = response('Resource is busy, retry later', 503)
+        res.headers['Retry-After'] = '1'
+        return res
+    return response('Database unavailable', 503)
+
+
+def stale_data_response():
+    return response('The resource was modified by another request, retry', 409)
+
+
+def init_database(app, db):
+    @app.errorhandler(PoolTimeoutError)
+    def pool_timeout(e):
+        db.session.rollback()
+        return pool_timeout_response()
+
+    @app.errorhandler(OperationalError)
+    def operational_error(e):
+        db.session.rollback()
+        return database_error_response(e)
+
+    @app.errorhandler(StaleDataError)
+    def stale_data(e):
+        db.session.rollback()
+        return stale_data_response()
+
+    @register_collector
+    def pool_metrics():
+        pool = db.engine.pool
+        if not isinstance(pool, QueuePool):
+            return []
+        return [
+            ('db_pool_size', 'gauge', 'Size of the connection pool', {(): pool.size()}),
+            ('db_pool_checked_out', 'gauge', 'Connections in use', {(): pool.checkedout()}),
+            ('db_pool_overflow', 'gauge', 'Connections opened above the pool size', {(): pool.overflow()}),
+        ]
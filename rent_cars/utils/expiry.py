@@ -0,0 +1,156 @@
+"""
+Expiry of the reservations past their end date: they are marked completed, their users can book again.
+
+A round expires the ended reservations by batches of RESERVATION_SWEEP_BATCH_SIZE, oldest first, and
+stops after RESERVATION_SWEEP_MAX_BATCHES: a backlog is spread over several rounds instead of making
+one last long. Each batch is a transaction of set-based statements:
+- the reservations are read from the partial index of the active reservation ends, whose size does not
+  depend on the history, and locked with SKIP LOCKED so the sweepers of several workers take distinct ones
+- the reservations, their cars and their users are updated with one UPDATE each
+- the side effects (notifications, reports) are published in the outbox
+
+Every worker runs a round every RESERVATION_SWEEP_INTERVAL seconds from a daemon thread started with
+its first request. `flask expire-reservations` runs a round, e.g. from a scheduler.
+"""
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from rent_cars import db
+from rent_cars.config import (CACHE_TTL, RESERVATION_SWEEP_INTERVAL, RESERVATION_SWEEP_BATCH_SIZE,
+                              RESERVATION_SWEEP_MAX_BATCHES)
+from rent_cars.models import Car, Reservation, User
+from .cache import AVAILABLE_CARS, cache, car_namespace, invalidate_on_commit
+from .conditional import touch
+from .metrics import CounterFamily, HistogramFamily, register_collector
+from .outbox import publish_many
+
+RESERVED = Reservation.ReservationStatus.reserved
+COMPLETED = Reservation.ReservationStatus.completed
+
+SWEEP_BATCH_DURATION = HistogramFamily('reservation_sweep_batch_duration_seconds',
+                                       'Duration of the reservation expiry batches').labels()
+RESERVATIONS_EXPIRED = CounterFamily('reservations_expired_total', 'Reservations expired by the sweeper').labels()
+
+_last_round = {'time': None, 'lag': 0.0}
+_sweeper = {'thread': None}
+_sweeper_lock = threading.Lock()
+
+
+@register_collector
+def _sweep_metrics():
+    metrics = [('reservation_sweep_lag_seconds', 'gauge',
+                'Time since the end of the oldest reservation left to expire after the last round',
+                {(): _last_round['lag']})]
+    if _last_round['time'] is not None:
+        metrics.append(('reservation_sweep_last_round_timestamp_seconds', 'gauge',
+                        'Time of the last expiry round', {(): _last_round['time']}))
+    return metrics
+
+
+def expire_batch(now, batch_size=RESERVATION_SWEEP_BATCH_SIZE):
+    """
+    expire a batch of reservations ended before now, returns their number
+    """
+    expired = db.session.query(Reservation.id, Reservation.car_id, Reservation.user_id).filter(
+        Reservation.status == RESERVED,
+        Reservation.reservation_end_date <= now,
+    ).order_by(Reservation.reservation_end_date).limit(batch_size).with_for_update(skip_locked=True).all()
+    if not expired:
+        db.session.rollback()
+        return 0
+
+    reservation_ids, car_ids, user_ids = zip(*expired)
+    updated = db.session.query(Reservation).filter(
+        Reservation.id.in_(reservation_ids),
+        Reservation.status == RESERVED,
+    ).update({'status': COMPLETED, 'date_last_update': now}, synchronize_session=False)
+    if updated != len(expired):
+        # without row locks (e.g. sqlite) another sweeper expired some of them first
+        db.session.rollback()
+        return 0
+    # the reservation is part of the car and user details
+    db.session.query(Car).filter(Car.id.in_(car_ids)).update(
+        {'date_last_update': now, 'version': Car.version + 1}, synchronize_session=False)
+    db.session.execute(touch(User, *user_ids))
+    publish_many('reservation.expired', [
+        {'id': reservation_id, 'car_id': car_id, 'user_id': user_id} for reservation_id, car_id, user_id in expired
+    ])
+    # the cache is only enabled when this process is the only one serving the app (utils/cache.py)
+    invalidate_on_commit(AVAILABLE_CARS, *[car_namespace(car_id) for car_id in car_ids])
+    db.session.commit()
+    return len(expired)
+
+
+def sweep(batch_size=RESERVATION_SWEEP_BATCH_SIZE, max_batches=RESERVATION_SWEEP_MAX_BATCHES):
+    """
+    expiry round, returns the number of expired reservations
+    """
+    now = datetime.utcnow()
+    total = 0
+    for _ in range(max_batches):
+        start = time.perf_counter()
+        expired = expire_batch(now, batch_size)
+        SWEEP_BATCH_DURATION.observe(time.perf_counter() - start)
+        RESERVATIONS_EXPIRED.inc(expired)
+        total += expired
+        if expired < batch_size:
+            break
+
+    oldest = db.session.query(func.min(Reservation.reservation_end_date)).filter(
+        Reservation.status == RESERVED,
+        Reservation.reservation_end_date <= now,
+    ).scalar()
+    db.session.rollback()
+    _last_round.update(time=time.time(), lag=(now - oldest).total_seconds() if oldest else 0.0)
+    return total
+
+
+def _run_sweeper(app):
+    with app.app_context():
+        while True:
+            # the first round waits too: starting a worker does no I/O
+            time.sleep(RESERVATION_SWEEP_INTERVAL)
+            try:
+                sweep()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                click.echo(f'reservation sweeper: {e}', err=True)
+            finally:
+                db.session.remove()
+
+
+def start_sweeper(app):
+    """
+    start the expiry thread of the process, once
+    """
+    if not RESERVATION_SWEEP_INTERVAL:
+        return
+    with _sweeper_lock:
+        if _sweeper['thread'] is None:
+            _sweeper['thread'] = threading.Thread(target=_run_sweeper, args=(app,), name='reservation-sweeper',
+                                                  daemon=True)
+            _sweeper['thread'].start()
+
+
+def init_expiry(app):
+    app.before_first_request(lambda: start_sweeper(app))
+
+
+@click.command('expire-reservations')
+@with_appcontext
+def expire_command():
+    """
+    expire the reservations past their end date
+    """
+    expired = sweep()
+    click.echo(f'{expired} reservation(s) expired, lag {_last_round["lag"]:.0f}s')
+    if expired and cache.enabled:
+        # the invalidations of this process do not reach the server
+        click.echo(f'the cars cached by a server with SESSION_BACKEND=memory are refreshed within {CACHE_TTL}s, '
+                   f'its own sweeper (RESERVATION_SWEEP_INTERVAL) has no such delay', err=True)
@@ -1,13 +1,18 @@
-from flask import jsonify
+from flask import current_app
+
+from .instrumentation import timed_serialization
+from .serializer import serialize, dumps
 
 
 def response(message, status_code=200, data=None):
-    res = jsonify(
-        {
-            'message': message,
-            'data': data
-        }
-    )
+    with timed_serialization():
+        body = dumps(
+            {
+                'message': message,
+                'data': serialize(data)
+            }
+        )
+    res = current_app.response_class(body, mimetype='application/json')
     res.status_code = status_code
 
     return res
@@ -0,0 +1,32 @@
+from math import radians, degrees, sin, cos, asin, sqrt
+
+EARTH_RADIUS = 6371.0  # km
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    great-circle distance in km between two points
+    """
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * asin(min(1.0, sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius):
+    """
+    (min_lat, max_lat, [(min_lon, max_lon), ...]) of the area containing every point at less than
+    radius km. The longitude range is split in two when it crosses the antimeridian.
+    """
+    delta_lat = degrees(radius / EARTH_RADIUS)
+    min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        # the area contains a pole, every longitude is in it
+        return max(min_lat, -90.0), min(max_lat, 90.0), [(-180.0, 180.0)]
+
+    delta_lon = degrees(asin(min(1.0, sin(radius / EARTH_RADIUS) / cos(radians(latitude)))))
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if min_lon < -180:
+        return min_lat, max_lat, [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
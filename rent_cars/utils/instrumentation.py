@@ -0,0 +1,150 @@
+"""
+Opt-in request instrumentation, enabled with INSTRUMENTATION=on:
+- latency histogram per endpoint
+- number and duration of the SQL statements (SQLAlchemy engine events)
+- serialization time of the responses
+published on /metrics, and optionally per response in a Server-Timing header (SERVER_TIMING=on).
+
+PROFILE_SLOW_REQUESTS enables a sampling profiler: the stacks of the threads serving a request
+are sampled every PROFILE_INTERVAL seconds, the samples of the requests slower than the threshold
+are written in PROFILE_DIR as collapsed stacks (flamegraph.pl / speedscope format).
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from rent_cars.config import (INSTRUMENTATION, SERVER_TIMING, PROFILE_SLOW_REQUESTS, PROFILE_INTERVAL,
+                              PROFILE_DIR)
+from .metrics import HistogramFamily, CounterFamily
+
+REQUEST_LATENCY = HistogramFamily('http_request_duration_seconds', 'Duration of the HTTP requests',
+                                  ('endpoint', 'method', 'status'))
+SQL_LATENCY = HistogramFamily('db_statement_duration_seconds', 'Duration of the SQL statements', ('endpoint',))
+SQL_STATEMENTS = CounterFamily('db_statements_total', 'Number of SQL statements', ('endpoint',))
+SERIALIZATION_LATENCY = HistogramFamily('serialization_duration_seconds', 'Time spent serializing responses',
+                                        ('endpoint',))
+
+
+def _endpoint():
+    return request.endpoint or 'unknown' if has_request_context() else 'background'
+
+
+@contextmanager
+def timed_serialization():
+    if not INSTRUMENTATION:
+        yield
+        return
+
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    SERIALIZATION_LATENCY.labels(endpoint=_endpoint()).observe(elapsed)
+    if has_request_context():
+        g.serialization_time = g.get('serialization_time', 0) + elapsed
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    endpoint = _endpoint()
+    SQL_LATENCY.labels(endpoint=endpoint).observe(elapsed)
+    SQL_STATEMENTS.labels(endpoint=endpoint).inc()
+    if has_request_context():
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_time = g.get('sql_time', 0) + elapsed
+
+
+class SamplingProfiler:
+    """
+    a single daemon thread samples the stacks of every thread currently serving a request
+    """
+    def __init__(self, interval, threshold, directory):
+        self.interval = interval
+        self.threshold = threshold
+        self.directory = directory
+        self._samples = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start_request(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                    self._thread.start()
+        self._samples[threading.get_ident()] = Counter()
+
+    def stop_request(self, duration, endpoint):
+        samples = self._samples.pop(threading.get_ident(), None)
+        if samples and duration >= self.threshold:
+            os.makedirs(self.directory, exist_ok=True)
+            file_name = f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{int(duration * 1000)}ms.folded'
+            with open(os.path.join(self.directory, file_name), 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in samples.items())
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for ident, samples in list(self._samples.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples[self._collapse(frame)] += 1
+
+
+def init_instrumentation(app):
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    profiler = None
+    if PROFILE_SLOW_REQUESTS:
+        profiler = SamplingProfiler(PROFILE_INTERVAL, PROFILE_SLOW_REQUESTS, PROFILE_DIR)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0
+        g.serialization_time = 0
+        if profiler:
+            profiler.start_request()
+
+    @app.after_request
+    def record_request(res):
+        duration = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_LATENCY.labels(endpoint=endpoint, method=request.method, status=res.status_code).observe(duration)
+        if profiler:
+            profiler.stop_request(duration, endpoint)
+
+        if SERVER_TIMING:
+            res.headers['Server-Timing'] = ', '.join([
+                f'app;dur={duration * 1000:.2f}',
+                f'db;dur={g.get("sql_time", 0) * 1000:.2f};desc="{g.get("sql_count", 0)} queries"',
+                f'serialize;dur={g.get("serialization_time", 0) * 1000:.2f}',
+            ])
+        return res
+
+    @app.teardown_request
+    def discard_samples(exception):
+        # after_request is skipped on unhandled exceptions
+        if profiler:
+            profiler._samples.pop(threading.get_ident(), None)
@@ -0,0 +1,26 @@
+"""
+Eager-loading profiles of the endpoints.
+
+The serializer follows the relationships declared as dataclass fields (Car.current_location,
+Car.active_reservations, User.licenses, User.reservation), loading them lazily costs one SELECT per
+relationship and per row. Each profile loads them upfront so an endpoint runs a fixed
+number of queries whatever the number of rows it returns:
+- detail endpoints fetch one row, the relationships are joined in the same SELECT
+- listing endpoints use joined loading for the scalar relationships of a car (one row per car),
+  and select-in loading for its active reservations and for users (one extra SELECT per relationship
+  for the whole page)
+"""
+from sqlalchemy.orm import joinedload, selectinload
+
+from rent_cars.models import Car, User
+
+LOADING_PROFILES = {
+    'cars.list': (joinedload(Car.current_location), selectinload(Car.active_reservations)),
+    'cars.detail': (joinedload(Car.current_location), joinedload(Car.active_reservations)),
+    'users.list': (selectinload(User.licenses), selectinload(User.reservation)),
+    'users.detail': (joinedload(User.licenses), joinedload(User.reservation)),
+}
+
+
+def with_profile(query, profile):
+    return query.options(*LOADING_PROFILES[profile])
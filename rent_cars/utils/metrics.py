@@ -0,0 +1,137 @@
+"""
+In-process metrics, rendered in the Prometheus text format by render_metrics().
+"""
+import threading
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+COLLECTORS = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """
+    thread safe latency histogram, buckets are upper bounds in seconds
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+
+    def snapshot(self):
+        """
+        count, sum and cumulative count per bucket
+        """
+        with self._lock:
+            cumulative = []
+            total = 0
+            for count in self.bucket_counts:
+                total += count
+                cumulative.append(total)
+            return {'count': self.count, 'sum': self.sum, 'buckets': dict(zip(self.buckets, cumulative))}
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class MetricFamily:
+    """
+    metrics of the same name, one child per combination of label values
+    """
+    metric_type = None
+    child_class = None
+
+    def __init__(self, name, description, label_names=(), **child_kwargs):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.child_kwargs = child_kwargs
+        self.children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self.children.get(key)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(key, self.child_class(**self.child_kwargs))
+        return child
+
+    def _label_string(self, key, **extra):
+        pairs = list(zip(self.label_names, key)) + list(extra.items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.metric_type}']
+        for key, child in list(self.children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class HistogramFamily(MetricFamily):
+    metric_type = 'histogram'
+    child_class = Histogram
+
+    def _render_child(self, key, histogram):
+        snapshot = histogram.snapshot()
+        for bound, count in snapshot['buckets'].items():
+            yield f'{self.name}_bucket{self._label_string(key, le=bound)} {count}'
+        yield f'{self.name}_bucket{self._label_string(key, le="+Inf")} {snapshot["count"]}'
+        yield f'{self.name}_sum{self._label_string(key)} {snapshot["sum"]}'
+        yield f'{self.name}_count{self._label_string(key)} {snapshot["count"]}'
+
+
+class CounterFamily(MetricFamily):
+    metric_type = 'counter'
+    child_class = Counter
+
+    def _render_child(self, key, counter):
+        yield f'{self.name}{self._label_string(key)} {counter.value}'
+
+
+def register_collector(collector):
+    """
+    collector is called at each rendering and returns (name, type, description, {labels: value})
+    for values maintained outside of the registry
+    """
+    COLLECTORS.append(collector)
+    return collector
+
+
+def render_metrics():
+    lines = []
+    for family in REGISTRY:
+        lines.extend(family.render())
+    for collector in COLLECTORS:
+        for name, metric_type, description, samples in collector():
+            lines.extend([f'# HELP {name} {description}', f'# TYPE {name} {metric_type}'])
+            for labels, value in samples.items():
+                label_string = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+                lines.append(f'{name}{{{label_string}}} {value}' if label_string else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,210 @@
+"""
+Transactional outbox: the side effects of a write (notifications, reporting...) are recorded as events
+in the outbox_event table, in the transaction of the write, and delivered by a separate worker:
+
+    flask outbox-worker --concurrency 4
+
+The request only pays for the INSERT of the event, which is committed if and only if the write is.
+
+The worker threads claim batches of due events (SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers
+share the outbox), hide them from the others for OUTBOX_LEASE seconds and run their handlers outside
+of any transaction. Delivered events are deleted, failed ones are retried with an exponential backoff.
+Delivery is at least once: an event claimed by a worker stopped before deleting it is delivered again
+once its lease is over, so handlers must be idempotent.
+The in-process cache is still invalidated by the commit of the write (utils/cache.py): the worker
+runs in another process.
+"""
+import json
+import logging
+import signal
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from rent_cars import db
+from rent_cars.config import (OUTBOX_BATCH_SIZE, OUTBOX_CONCURRENCY, OUTBOX_POLL_INTERVAL, OUTBOX_LEASE,
+                              OUTBOX_RETRY_DELAY, OUTBOX_MAX_RETRY_DELAY)
+from rent_cars.models import OutboxEvent
+from .serializer import serialize
+
+# topic: handlers called with the topic and the payload of the events
+HANDLERS = {}
+
+
+def outbox_handler(*topics):
+    def decorator(f):
+        for topic in topics:
+            HANDLERS.setdefault(topic, []).append(f)
+        return f
+
+    return decorator
+
+
+def _event(topic, instance):
+    return OutboxEvent(topic=topic, payload=json.dumps(serialize(instance)))
+
+
+def publish(topic, instance, session=None):
+    """
+    record an event of topic in the transaction of session (db.session by default, or an AsyncSession),
+    its payload is the serialized instance. The event of a pending instance is added once the instance
+    is flushed, with its id
+    """
+    session = session or db.session
+    if instance in session.new:
+        session.info.setdefault('outbox', []).append((topic, instance))
+    else:
+        session.add(_event(topic, instance))
+
+
+def publish_many(topic, payloads):
+    """
+    record events of topic with the given payloads in the transaction of db.session, in one statement
+    """
+    now = datetime.utcnow()
+    db.session.execute(OutboxEvent.__table__.insert(), [
+        {'topic': topic, 'payload': json.dumps(payload), 'created_at': now, 'available_at': now, 'attempts': 0}
+        for payload in payloads
+    ])
+
+
+# on every session (the sync session of an AsyncSession included), a session flushed again
+# by the commit once its events are added
+@event.listens_for(Session, 'after_flush_postexec')
+def _add_pending_events(session, flush_context):
+    pending = session.info.get('outbox')
+    if not pending:
+        return
+    flushed = [(topic, instance) for topic, instance in pending if instance not in session.new]
+    session.info['outbox'] = [item for item in pending if item not in flushed]
+    session.add_all([_event(topic, instance) for topic, instance in flushed])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_events(session):
+    session.info.pop('outbox', None)
+
+
+def retry_delay(attempts):
+    return min(OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), OUTBOX_MAX_RETRY_DELAY)
+
+
+def claim(batch_size):
+    """
+    lock a batch of due events and push their due date back by OUTBOX_LEASE, returns their
+    (id, topic, payload, attempts)
+    """
+    now = datetime.utcnow()
+    events = db.session.query(
+        OutboxEvent.id, OutboxEvent.topic, OutboxEvent.payload, OutboxEvent.attempts
+    ).filter(
+        OutboxEvent.available_at <= now
+    ).order_by(OutboxEvent.id).limit(batch_size).with_for_update(skip_locked=True).all()
+    if events:
+        db.session.query(OutboxEvent).filter(OutboxEvent.id.in_([event_id for event_id, *_ in events])).update(
+            {'available_at': now + timedelta(seconds=OUTBOX_LEASE)}, synchronize_session=False)
+    db.session.commit()
+    return events
+
+
+def drain(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    deliver a batch of due events, returns the numbers of delivered and failed events
+    """
+    events = claim(batch_size)
+    delivered, failed = [], []
+    for event_id, topic, payload, attempts in events:
+        try:
+            payload = json.loads(payload)
+            for handle in HANDLERS.get(topic, ()):
+                handle(topic, payload)
+        except Exception as e:
+            failed.append((event_id, attempts + 1, f'{type(e).__name__}: {e}'[:200]))
+        else:
+            delivered.append(event_id)
+
+    # handlers may have used the session
+    db.session.rollback()
+    if delivered:
+        db.session.query(OutboxEvent).filter(OutboxEvent.id.in_(delivered)).delete(synchronize_session=False)
+    now = datetime.utcnow()
+    for event_id, attempts, error in failed:
+        db.session.query(OutboxEvent).filter_by(id=event_id).update({
+            'attempts': attempts, 'last_error': error,
+            'available_at': now + timedelta(seconds=retry_delay(attempts)),
+        }, synchronize_session=False)
+    db.session.commit()
+    return len(delivered), len(failed)
+
+
+def run_worker(app, concurrency=OUTBOX_CONCURRENCY, batch_size=OUTBOX_BATCH_SIZE,
+               poll_interval=OUTBOX_POLL_INTERVAL, stop=None):
+    """
+    drain the outbox from concurrency threads until stop is set or the process is interrupted
+    """
+    stop = stop or threading.Event()
+
+    def work():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    delivered, failed = drain(batch_size)
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    click.echo(f'outbox: {e}', err=True)
+                    delivered = failed = 0
+                if delivered + failed < batch_size:
+                    stop.wait(poll_interval)
+
+    # daemons: a second interruption stops the process at once, the claimed events are delivered again
+    threads = [threading.Thread(target=work, name=f'outbox-worker-{i}', daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        # the batches in progress are finished
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+@click.command('outbox-worker')
+@click.option('--concurrency', default=OUTBOX_CONCURRENCY, show_default=True, help='worker threads')
+@click.option('--batch-size', default=OUTBOX_BATCH_SIZE, show_default=True, help='events claimed at once')
+@click.option('--poll-interval', default=OUTBOX_POLL_INTERVAL, show_default=True,
+              help='seconds between polls of an empty outbox')
+@with_appcontext
+def worker_command(concurrency, batch_size, poll_interval):
+    """
+    deliver the outbox events until interrupted
+    """
+    # stopped by Ctrl+C and docker stop (KeyboardInterrupt), even when started with SIGINT ignored
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    click.echo(f'outbox worker: {concurrency} thread(s), batches of {batch_size} events')
+    run_worker(current_app._get_current_object(), concurrency, batch_size, poll_interval)
+
+
+notifications = logging.getLogger('rent_cars.notifications')
+
+
+@outbox_handler('reservation.created', 'reservation.cancelled', 'reservation.expired')
+def notify_user(topic, reservation):
+    # no delivery channel (mail, push) is set up yet, notifications are logged
+    notifications.info('%s: reservation %s of user %s, car %s', topic, reservation['id'], reservation['user_id'],
+                       reservation['car_id'])
+
+
+@outbox_handler('reservation.created', 'reservation.cancelled', 'reservation.expired')
+def refresh_reports(topic, reservation):
+    # the reporting summary follows the bookings without a report request paying for its refresh
+    from .reporting import refresh_if_stale
+    refresh_if_stale()
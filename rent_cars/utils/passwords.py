@@ -0,0 +1,96 @@
+"""
+Password hashing service.
+
+Hashes are deliberately CPU heavy, they are computed in a bounded process pool so a burst
+of logins does not hold the GIL and every waitress thread: at most PASSWORD_HASH_WORKERS hashes
+run at the same time, the other requests wait for a free worker.
+Two latencies are recorded per operation (hash / verify): the time spent hashing in the worker,
+and the time seen by the request (queueing in the pool included).
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from rent_cars.config import PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH, PASSWORD_HASH_WORKERS
+from .metrics import HistogramFamily
+
+HASHING_LATENCY = HistogramFamily('password_hashing_seconds', 'Time spent computing password hashes',
+                                  ('operation',))
+REQUEST_LATENCY = HistogramFamily('password_hashing_request_seconds',
+                                  'Password hashing time seen by the requests, waiting for a worker included',
+                                  ('operation',))
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return _executor
+
+
+def _timed_hash(password, method, salt_length):
+    start = time.perf_counter()
+    return generate_password_hash(password, method, salt_length), time.perf_counter() - start
+
+
+def _timed_check(password_hash, password):
+    start = time.perf_counter()
+    return check_password_hash(password_hash, password), time.perf_counter() - start
+
+
+def _run(operation, function, *args):
+    start = time.perf_counter()
+    if PASSWORD_HASH_WORKERS:
+        result, elapsed = _get_executor().submit(function, *args).result()
+    else:
+        result, elapsed = function(*args)
+
+    HASHING_LATENCY.labels(operation=operation).observe(elapsed)
+    REQUEST_LATENCY.labels(operation=operation).observe(time.perf_counter() - start)
+    return result
+
+
+def hash_password(password):
+    return _run('hash', _timed_hash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+
+
+def hash_passwords(passwords):
+    """
+    hash a batch of passwords on all the workers of the pool
+    """
+    if not PASSWORD_HASH_WORKERS:
+        return [hash_password(password) for password in passwords]
+
+    start = time.perf_counter()
+    results = list(_get_executor().map(_timed_hash, passwords, [PASSWORD_HASH_METHOD] * len(passwords),
+                                       [PASSWORD_SALT_LENGTH] * len(passwords)))
+    for _, elapsed in results:
+        HASHING_LATENCY.labels(operation='hash').observe(elapsed)
+    REQUEST_LATENCY.labels(operation='hash').observe(time.perf_counter() - start)
+    return [password_hash for password_hash, _ in results]
+
+
+def verify_password(password_hash, password):
+    return _run('verify', _timed_check, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """
+    True when the hash was made with other parameters than PASSWORD_HASH_METHOD
+    """
+    method = password_hash.split('$', 1)[0]
+    salt = password_hash.split('$')[1] if password_hash.count('$') == 2 else ''
+    return method != PASSWORD_HASH_METHOD or len(salt) != PASSWORD_SALT_LENGTH
+
+
+def hashing_stats():
+    return {
+        operation: {
+            'hashing': HASHING_LATENCY.labels(operation=operation).snapshot(),
+            'request': REQUEST_LATENCY.labels(operation=operation).snapshot(),
+        }
+        for operation in ['hash', 'verify']
+    }
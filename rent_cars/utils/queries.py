@@ -0,0 +1,45 @@
+"""
+Helpers to count the SQL statements sent to the database, meant for tests:
+
+    with assert_num_queries(3):
+        client.get('/users?limit=50')
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None):
+    if engine is None:
+        from rent_cars import db
+        engine = db.engine
+
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
+
+
+@contextmanager
+def assert_num_queries(expected, engine=None):
+    with count_queries(engine) as counter:
+        yield counter
+
+    if counter.count != expected:
+        statements = '\n'.join(counter.statements)
+        raise AssertionError(f'{counter.count} queries executed, {expected} expected:\n{statements}')
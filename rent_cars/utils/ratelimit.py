@@ -0,0 +1,170 @@
+"""
+Rate limiting of the expensive endpoints (password hashing, bookings) with token buckets.
+
+The limits of a route are listed in RATE_LIMITS: a bucket holds up to `requests` tokens and is refilled
+at `requests / seconds` tokens per second, each request takes a token. Buckets are keyed by:
+- ip: client address (see PROXY_COUNT when served behind proxies)
+- user: logged in user, the limit is skipped for anonymous requests
+- endpoint: one bucket shared by every client of the route
+A request takes a token of each bucket of its route, only when every one of them has a token: a request
+answered 429 (with a Retry-After header) does not use the quota of the other buckets.
+
+The default MemoryBackend keeps the buckets of the process behind a single lock, held for a few dict
+operations (splitting it in shards measured no faster, see benchmarks/ratelimit.py). With several
+processes each one has its own buckets, a shared backend (e.g. redis) only has to implement
+RateLimitBackend and be assigned to limiter.backend.
+"""
+import math
+import threading
+import time
+
+from flask import request, session
+
+from rent_cars.config import RATE_LIMITING, RATE_LIMITS, RATE_LIMIT_MAX_KEYS
+from .formatter import response
+from .metrics import CounterFamily
+
+RATE_LIMIT_CHECKS = CounterFamily('rate_limit_checks_total', 'Rate limited requests by route and result',
+                                  ('route', 'result'))
+
+
+class RateLimitBackend:
+    def consume(self, buckets):
+        """
+        take a token of each bucket of buckets, (key, rate, capacity) refilled at rate tokens per second and
+        holding at most capacity tokens, only if every one of them has a token.
+        returns 0 when the tokens were taken, otherwise the seconds to wait until they all have one
+        """
+        raise NotImplementedError
+
+
+class MemoryBackend(RateLimitBackend):
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.max_keys = max_keys
+
+    def consume(self, buckets):
+        with self._lock:
+            # read under the lock: a bucket is never updated at a later time than now
+            now = time.monotonic()
+            levels = []
+            for key, rate, capacity in buckets:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    levels.append(capacity)
+                else:
+                    tokens, updated_at, _ = bucket
+                    levels.append(min(capacity, tokens + (now - updated_at) * rate))
+
+            retry_after = max([(1 - tokens) / rate for tokens, (_, rate, _) in zip(levels, buckets) if tokens < 1],
+                              default=0)
+            if not retry_after:
+                # all allowed: a token of each
+                levels = [tokens - 1 for tokens in levels]
+            if len(self._buckets) + len(buckets) > self.max_keys:
+                self._prune(now)
+            for tokens, (key, rate, capacity) in zip(levels, buckets):
+                self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            return retry_after
+
+    def _prune(self, now):
+        # a full bucket is the same as no bucket, the oldest ones go when there is none
+        for key in [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]:
+            del self._buckets[key]
+        while len(self._buckets) >= self.max_keys:
+            del self._buckets[next(iter(self._buckets))]
+
+
+class RateLimiter:
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = {
+            route: [(key, requests / seconds, requests) for key, requests, seconds in route_limits]
+            for route, route_limits in limits.items()
+        }
+
+    def hit(self, route, ip, user_id):
+        """
+        take a token of each bucket of route, returns 0 when the request is allowed,
+        otherwise the seconds to wait before retrying (no token is taken)
+        """
+        buckets = []
+        for key, rate, capacity in self.limits[route]:
+            if key == 'ip':
+                bucket = f'{route}:ip:{ip}'
+            elif key == 'user':
+                if user_id is None:
+                    continue
+                bucket = f'{route}:user:{user_id}'
+            else:
+                bucket = f'{route}:endpoint'
+            buckets.append((bucket, rate, capacity))
+        return self.backend.consume(buckets)
+
+
+limiter = RateLimiter(MemoryBackend(), RATE_LIMITS)
+
+
+def _checker(route, methods):
+    if route not in RATE_LIMITS:
+        raise KeyError(f'no rate limits configured for {route}, see RATE_LIMITS in rent_cars/config.py')
+    allowed = RATE_LIMIT_CHECKS.labels(route=route, result='allowed')
+    limited = RATE_LIMIT_CHECKS.labels(route=route, result='limited')
+
+    def check(method, ip, user_id):
+        """
+        None when the request is allowed, otherwise the 429 response
+        """
+        if not RATE_LIMITING or (methods and method not in methods):
+            return None
+        retry_after = limiter.hit(route, ip, user_id)
+        if not retry_after:
+            allowed.inc()
+            return None
+
+        limited.inc()
+        res = response('Too many requests, retry later', 429)
+        res.headers['Retry-After'] = str(math.ceil(retry_after))
+        return res
+
+    return check
+
+
+def rate_limited(route, methods=None):
+    """
+    apply RATE_LIMITS[route] to the view (to its requests of methods only, if given),
+    placed under login_required so the user limits apply to the logged in user
+    """
+    check = _checker(route, methods)
+
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            res = check(request.method, request.remote_addr, session.get('user_id'))
+            if res is not None:
+                return res
+            return f(*args, **kwargs)
+        wrapper.__name__ = f.__name__
+
+        return wrapper
+
+    return decorator
+
+
+def async_rate_limited(route, methods=None):
+    """
+    rate_limited of the async endpoints (rent_cars.asgi)
+    """
+    check = _checker(route, methods)
+
+    def decorator(f):
+        async def wrapper(request, **kwargs):
+            res = check(request.method, request.remote_addr, request.session.get('user_id'))
+            if res is not None:
+                return res
+            return await f(request, **kwargs)
+        wrapper.__name__ = f.__name__
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,64 @@
+"""
+Routing of the read-only requests to the read replicas (DATABASE_REPLICA_URIS).
+
+GET requests are served by a replica picked at the start of the request, everything else
+(writes, SELECT ... FOR UPDATE of the bookings, login updating last_login) goes to the primary.
+After a successful write, the requests of the same session stick to the primary for
+REPLICA_STICKY_SECONDS so users read their own writes despite the replication lag.
+Code that must read fresh data during a GET (e.g. to fill the cache) runs inside `with primary():`.
+"""
+import random
+import time
+from contextlib import contextmanager
+
+from flask import g, request, session, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+
+from rent_cars.config import DATABASE_REPLICA_URIS, REPLICA_STICKY_SECONDS
+
+REPLICA_BINDS = [f'replica_{i}' for i in range(len(DATABASE_REPLICA_URIS))]
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica_bind = g.get('replica_bind') if has_request_context() else None
+        if replica_bind is None or self._flushing:
+            return super().get_bind(mapper, clause)
+        return self.app.extensions['sqlalchemy'].db.get_engine(self.app, bind=replica_bind)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@contextmanager
+def primary():
+    replica_bind = g.get('replica_bind')
+    g.replica_bind = None
+    try:
+        yield
+    finally:
+        g.replica_bind = replica_bind
+
+
+def replica_binds():
+    return dict(zip(REPLICA_BINDS, DATABASE_REPLICA_URIS))
+
+
+def init_replicas(app):
+    if not REPLICA_BINDS:
+        return
+
+    @app.before_request
+    def route_reads():
+        g.replica_bind = None
+        if request.method == 'GET' and session.get('primary_until', 0) < time.time():
+            g.replica_bind = random.choice(REPLICA_BINDS)
+
+    @app.after_request
+    def stick_to_primary(res):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and res.status_code < 400:
+            session['primary_until'] = time.time() + REPLICA_STICKY_SECONDS
+        return res
@@ -0,0 +1,189 @@
+"""
+Reporting aggregates, computed in SQL.
+
+Date-bucketed figures (reservations, cancellations and rental hours per day of creation) are kept in the
+reservation_daily_summary table. It is refreshed incrementally: only the days of the reservations created
+or updated since the previous refresh (minus REPORT_REFRESH_OVERLAP, for transactions committed late)
+are recomputed. Reports refresh it when read, at most every REPORT_REFRESH_INTERVAL seconds per process,
+`flask refresh-reports` does it from a scheduler. Deleted reservations are only removed from the
+summary by a full refresh (`flask refresh-reports --full`).
+"""
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Float, case, func, literal, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from rent_cars import db
+from rent_cars.config import REPORT_REFRESH_INTERVAL, REPORT_REFRESH_OVERLAP
+from rent_cars.models import Car, Reservation, ReservationDailySummary
+from .replicas import primary
+
+CANCELLED = Reservation.ReservationStatus.cancelled
+
+_last_refresh = {'time': None, 'watermark': None}
+
+
+class seconds_between(FunctionElement):
+    type = Float()
+    name = 'seconds_between'
+    inherit_cache = True
+
+
+@compiles(seconds_between)
+def _seconds_between(element, compiler, **kw):
+    # compiled in the order of the SQL text, positional bind parameters follow that order
+    start, end = element.clauses
+    end = compiler.process(end, **kw)
+    return f'EXTRACT(EPOCH FROM ({end} - {compiler.process(start, **kw)}))'
+
+
+@compiles(seconds_between, 'sqlite')
+def _sqlite_seconds_between(element, compiler, **kw):
+    start, end = element.clauses
+    end = compiler.process(end, **kw)
+    return f'((julianday({end}) - julianday({compiler.process(start, **kw)})) * 86400)'
+
+
+class greatest(FunctionElement):
+    name = 'greatest'
+    inherit_cache = True
+
+
+class least(FunctionElement):
+    name = 'least'
+    inherit_cache = True
+
+
+@compiles(greatest)
+@compiles(least)
+def _greatest_least(element, compiler, **kw):
+    return f'{element.name.upper()}({compiler.process(element.clauses, **kw)})'
+
+
+@compiles(greatest, 'sqlite')
+@compiles(least, 'sqlite')
+def _sqlite_greatest_least(element, compiler, **kw):
+    # the scalar min / max functions of sqlite take several arguments
+    function = 'MAX' if element.name == 'greatest' else 'MIN'
+    return f'{function}({compiler.process(element.clauses, **kw)})'
+
+
+def _as_date(value):
+    # sqlite returns date() as text
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def refresh_daily_summary(full=False):
+    """
+    recompute the summary of the days touched since the previous refresh (of every day when full),
+    returns the number of days refreshed
+    """
+    now = datetime.utcnow()
+    summary = ReservationDailySummary.__table__
+    day = func.date(Reservation.date_created)
+
+    with primary():
+        watermark = _last_refresh['watermark']
+        if watermark is None and not full:
+            watermark = db.session.query(func.max(ReservationDailySummary.refreshed_at)).scalar()
+
+        touched = db.session.query(day).distinct()
+        if watermark is not None and not full:
+            since = watermark - timedelta(seconds=REPORT_REFRESH_OVERLAP)
+            touched = touched.filter(or_(Reservation.date_created >= since, Reservation.date_last_update >= since))
+        days = [_as_date(value) for value, in touched]
+
+        aggregates = select(
+            day,
+            func.count(),
+            func.sum(case((Reservation.status == CANCELLED, 1), else_=0)),
+            func.coalesce(func.sum(case(
+                (Reservation.status != CANCELLED,
+                 seconds_between(Reservation.reservation_start_date, Reservation.reservation_end_date) / 3600),
+                else_=0)), 0),
+            literal(now),
+        ).group_by(day)
+        if full:
+            db.session.execute(summary.delete())
+        elif days:
+            db.session.execute(summary.delete().where(summary.c.day.in_(days)))
+            aggregates = aggregates.where(day.in_(days))
+
+        if full or days:
+            db.session.execute(summary.insert().from_select(
+                ['day', 'reservations', 'cancellations', 'rental_hours', 'refreshed_at'], aggregates))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # refreshed at the same time by another process
+            db.session.rollback()
+
+    _last_refresh.update(time=time.monotonic(), watermark=now)
+    return len(days)
+
+
+def refresh_if_stale():
+    if _last_refresh['time'] is None or time.monotonic() - _last_refresh['time'] > REPORT_REFRESH_INTERVAL:
+        refresh_daily_summary()
+
+
+def daily_reservations(start, end):
+    """
+    summary rows of the days of [start, end]
+    """
+    rows = db.session.query(ReservationDailySummary).filter(
+        ReservationDailySummary.day.between(start, end)
+    ).order_by(ReservationDailySummary.day)
+    return [
+        {'day': row.day.isoformat(), 'reservations': row.reservations, 'cancellations': row.cancellations,
+         'rental_hours': round(row.rental_hours, 2)}
+        for row in rows
+    ]
+
+
+def reservations_summary(start, end):
+    """
+    cancellation rate and average rental duration (in hours) of the reservations created during [start, end]
+    """
+    reservations, cancellations, rental_hours = db.session.query(
+        func.coalesce(func.sum(ReservationDailySummary.reservations), 0),
+        func.coalesce(func.sum(ReservationDailySummary.cancellations), 0),
+        func.coalesce(func.sum(ReservationDailySummary.rental_hours), 0),
+    ).filter(ReservationDailySummary.day.between(start, end)).one()
+
+    rentals = reservations - cancellations
+    return {
+        'reservations': reservations,
+        'cancellations': cancellations,
+        'cancellation_rate': round(cancellations / reservations, 4) if reservations else None,
+        'average_rental_hours': round(rental_hours / rentals, 2) if rentals else None,
+    }
+
+
+def car_utilisation(start, end, limit, offset=0):
+    """
+    share of [start, end) during which each car was rented (reservations not cancelled, clipped to the window),
+    most used cars first
+    """
+    window_start = datetime.combine(start, datetime.min.time())
+    window_end = datetime.combine(end, datetime.min.time()) + timedelta(days=1)
+    window_seconds = (window_end - window_start).total_seconds()
+
+    rented_seconds = func.coalesce(func.sum(seconds_between(
+        greatest(Reservation.reservation_start_date, window_start),
+        least(Reservation.reservation_end_date, window_end),
+    )), 0)
+    rows = db.session.query(Car.id, Car.license_plate, rented_seconds.label('rented_seconds')).outerjoin(
+        Reservation,
+        (Reservation.car_id == Car.id) & (Reservation.status != CANCELLED)
+        & (Reservation.reservation_start_date < window_end) & (Reservation.reservation_end_date > window_start),
+    ).group_by(Car.id, Car.license_plate).order_by(rented_seconds.desc(), Car.id).limit(limit).offset(offset)
+
+    return [
+        {'car_id': car_id, 'license_plate': license_plate, 'rental_hours': round(seconds / 3600, 2),
+         'utilisation': round(seconds / window_seconds, 4)}
+        for car_id, license_plate, seconds in rows
+    ]
@@ -0,0 +1,300 @@
+"""
+Declarative validation of the request bodies and query strings.
+
+A Schema maps field names to Fields (type, required or default, datetime format, checks) plus rules
+on several fields. It is compiled once, when the route is declared, into a validator function: the
+per-field work is picked at compile time and the datetime formats are turned into regular expressions,
+so a request only runs the parsing of its values. Every field is validated, all the errors are reported
+in one 400 response: {"message": "Invalid field(s): [...]", "data": {"errors": {field: error}}}.
+
+    LOGIN = Schema({'username': Field(str, required=True), 'password': Field(str, required=True)})
+
+    @bp.route('/login', methods=['POST'])
+    @validated(LOGIN)
+    def login():
+        request.validated['username']
+
+validated (async_validated for rent_cars.asgi) is the single decorator of the routes: it validates the
+request with the schema, if any, and answers every CustomException raised by the view with its status.
+"""
+import re
+from datetime import date, datetime
+
+import werkzeug.exceptions
+from flask import request
+
+from rent_cars import db
+from .accounts import current_user
+from .custom_exceptions import CustomException
+from .formatter import response
+
+_MISSING = object()
+
+# strptime directives parsed by the compiled datetime fields, others fall back to strptime
+_DIRECTIVES = {'%Y': ('year', r'(\d{4})'), '%m': ('month', r'(\d{1,2})'), '%d': ('day', r'(\d{1,2})'),
+               '%H': ('hour', r'(\d{1,2})'), '%M': ('minute', r'(\d{1,2})'), '%S': ('second', r'(\d{1,2})')}
+_DATETIME_ARGS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+_TYPE_NAMES = {str: 'str', int: 'int', float: 'number', bool: 'bool', list: 'list', dict: 'object'}
+
+
+class ValidationError(CustomException):
+    def __init__(self, errors, status_code=400):
+        super().__init__(f'Invalid field(s): {list(errors)}', status_code)
+        self.errors = errors
+
+
+class FieldError(ValueError):
+    def __init__(self, error):
+        # a message, or the errors of the fields of a nested schema
+        self.error = error
+
+
+class Field:
+    def __init__(self, type=str, required=False, default=None, format='%Y-%m-%d', checks=(), items=None):
+        """
+        type: str, int, float, bool, datetime or date (parsed with format), list (of items, a Schema)
+        checks: (predicate, message) tried in order on the parsed value
+        """
+        self.type = type
+        self.required = required
+        self.default = default
+        self.format = format
+        self.checks = tuple(checks)
+        self.items = items
+
+
+class Schema:
+    def __init__(self, fields, source='json', rules=()):
+        """
+        source: 'json' body or query string 'args' (values are strings converted to the field types)
+        rules: functions of the valid values, returning (field, message) on error. They may add derived
+        values and only run when every field is valid
+        """
+        self.fields = fields
+        self.source = source
+        self.rules = tuple(rules)
+
+
+def _datetime_parser(field_format):
+    names, pattern = [], ''
+    for part in re.split(r'(%.)', field_format):
+        if part in _DIRECTIVES:
+            name, group = _DIRECTIVES[part]
+            names.append(name)
+            pattern += group
+        elif part.startswith('%') and len(part) == 2:
+            return lambda value: datetime.strptime(value, field_format)
+        else:
+            pattern += re.escape(part)
+    match = re.compile(pattern).fullmatch
+
+    if tuple(names) == _DATETIME_ARGS[:len(names)]:
+        # e.g. %Y-%m-%d %H:%M, the groups are the positional arguments of datetime
+        def parse(value):
+            found = match(value)
+            if found is None:
+                raise ValueError(value)
+            return datetime(*map(int, found.groups()))
+    else:
+        def parse(value):
+            found = match(value)
+            if found is None:
+                raise ValueError(value)
+            return datetime(**dict(zip(names, map(int, found.groups()))))
+
+    return parse
+
+
+def _compile_field(field, source):
+    """
+    returns parse(value): the valid value, converted, raises FieldError
+    """
+    checks = field.checks
+    if field.type in (datetime, date):
+        parse_datetime = _datetime_parser(field.format)
+        type_error = f'Format of datetime is wrong. Accepted format: {field.format}'
+        as_date = field.type is date
+
+        def convert(value):
+            try:
+                value = parse_datetime(value)
+            except (TypeError, ValueError):
+                raise FieldError(type_error)
+            return value.date() if as_date else value
+    elif field.type is list:
+        validate_item = compile_schema(field.items) if field.items else None
+        type_error = 'should be of type list'
+
+        def convert(value):
+            if not isinstance(value, list):
+                raise FieldError(type_error)
+            if validate_item is None:
+                return value
+            items, errors = [], {}
+            for index, item in enumerate(value):
+                try:
+                    items.append(validate_item(item))
+                except ValidationError as e:
+                    errors.update({f'{index}.{name}': error for name, error in e.errors.items()})
+            if errors:
+                raise FieldError(errors)
+            return items
+    else:
+        target = field.type
+        expected = (int, float) if target is float else target
+        type_error = f'should be of type {_TYPE_NAMES.get(target, target.__name__)}'
+        strict = target is not bool and target is not str
+
+        if source == 'args' and target is bool:
+            # query string values are strings
+            def convert(value):
+                if value not in ('true', 'false'):
+                    raise FieldError(type_error)
+                return value == 'true'
+        elif source == 'args' and target is not str:
+            def convert(value):
+                try:
+                    return target(value)
+                except ValueError:
+                    raise FieldError(type_error)
+        else:
+            def convert(value):
+                # bool is an int for isinstance, not for the schemas
+                if not isinstance(value, expected) or (strict and (value is True or value is False)):
+                    raise FieldError(type_error)
+                return value
+
+    if not checks:
+        return convert
+    if len(checks) == 1:
+        (predicate, message), = checks
+
+        def parse(value):
+            value = convert(value)
+            if not predicate(value):
+                raise FieldError(message)
+            return value
+
+        return parse
+
+    def parse(value):
+        value = convert(value)
+        for predicate, message in checks:
+            if not predicate(value):
+                raise FieldError(message)
+        return value
+
+    return parse
+
+
+def compile_schema(schema):
+    """
+    returns the validator of schema: validate(data) returns the valid values of the declared fields,
+    raises ValidationError with the errors of every field
+    """
+    fields = tuple((name, field.required, field.default, _compile_field(field, schema.source))
+                   for name, field in schema.fields.items())
+    rules = schema.rules
+
+    def validate(data):
+        if not isinstance(data, dict) and schema.source == 'json':
+            raise ValidationError({'body': 'should be a JSON object'})
+        values, errors = {}, {}
+        for name, required, default, parse in fields:
+            value = data.get(name, _MISSING)
+            if value is _MISSING:
+                if required:
+                    errors[name] = 'Mandatory field missing'
+                elif default is not None:
+                    values[name] = default
+                continue
+            try:
+                values[name] = parse(value)
+            except FieldError as e:
+                if isinstance(e.error, dict):
+                    errors.update({f'{name}.{key}': error for key, error in e.error.items()})
+                else:
+                    errors[name] = e.error
+        if not errors:
+            for rule in rules:
+                error = rule(values)
+                if error:
+                    errors[error[0]] = error[1]
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+    return validate
+
+
+def error_response(e):
+    return response(e.message, e.status_code, data={'errors': e.errors} if isinstance(e, ValidationError) else None)
+
+
+def _request_data(req, source):
+    if source == 'args':
+        return req.args
+    try:
+        body = req.json
+    except werkzeug.exceptions.BadRequest:
+        body = None
+    # a missing body is an empty one: its mandatory fields are reported
+    return {} if body is None else body
+
+
+def _validator(schema, methods, admin_schema):
+    if schema is None:
+        return lambda req, is_admin: None
+    validators = {False: compile_schema(schema), True: compile_schema(admin_schema or schema)}
+
+    def run(req, is_admin):
+        if methods and req.method not in methods:
+            req.validated = None
+        else:
+            validate = validators[bool(admin_schema and is_admin)]
+            req.validated = validate(_request_data(req, schema.source))
+
+    return run
+
+
+def validated(schema=None, methods=None, admin_schema=None):
+    """
+    validate the requests (of methods only, if given) with schema, or admin_schema for the admin users,
+    the values are set in request.validated. The CustomExceptions raised by the validation or the view
+    are answered with their status, the transaction is rolled back
+    """
+    run = _validator(schema, methods, admin_schema)
+
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            try:
+                run(request, admin_schema and (current_user() or {}).get('is_admin'))
+                return f(*args, **kwargs)
+            except CustomException as e:
+                db.session.rollback()
+                return error_response(e)
+        wrapper.__name__ = f.__name__
+
+        return wrapper
+
+    return decorator
+
+
+def async_validated(schema=None, methods=None, admin_schema=None):
+    """
+    validated of the async endpoints (rent_cars.asgi), their sessions are rolled back when closed
+    """
+    run = _validator(schema, methods, admin_schema)
+
+    def decorator(f):
+        async def wrapper(request, **kwargs):
+            try:
+                run(request, (request.user or {}).get('is_admin'))
+                return await f(request, **kwargs)
+            except CustomException as e:
+                return error_response(e)
+        wrapper.__name__ = f.__name__
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,96 @@
+"""
+JSON serialization of the dataclass models.
+
+Each model gets its field-to-JSON encoder compiled once (on first use), a whole response
+is then converted to plain python types and dumped in a single pass.
+orjson is used as backend when installed, the standard json module otherwise.
+"""
+import dataclasses
+import enum
+import json
+from datetime import datetime
+
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PLAIN_TYPES = (str, int, float, bool)
+
+_encoders = {}
+
+
+def _encode_datetime(value):
+    # same format as flask's jsonify, so clients see no difference
+    return http_date(value) if isinstance(value, datetime) else value
+
+
+def _compile_encoder(model):
+    plain_fields = []
+    converted_fields = []
+    for field in dataclasses.fields(model):
+        if field.type in PLAIN_TYPES:
+            plain_fields.append(field.name)
+        elif field.type is datetime:
+            converted_fields.append((field.name, _encode_datetime))
+        else:
+            converted_fields.append((field.name, serialize))
+
+    def encode(instance):
+        row = {name: getattr(instance, name) for name in plain_fields}
+        for name, converter in converted_fields:
+            row[name] = converter(getattr(instance, name))
+        return row
+
+    _encoders[model] = encode
+    return encode
+
+
+def get_encoder(model):
+    return _encoders.get(model) or _compile_encoder(model)
+
+
+def serialize(value):
+    """
+    convert models (and containers of models) to JSON compatible python types
+    """
+    if value is None or isinstance(value, PLAIN_TYPES):
+        return value
+
+    encoder = _encoders.get(type(value))
+    if encoder:
+        return encoder(value)
+    if dataclasses.is_dataclass(value):
+        return _compile_encoder(type(value))(value)
+
+    if isinstance(value, (list, tuple)):
+        return serialize_rows(value)
+    if isinstance(value, dict):
+        return {key: serialize(item) for key, item in value.items()}
+    if isinstance(value, datetime):
+        return _encode_datetime(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+
+    return value
+
+
+def serialize_rows(rows):
+    if not rows:
+        return []
+
+    # rows of a page are usually of the same model, look its encoder up once
+    model = type(rows[0])
+    if dataclasses.is_dataclass(model):
+        encoder = get_encoder(model)
+        return [encoder(row) if type(row) is model else serialize(row) for row in rows]
+
+    return [serialize(row) for row in rows]
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
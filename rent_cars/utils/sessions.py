@@ -0,0 +1,165 @@
+"""
+Server side sessions: the cookie only holds a random session id, the session data is kept in a store
+(SESSION_BACKEND):
+- memory: in-process LRU, fastest, sessions are not shared between processes and are lost on restart.
+  The app must be served by a single process: refused with several ASGI workers
+- database: user_session table, shared by every process serving the app
+
+The session only holds the id of the logged in user, its principal (id, is_admin) is read apart
+(see utils/accounts.py) so changes of the user apply to its sessions at once: cached with the memory
+sessions, read on every request with the database sessions.
+A session is written back only when it was modified.
+"""
+import json
+import secrets
+import time
+from datetime import datetime, timedelta
+
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import select
+from werkzeug.datastructures import CallbackDict
+
+from rent_cars.config import SESSION_BACKEND, SESSION_MAX_ENTRIES, SESSION_PURGE_INTERVAL
+from rent_cars.models import UserSession
+from .cache import LRUBackend
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def rotate(self):
+        """
+        new id for the same data, done at login so a session id known before the login can't be reused
+        """
+        if not self.new:
+            self.previous_sid = self.previous_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class SessionStore:
+    def get(self, sid):
+        raise NotImplementedError
+
+    def set(self, sid, data, ttl):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES):
+        self.entries = LRUBackend(max_entries)
+
+    def get(self, sid):
+        return self.entries.get(sid)
+
+    def set(self, sid, data, ttl):
+        self.entries.set(sid, data, ttl)
+
+    def delete(self, sid):
+        self.entries.delete(sid)
+
+
+class DatabaseSessionStore(SessionStore):
+    """
+    sessions are read and written on their own connection, outside of the transaction of the request
+    """
+    def __init__(self, db, purge_interval=SESSION_PURGE_INTERVAL):
+        self.db = db
+        self.table = UserSession.__table__
+        self.purge_interval = purge_interval
+        self._next_purge = 0
+
+    def get(self, sid):
+        with self.db.engine.connect() as connection:
+            data = connection.execute(
+                select(self.table.c.data).where(
+                    self.table.c.sid == sid, self.table.c.expires_at > datetime.utcnow())
+            ).scalar()
+        return json.loads(data) if data is not None else None
+
+    def set(self, sid, data, ttl):
+        values = {'data': json.dumps(data), 'expires_at': datetime.utcnow() + timedelta(seconds=ttl)}
+        with self.db.engine.begin() as connection:
+            updated = connection.execute(self.table.update().where(self.table.c.sid == sid).values(**values))
+            if not updated.rowcount:
+                connection.execute(self.table.insert().values(sid=sid, **values))
+        self._purge()
+
+    def delete(self, sid):
+        with self.db.engine.begin() as connection:
+            connection.execute(self.table.delete().where(self.table.c.sid == sid))
+
+    def _purge(self):
+        # expired sessions are never read, they are deleted from time to time
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self.purge_interval
+        with self.db.engine.begin() as connection:
+            connection.execute(self.table.delete().where(self.table.c.expires_at <= datetime.utcnow()))
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.store.set(session.sid, dict(session), int(app.permanent_session_lifetime.total_seconds()))
+        if session.modified or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def check_session_backend(processes):
+    """
+    refuse to serve the app from several processes with the memory sessions, each process would only know
+    the sessions it created
+    """
+    if processes > 1 and SESSION_BACKEND != 'database':
+        raise RuntimeError(f'{processes} processes need SESSION_BACKEND=database, '
+                           f'the {SESSION_BACKEND} sessions are not shared between processes')
+
+
+def init_sessions(app, db):
+    store = DatabaseSessionStore(db) if SESSION_BACKEND == 'database' else MemorySessionStore()
+    app.session_interface = ServerSideSessionInterface(store)
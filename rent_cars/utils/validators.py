@@ -1,146 +1,204 @@
-import werkzeug.exceptions
-from flask import session
-
-from .custom_exceptions import MissingMandatoryFields, PasswordsNotMatching, WrongFormat, InputNotAcceptable, \
-    RecordAlreadyExists, WrongType, RecordNotFound
-from datetime import datetime
-from rent_cars.models import User, License, Car
-
-
-class BaseValidator:
-    mandatory_fields = []
-    optional_fields = {}
-
-    def __init__(self, request):
-        try:
-            self.body = request.json
-        except werkzeug.exceptions.BadRequest:
-            self.body = {}
-
-    @staticmethod
-    def _validate_field_uniqueness(model, field_name, field_value):
-        if model.query.filter_by(**{field_name: field_value}).first():
-            raise RecordAlreadyExists(
-                f"{field_name} already exists"
-            )
-
-    def _validate_fields(self):
-        missing_fields = [field for field in self.mandatory_fields if field not in self.body]
-        if missing_fields:
-            raise MissingMandatoryFields(
-                f'Mandatory field(s) Missing: {missing_fields}'
-            )
-
-    def _validate_fields_content_type(self):
-        wrong_types = [
-            f"{field_name} should be of type {field_data['type']}"
-            for field_name, field_data in self.optional_fields.items()
-            if not isinstance(field_data['value'], field_data['type'])
-        ]
-
-        if wrong_types:
-            raise WrongType(f'The type of values of some fields is wrong. {wrong_types}')
-
-    @staticmethod
-    def _validate_datetime_field(field_value, field_format='%Y-%m-%d'):
-        try:
-            datetime_obj = datetime.strptime(field_value, field_format)
-        except ValueError:
-            raise WrongFormat(f"Format of datetime is wrong. Accepted format: {field_format}")
-
-        return datetime_obj
-
-
-class AccountsValidator(BaseValidator):
-    def registration(self):
-        self.mandatory_fields = ['username', 'email', 'password1', 'password2', 'license_number',
-                                 'date_issued', 'date_expiry']
-        self._validate_fields()
-        self._validate_field_uniqueness(User, 'email', self.body['email'])
-        self._validate_license_info()
-
-        return self.mandatory_fields
-
-    def login(self):
-        self.mandatory_fields = ['username', 'password']
-        self._validate_fields()
-
-    def update_user(self):
-        is_admin = session['user']['is_admin']
-        self.optional_fields = {
-            'username': {'type': str, 'value': self.body.get('username')},
-            'password': {'type': str, 'value': self.body.get('password')}
-        }
-        if is_admin:
-            self.optional_fields['is_admin'] = {'type': bool, 'value': self.body.get('is_admin')}
-
-        self._validate_fields_content_type()
-
-        self._validate_field_uniqueness(User, 'username', self.optional_fields['username']['value'])
-
-        return self.optional_fields
-
-    def _validate_license_info(self):
-        # license number is alphanumeric of length (12 or 9)
-        license_number = self.body['license_number']
-        if len(license_number) not in [12, 9] or not license_number.isalnum():
-            raise WrongFormat('License number is not valid')
-
-        # license dates are of format YYYY-MM-DD
-        _ = self._validate_datetime_field(self.body['date_issued'])
-        d_expiry = self._validate_datetime_field(self.body['date_expiry'])
-
-        # license that expires in less than 90 days won't be accepted
-        today = datetime.today()
-        if (d_expiry - today).days < 90:
-            raise InputNotAcceptable(
-                "License will expire in less than 90 days"
-            )
-
-        # validate uniqueness of license_number
-        self._validate_field_uniqueness(License, field_name='license_number', field_value=self.body['license_number'])
-
-    def _validate_password(self):
-        if self.body['password1'] != self.body['password2']:
-            raise PasswordsNotMatching("Passwords don't matching")
-
-
-class CarsValidator(BaseValidator):
-    def add_car(self):
-        body = self.body
-        self.mandatory_fields = ['license_plate', 'company', 'model', 'fabrication_year', 'number_of_seats']
-        self._validate_fields()
-        self._validate_field_uniqueness(Car, 'license_plate', body['license_plate'])
-
-        return self.mandatory_fields
-
-    def update_car(self):
-        self.optional_fields = {
-            'license_plate': {'type': str, 'value': self.body.get('license_plate')},
-            'company': {'type': str, 'value': self.body.get('company')},
-            'model': {'type': str, 'value': self.body.get('model')},
-            'fabrication_year': {'type': str, 'value': self.body.get('fabrication_year')},
-            'number_of_seats': {'type': int, 'value': self.body.get('number_of_seats')},
-        }
-
-        if session['user']['is_admin']:
-            self.optional_fields['is_available'] = {'type': bool, 'value': self.body.get('is_available')}
-
-        self._validate_fields_content_type()
-
-
-class ReservationsValidator(BaseValidator):
-    def add_reservation(self):
-        self.mandatory_fields = ['car_id', 'reservation_start_date', 'reservation_end_date']
-        self._validate_fields()
-        self._validate_car_existence()
-        self._validate_datetime_field(self.body['reservation_start_date'], '%Y-%m-%d %H:%M')
-        self._validate_datetime_field(self.body['reservation_end_date'], '%Y-%m-%d %H:%M')
-
-        return self.mandatory_fields
-
-    def _validate_car_existence(self):
-        car_id = self.body.get('car_id')
-        car = Car.query.filter_by(id=car_id).first()
-        if not car:
-            raise RecordNotFound(f'Car {car_id} not found')
+"""
+Schemas of the request bodies and query strings (see utils/schema.py), and the checks that need the database.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import exists, select
+
+from rent_cars import db
+from rent_cars.models import User, License, Car, Reservation
+from rent_cars.config import NEARBY_DEFAULT_RADIUS, NEARBY_MAX_RADIUS, REPORT_DEFAULT_DAYS, REPORT_MAX_DAYS
+from .conditional import touch
+from .custom_exceptions import RecordAlreadyExists, RecordNotFound, RecordConflict
+from .schema import Schema, Field
+
+RESERVATION_DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def _end_after_start(start, end, message):
+    def rule(values):
+        if values[end] <= values[start]:
+            return end, message
+
+    return rule
+
+
+def _passwords_matching(values):
+    if values['password1'] != values['password2']:
+        return 'password2', "Passwords don't matching"
+
+
+def _report_window(values):
+    """
+    days of the report, start and end (YYYY-MM-DD) are included, by default the last REPORT_DEFAULT_DAYS days
+    """
+    end = values.setdefault('end', datetime.utcnow().date())
+    start = values.setdefault('start', end - timedelta(days=REPORT_DEFAULT_DAYS - 1))
+    if end < start:
+        return 'end', 'end should not be before start'
+    if (end - start).days >= REPORT_MAX_DAYS:
+        return 'end', f'a report covers at most {REPORT_MAX_DAYS} days'
+
+
+# license number is alphanumeric of length (12 or 9)
+LICENSE_NUMBER = Field(str, required=True, checks=[
+    (lambda value: len(value) in (12, 9) and value.isalnum(), 'License number is not valid'),
+])
+# license that expires in less than 90 days won't be accepted
+LICENSE_EXPIRY = Field(datetime, required=True, checks=[
+    (lambda value: (value - datetime.today()).days >= 90, 'License will expire in less than 90 days'),
+])
+LATITUDE_CHECK = (lambda value: -90 <= value <= 90, 'latitude should be between -90 and 90')
+LONGITUDE_CHECK = (lambda value: -180 <= value <= 180, 'longitude should be between -180 and 180')
+
+LOGIN = Schema({
+    'username': Field(str, required=True),
+    'password': Field(str, required=True),
+})
+
+# the uniqueness of username, email and license number is left to the unique constraints,
+# registration_conflicts() tells which of them failed
+REGISTRATION = Schema({
+    'username': Field(str, required=True),
+    'email': Field(str, required=True),
+    'password1': Field(str, required=True),
+    'password2': Field(str, required=True),
+    'license_number': LICENSE_NUMBER,
+    'date_issued': Field(datetime, required=True),
+    'date_expiry': LICENSE_EXPIRY,
+}, rules=[_passwords_matching])
+
+USER_UPDATE = Schema({
+    'username': Field(str),
+    'password': Field(str),
+})
+USER_UPDATE_ADMIN = Schema(dict(USER_UPDATE.fields, is_admin=Field(bool)))
+
+CAR = Schema({
+    'license_plate': Field(str, required=True),
+    'company': Field(str, required=True),
+    'model': Field(str, required=True),
+    'fabrication_year': Field(str, required=True),
+    'number_of_seats': Field(int, required=True),
+})
+
+CAR_UPDATE = Schema({name: Field(field.type) for name, field in CAR.fields.items()})
+CAR_UPDATE_ADMIN = Schema(dict(CAR_UPDATE.fields, is_available=Field(bool)))
+
+AVAILABILITY_WINDOW = Schema({
+    'start': Field(datetime, required=True, format=RESERVATION_DATE_FORMAT),
+    'end': Field(datetime, required=True, format=RESERVATION_DATE_FORMAT),
+}, source='args', rules=[_end_after_start('start', 'end', 'end should be after start')])
+
+NEARBY_SEARCH = Schema({
+    'lat': Field(float, required=True, checks=[LATITUDE_CHECK]),
+    'lon': Field(float, required=True, checks=[LONGITUDE_CHECK]),
+    'radius': Field(float, default=NEARBY_DEFAULT_RADIUS, checks=[
+        (lambda value: 0 < value <= NEARBY_MAX_RADIUS,
+         f'radius should be greater than 0 and at most {NEARBY_MAX_RADIUS} km'),
+    ]),
+}, source='args')
+
+# {"locations": [{"car_id": 1, "latitude": 48.8, "longitude": 2.3}, ...]}
+BULK_LOCATIONS = Schema({
+    'locations': Field(list, required=True, checks=[(bool, 'should not be empty')], items=Schema({
+        'car_id': Field(int, required=True),
+        'latitude': Field(float, required=True, checks=[LATITUDE_CHECK]),
+        'longitude': Field(float, required=True, checks=[LONGITUDE_CHECK]),
+    })),
+})
+
+RESERVATION = Schema({
+    'car_id': Field(int, required=True),
+    'reservation_start_date': Field(datetime, required=True, format=RESERVATION_DATE_FORMAT),
+    'reservation_end_date': Field(datetime, required=True, format=RESERVATION_DATE_FORMAT),
+}, rules=[_end_after_start('reservation_start_date', 'reservation_end_date',
+                           'reservation_end_date should be after reservation_start_date')])
+
+REPORT_WINDOW = Schema({
+    'start': Field(date),
+    'end': Field(date),
+}, source='args', rules=[_report_window])
+
+
+def validate_uniqueness(*checks):
+    """
+    checks are (model, field_name, field_value), all of them are answered by a single
+    SELECT EXISTS(...), EXISTS(...) round-trip. None values are not checked.
+    """
+    checks = [(model, field_name, field_value) for model, field_name, field_value in checks
+              if field_value is not None]
+    if not checks:
+        return
+
+    row = db.session.query(*[
+        exists().where(getattr(model, field_name) == field_value).label(field_name)
+        for model, field_name, field_value in checks
+    ]).one()
+    existing_fields = [field_name for (_, field_name, _), found in zip(checks, row) if found]
+    if existing_fields:
+        raise RecordAlreadyExists(
+            f"{', '.join(existing_fields)} already exists"
+        )
+
+
+def registration_conflicts(values):
+    validate_uniqueness(
+        (User, 'username', values['username']),
+        (User, 'email', values['email']),
+        (License, 'license_number', values['license_number']),
+    )
+
+
+def check_cars_exist(car_ids):
+    """
+    all the cars are checked with a single query
+    """
+    existing_ids = {car_id for car_id, in Car.query.with_entities(Car.id).filter(Car.id.in_(car_ids))}
+    missing_ids = sorted(set(car_ids) - existing_ids)
+    if missing_ids:
+        raise RecordNotFound(f'Car(s) not found: {missing_ids}', 404)
+
+
+def reservation_overlaps(start, end):
+    """
+    criteria of the active reservations overlapping the period [start, end)
+    """
+    return (Reservation.status == Reservation.ReservationStatus.reserved,
+            Reservation.reservation_start_date < end, Reservation.reservation_end_date > start)
+
+
+def overlapping_reservation(car_id, start, end):
+    return select(Reservation.id).filter(Reservation.car_id == car_id, *reservation_overlaps(start, end)).limit(1)
+
+
+def check_car_availability(car, car_id):
+    """
+    the car exists and is in service (not disabled by an admin)
+    """
+    if not car:
+        raise RecordNotFound(f'Car {car_id} not found', 404)
+    if not car.is_available:
+        raise RecordConflict(f'Car {car_id} is not available')
+
+
+def check_no_overlap(reservation_id, car_id):
+    """
+    reservation_id is the result of overlapping_reservation, read once the car row is written: concurrent
+    bookings of the car wait for the first one to commit and then see its reservation
+    """
+    if reservation_id is not None:
+        raise RecordConflict(f'Car {car_id} is already reserved for this period')
+
+
+def lock_available_car(car_id, start, end):
+    """
+    the car to book for [start, end), locked until the end of the transaction: done last in the booking validation.
+    The car row is written (the reservation is part of its details) before the overlap check: the row lock
+    (the database lock on sqlite, which ignores FOR UPDATE) serializes the bookings of the car
+    """
+    car = Car.query.filter_by(id=car_id).with_for_update().first()
+    check_car_availability(car, car_id)
+    db.session.execute(touch(Car, car_id))
+    check_no_overlap(db.session.execute(overlapping_reservation(car_id, start, end)).scalar(), car_id)
+    return car
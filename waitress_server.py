@@ -1,3 +1,4 @@
 from waitress import serve
 import app
-serve(app.app, host='0.0.0.0', port=8080)
+from rent_cars.config import WAITRESS_THREADS
+serve(app.app, host='0.0.0.0', port=8080, threads=WAITRESS_THREADS)